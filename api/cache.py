@@ -0,0 +1,146 @@
+"""Cache das respostas de leitura.
+
+Uma atualizacao finalizada não muda mais, então a resposta de uma leitura sobre ela
+pode ser guardada já renderizada, com chave (caminho, pk da atualizacao, query string).
+As próximas leituras iguais saem do cache sem passar pelo ORM nem pelo serializer, e
+o ETag forte permite ao cliente revalidar com If-None-Match e receber 304.
+
+O cache usado é o alias "respostas" de settings.CACHES, por padrão um ArquivosLimitados:
+arquivos num diretório compartilhado por todos os processos da máquina que usam o mesmo banco,
+limitado pelo total de bytes. Cada atualizacao tem uma geração que faz parte da chave e fica no mesmo cache;
+invalidar() troca a geração e as entradas antigas deixam de ser encontradas em todos os
+processos que usam o cache.
+"""
+import hashlib
+import json
+import os
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.http import HttpResponse
+from rest_framework import status as http_status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from api.models import Atualizacao
+
+ALIAS = "respostas"
+
+
+class ArquivosLimitados(FileBasedCache):
+    """FileBasedCache que, além do MAX_ENTRIES, limita o total de bytes em disco a
+    settings.CACHE_RESPOSTAS_TOTAL_BYTES: depois de cada gravação, os arquivos mais antigos
+    são removidos até o total caber no limite."""
+
+    def set(self, key, value, timeout = DEFAULT_TIMEOUT, version = None):
+        super().set(key, value, timeout, version)
+        self._limitar()
+
+    def _limitar(self):
+        limite = getattr(settings, "CACHE_RESPOSTAS_TOTAL_BYTES", 512 * 1024 * 1024)
+        arquivos = []
+        for nome in self._list_cache_files():
+            try:
+                info = os.stat(nome)
+            except FileNotFoundError:
+                #removido por outro processo
+                continue
+            arquivos.append((info.st_mtime_ns, info.st_size, nome))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, nome in sorted(arquivos):
+            if total <= limite:
+                break
+            self._delete(nome)
+            total -= tamanho
+
+
+def cache():
+    return caches[ALIAS]
+
+
+def limpar(plan = None, **kwargs):
+    """Descarta todo o cache. Ligado ao post_migrate: o cache sobrevive ao banco e, com o
+    banco recriado, os pks das atualizacoes (e as chaves) voltariam a se repetir.
+    Um migrate que não aplicou nenhuma migração deixa o cache como está."""
+    if plan is not None and not plan:
+        return
+    cache().clear()
+
+
+def geracao(pk:int) -> str:
+    chave = f"geracao:{pk}"
+    valor = cache().get(chave)
+    if valor is None:
+        #add não sobrescreve se outra requisição criou a geração ao mesmo tempo
+        cache().add(chave, uuid.uuid4().hex, timeout = None)
+        valor = cache().get(chave)
+    return valor
+
+
+def invalidar(pk:int):
+    """Descarta as respostas em cache da atualizacao."""
+    cache().delete(f"geracao:{pk}")
+
+
+def chave(request, pk:int) -> str:
+    params = sorted((nome, valor) for nome, valores in request.query_params.lists() for valor in valores)
+    consulta = hashlib.sha256(json.dumps([request.path, params]).encode()).hexdigest()
+    return f"resposta:{pk}:{geracao(pk)}:{consulta}"
+
+
+def etag(corpo:bytes) -> str:
+    return '"' + hashlib.sha256(corpo).hexdigest()[:32] + '"'
+
+
+def nao_modificado(request, valor:str) -> bool:
+    return valor in [e.strip() for e in request.headers.get("If-None-Match", "").split(",")]
+
+
+def sucesso(atualizacao:Atualizacao) -> bool:
+    return atualizacao.status == "SUCESSO"
+
+
+def em_cache(imutavel = sucesso):
+    """Decorator das views de leitura com a atualizacao em pk_atualizacao (ou pk).
+    Só guarda respostas 200 de atualizacoes para as quais imutavel(atualizacao) é verdadeiro;
+    streaming e a listagem da própria tabela Atualizacao ficam de fora."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            pk = kwargs.get("pk_atualizacao", kwargs.get("pk"))
+            if str(kwargs.get("table", "")).lower() == "atualizacao" or request.query_params.get("stream") in ("true", "1"):
+                return view(request, *args, **kwargs)
+
+            key = chave(request, pk)
+            entrada = cache().get(key)
+            if entrada is not None:
+                if nao_modificado(request, entrada["etag"]):
+                    return HttpResponse(status = http_status.HTTP_304_NOT_MODIFIED, headers = {"ETag": entrada["etag"]})
+                if request.accepted_renderer.format == "json":
+                    response = HttpResponse(entrada["corpo"], content_type = "application/json")
+                else:
+                    response = Response(json.loads(entrada["corpo"]))
+                response["ETag"] = entrada["etag"]
+                return response
+
+            #lida antes da view: se a atualizacao terminar no meio dela, a resposta não vai para o cache
+            atualizacao = Atualizacao.objects.filter(pk = pk).first()
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or not isinstance(response, Response):
+                return response
+            if atualizacao is None or not imutavel(atualizacao):
+                return response
+
+            corpo = JSONRenderer().render(response.data)
+            response["ETag"] = etag(corpo)
+            if len(corpo) <= getattr(settings, "CACHE_RESPOSTA_MAX_BYTES", 32 * 1024 * 1024):
+                cache().set(key, {"etag": response["ETag"], "corpo": corpo}, timeout = None)
+            if nao_modificado(request, response["ETag"]):
+                return HttpResponse(status = http_status.HTTP_304_NOT_MODIFIED, headers = {"ETag": response["ETag"]})
+            return response
+        return wrapper
+    return decorator
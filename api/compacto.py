@@ -0,0 +1,161 @@
+"""Leitura das atualizacoes gravadas com armazenamento compacto (SerieCompacta).
+
+Cada SerieCompacta guarda uma linha do CSV com os valores de todos os anos num campo binário.
+Os filtros de dimensão são aplicados no banco, sobre as séries; os de ano, ao desempacotar.
+As séries de um bloco são desempacotadas de uma vez com numpy e viram as mesmas linhas
+(entidade, ano) das tabelas de dados, no formato do listar-tabela, do agregar e do exportar.
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from django.db import models
+
+from api import serializer
+from api.filters import dimensao_do_model, condicoes, ordenar, parametros_agregacao
+from api.models import SerieCompacta
+from api.serializer import leitura_rapida
+
+#funcao do agregar: método do groupby do pandas
+FUNCOES = {
+    "sum": "sum",
+    "avg": "mean",
+    "min": "min",
+    "max": "max",
+    "count": "count"
+}
+
+
+class ConsultaCompacta:
+    """Recorte de uma tabela numa atualizacao compacta: as séries, já filtradas pelas dimensões
+    e na ordem do id, e os filtros de ano ({lookup: valor}) aplicados ao desempacotar."""
+
+    def __init__(self, model, series, anos:dict):
+        self.model = model
+        self.series = series
+        self.anos = anos
+
+    def apos(self, cursor:int, limit:int):
+        """As limit primeiras séries com id maior que cursor."""
+        return ConsultaCompacta(self.model, self.series.filter(pk__gt = cursor)[:limit], self.anos)
+
+
+def filtrar(model, atualizacao, params) -> ConsultaCompacta:
+    """Mesmos filtros do api.filters.filtrar, validados contra a tabela de dados."""
+    filtros = condicoes(model, params)
+    anos = {lookup: valor for lookup, valor in filtros.items() if lookup.startswith("ano__")}
+    series = SerieCompacta.objects.filter(atualizacao = atualizacao, tabela = model.__name__,
+                                          **{lookup: valor for lookup, valor in filtros.items() if lookup not in anos})
+    return ConsultaCompacta(model, series.order_by("pk"), anos)
+
+
+class LeituraCompacta:
+    """Mesma interface da LeituraRapida (linhas e colunas), lendo as séries compactas.
+    O id de cada linha é o da SerieCompacta, o mesmo em todos os anos da entidade, e as linhas
+    saem por entidade e ano. chunk_size conta séries, não linhas."""
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.campos = leitura_rapida(serializer_class).campos
+        self.metricas = [field.name for field in model._meta.concrete_fields if isinstance(field, models.DecimalField)]
+        self.dimensoes = [campo for campo in self.campos if campo in ("classificacao", "pais", "produto", "cultivar")
+                          and dimensao_do_model(model, campo) is not None]
+
+    def blocos(self, consulta:ConsultaCompacta, chunk_size:int = 2000):
+        """DataFrames com as colunas de self.campos, um por chunk_size séries. O primeiro sai mesmo vazio."""
+        colunas = ["id", "atualizacao_id", *[f"{campo}__nome" for campo in self.dimensoes], "ano_inicial", "valores"]
+        series = consulta.series.values_list(*colunas).iterator(chunk_size = chunk_size)
+        primeiro = True
+        while True:
+            lote = [serie for _, serie in zip(range(chunk_size), series)]
+            if lote or primeiro:
+                yield self.desempacotar(lote, consulta.anos)
+            primeiro = False
+            if len(lote) < chunk_size:
+                break
+
+    def desempacotar(self, lote:list, anos:dict) -> pd.DataFrame:
+        """Uma linha por (série, ano) com valor, sem laço por série: os valores são concatenados
+        e o ano de cada um sai da posição dentro da sua série."""
+        n_metricas = len(self.metricas)
+        brutos = [bytes(serie[-1]) for serie in lote]
+        tamanhos = np.array([len(bruto) // (8 * n_metricas) for bruto in brutos], dtype = np.int64)
+        valores = np.frombuffer(b"".join(brutos), dtype = "<f8").reshape(-1, n_metricas)
+        repetir = lambda coluna: np.repeat(np.array([serie[coluna] for serie in lote], dtype = object), tamanhos)
+
+        inicio = np.repeat(np.cumsum(tamanhos) - tamanhos, tamanhos)
+        ano = np.repeat(np.array([serie[-2] for serie in lote], dtype = np.int64), tamanhos) + np.arange(len(valores)) - inicio
+        #anos sem valor (NaN em todas as métricas) não existem na tabela de dados
+        mascara = ~np.isnan(valores).all(axis = 1)
+        if "ano__in" in anos:
+            mascara &= np.isin(ano, anos["ano__in"])
+        if "ano__gte" in anos:
+            mascara &= ano >= anos["ano__gte"]
+        if "ano__lte" in anos:
+            mascara &= ano <= anos["ano__lte"]
+
+        dados = {"id": repetir(0), "atualizacao": repetir(1), "ano": ano}
+        for i, campo in enumerate(self.dimensoes):
+            dados[campo] = repetir(2 + i)
+        for i, campo in enumerate(self.metricas):
+            dados[campo] = valores[:, i]
+        return pd.DataFrame({campo: dados[campo][mascara] for campo in self.campos})
+
+    def tuplas(self, consulta:ConsultaCompacta, chunk_size:int = 2000):
+        """Tuplas na ordem de self.campos, com as métricas como string de duas casas (como o DecimalField do DRF)."""
+        for df in self.blocos(consulta, chunk_size):
+            colunas = []
+            for campo in self.campos:
+                coluna = df[campo].to_numpy()
+                if campo in self.metricas:
+                    coluna = [None if np.isnan(valor) else f"{valor:.2f}" for valor in coluna]
+                else:
+                    coluna = coluna.tolist()
+                colunas.append(coluna)
+            yield from zip(*colunas)
+
+    def linhas(self, consulta:ConsultaCompacta, chunk_size:int = None):
+        """Uma dict por linha, no mesmo formato do ModelSerializer(many = True)."""
+        campos = self.campos
+        for linha in self.tuplas(consulta, chunk_size or 2000):
+            yield dict(zip(campos, linha))
+
+    def colunas(self, consulta:ConsultaCompacta) -> dict:
+        """Layout colunar: {campo: [valores]}."""
+        valores = list(zip(*self.tuplas(consulta)))
+        return {campo: list(valores[i]) if valores else [] for i, campo in enumerate(self.campos)}
+
+    def pagina(self, consulta:ConsultaCompacta, cursor:int, limit:int) -> tuple:
+        """Página do listar-tabela por entidade: as séries inteiras seguintes ao cursor (id da série)
+        que cabem em limit linhas, com ao menos uma. Retorna (linhas, próximo cursor ou None)."""
+        series = list(consulta.apos(cursor, limit).series.values_list("id", flat = True))
+        linhas = list(self.linhas(consulta.apos(cursor, limit)))
+        por_serie = {}
+        for linha in linhas:
+            por_serie[linha["id"]] = por_serie.get(linha["id"], 0) + 1
+        total, incluidas = 0, []
+        for serie in series:
+            if incluidas and total + por_serie.get(serie, 0) > limit:
+                break
+            total += por_serie.get(serie, 0)
+            incluidas.append(serie)
+        if not incluidas:
+            return [], None
+        ultima = incluidas[-1]
+        proximo = ultima if len(incluidas) < len(series) or len(series) == limit else None
+        return [linha for linha in linhas if linha["id"] <= ultima], proximo
+
+
+@lru_cache(maxsize = None)
+def leitura_compacta(serializer_class) -> LeituraCompacta:
+    """LeituraCompacta de um serializer, montada uma única vez por classe."""
+    return LeituraCompacta(serializer_class)
+
+
+def agregar(consulta:ConsultaCompacta, params) -> list:
+    """O api.filters.agregar feito com groupby do pandas sobre as séries desempacotadas."""
+    por, selecionadas, funcao, top = parametros_agregacao(consulta.model, params)
+    leitura = leitura_compacta(getattr(serializer, f"{consulta.model.__name__}Serializer"))
+    df = pd.concat([bloco[por + selecionadas] for bloco in leitura.blocos(consulta)], ignore_index = True)
+    linhas = df.groupby(por, as_index = False)[selecionadas].agg(FUNCOES[funcao]).to_dict("records")
+    return ordenar(linhas, por, selecionadas, funcao, top)
@@ -0,0 +1,170 @@
+"""Exportação das tabelas de uma atualizacao em formatos para consumo em DataFrames.
+
+As linhas são lidas direto do cursor do banco em blocos, sem instanciar models nem passar
+pelo serializer, e cada bloco vira um DataFrame do pandas já com os tipos finais
+(quantidades e valores em float64). As colunas são as mesmas do listar-tabela.
+
+Formatos:
+1) csv: texto gerado bloco a bloco, pode ser enviado em streaming
+2) parquet e arrow (Arrow IPC em arquivo): dependem do pyarrow, que é opcional. Cada bloco vira
+um row group (parquet) ou record batch (arrow), então também podem ser enviados em streaming
+"""
+import importlib
+import io
+
+import pandas as pd
+from django.db import connection, models
+
+from api.models import Dimensao
+from api.serializer import leitura_rapida
+from api.compacto import ConsultaCompacta, leitura_compacta
+
+EXTENSOES = {
+    "csv": "csv",
+    "parquet": "parquet",
+    "arrow": "arrow"
+}
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file"
+}
+
+
+class FormatoIndisponivel(Exception):
+    """O formato pedido depende de uma biblioteca que não está instalada."""
+
+
+def pyarrow():
+    try:
+        return importlib.import_module("pyarrow")
+    except ImportError:
+        raise FormatoIndisponivel("parquet and arrow formats require pyarrow (pip install pyarrow).")
+
+
+def tipos(model, campos:list) -> dict:
+    """dtype do pandas de cada campo; o banco pode devolver int ou float para o mesmo DecimalField."""
+    resultado = {}
+    for campo in campos:
+        field = model._meta.get_field(campo)
+        if isinstance(field, models.DecimalField):
+            resultado[campo] = "float64"
+        elif field.is_relation and issubclass(field.related_model, Dimensao):
+            resultado[campo] = "str"
+        elif isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+            resultado[campo] = "int64"
+        else:
+            resultado[campo] = "str"
+    return resultado
+
+
+def blocos(queryset, serializer_class, chunk_size:int = 50000):
+    """DataFrames de até chunk_size linhas lidos direto do cursor. queryset também pode ser uma
+    ConsultaCompacta (api.compacto); aí cada bloco traz as linhas de chunk_size // 100 séries."""
+    if isinstance(queryset, ConsultaCompacta):
+        leitura = leitura_compacta(serializer_class)
+        dtypes = tipos(queryset.model, leitura.campos)
+        for bloco in leitura.blocos(queryset, max(1, chunk_size // 100)):
+            yield bloco.astype(dtypes)
+        return
+    leitura = leitura_rapida(serializer_class)
+    dtypes = tipos(queryset.model, leitura.campos)
+    sql, params = queryset.values_list(*leitura.colunas_db).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        #o primeiro bloco sai mesmo vazio, para que o esquema seja sempre conhecido
+        linhas = cursor.fetchmany(chunk_size)
+        yield pd.DataFrame.from_records(linhas, columns = leitura.campos).astype(dtypes)
+        while len(linhas) == chunk_size:
+            linhas = cursor.fetchmany(chunk_size)
+            if linhas:
+                yield pd.DataFrame.from_records(linhas, columns = leitura.campos).astype(dtypes)
+
+
+def dataframe(queryset, serializer_class) -> pd.DataFrame:
+    return pd.concat(list(blocos(queryset, serializer_class)), ignore_index = True)
+
+
+def csv_stream(queryset, serializer_class, chunk_size:int = 50000):
+    """CSV em partes: o cabeçalho e depois um pedaço de texto por bloco."""
+    for i, bloco in enumerate(blocos(queryset, serializer_class, chunk_size)):
+        yield bloco.to_csv(index = False, header = i == 0)
+
+
+class Saida(io.RawIOBase):
+    """Destino binário que só guarda o que foi escrito até ser retirado. tell() conta todos os
+    bytes já escritos, como num arquivo: o parquet usa essas posições no rodapé."""
+
+    def __init__(self):
+        super().__init__()
+        self.partes = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        dados = bytes(dados)
+        self.partes.append(dados)
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def retirar(self) -> bytes:
+        dados = b"".join(self.partes)
+        self.partes = []
+        return dados
+
+
+def gravar(queryset, serializer_class, formato:str, destino):
+    """Grava parquet ou arrow em destino, um bloco por vez, com um yield depois de cada bloco.
+    O rodapé é escrito quando o gerador termina."""
+    pa = pyarrow()
+    writer = None
+    try:
+        for bloco in blocos(queryset, serializer_class):
+            tabela = pa.Table.from_pandas(bloco, preserve_index = False)
+            if writer is None:
+                if formato == "parquet":
+                    writer = importlib.import_module("pyarrow.parquet").ParquetWriter(destino, tabela.schema)
+                else:
+                    writer = pa.ipc.new_file(destino, tabela.schema)
+            writer.write_table(tabela)
+            yield
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def binario_stream(queryset, serializer_class, formato:str):
+    """parquet ou arrow em partes, uma por bloco e a última com o rodapé; a memória não depende
+    do tamanho da tabela. Sem o pyarrow levanta FormatoIndisponivel já na chamada."""
+    pyarrow()
+
+    def partes():
+        saida = Saida()
+        for _ in gravar(queryset, serializer_class, formato, saida):
+            yield saida.retirar()
+        yield saida.retirar()
+    return partes()
+
+
+def escrever(queryset, serializer_class, formato:str, destino):
+    """Grava a tabela em destino (caminho ou arquivo binário aberto) no formato informado.
+    parquet e arrow são escritos bloco a bloco, a memória não depende do tamanho da tabela."""
+    if formato == "csv":
+        if isinstance(destino, (str, bytes)) or hasattr(destino, "__fspath__"):
+            with open(destino, "w", encoding = "utf-8", newline = "") as f:
+                f.writelines(csv_stream(queryset, serializer_class))
+        else:
+            for parte in csv_stream(queryset, serializer_class):
+                destino.write(parte.encode("utf-8"))
+        return
+    if formato not in EXTENSOES:
+        raise ValueError(f"formato must be one of these: {','.join(EXTENSOES)}")
+
+    for _ in gravar(queryset, serializer_class, formato, destino):
+        pass
@@ -0,0 +1,155 @@
+"""Filtros e agregações feitos no banco para as tabelas de dados.
+
+Os parâmetros de query string viram filtros/agrupamentos do ORM, assim o cliente
+recebe só o recorte que precisa em vez da tabela inteira.
+"""
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Avg, Count, Max, Min, Sum
+
+from api.models import Dimensao
+
+CENTAVOS = Decimal("0.01")
+
+#campos pelos quais é possível filtrar e agrupar, quando existem na tabela
+DIMENSOES = ["ano", "classificacao", "pais", "produto", "cultivar"]
+
+FUNCOES = {
+    "sum": Sum,
+    "avg": Avg,
+    "min": Min,
+    "max": Max,
+    "count": Count
+}
+
+
+class FiltroInvalido(ValueError):
+    """Parâmetro de filtro/agregação inválido para a tabela consultada."""
+
+
+def campos_do_model(model) -> list:
+    return [f.name for f in model._meta.get_fields()]
+
+
+def metricas_do_model(model) -> list:
+    """Campos numéricos (quantidades e valores) da tabela."""
+    return [f.name for f in model._meta.get_fields() if isinstance(f, models.DecimalField)]
+
+
+def dimensao_do_model(model, campo:str):
+    """Model da tabela de dimensão referenciada pelo campo, ou None se o campo não for uma dimensão."""
+    field = model._meta.get_field(campo)
+    if field.is_relation and issubclass(field.related_model, Dimensao):
+        return field.related_model
+    return None
+
+
+def filtrar(queryset, params):
+    """Aplica os filtros da query string:
+    1) ano, ano_min e ano_max
+    2) pais, produto, cultivar e classificacao; vários valores podem ser separados por vírgula.
+       Os nomes são trocados antes pelos ids das dimensões, para o filtro usar os índices.
+    """
+    return queryset.filter(**condicoes(queryset.model, params))
+
+
+def condicoes(model, params) -> dict:
+    """{lookup do ORM: valor} dos filtros da query string válidos para a tabela (ver filtrar)."""
+    campos = campos_do_model(model)
+    resultado = {}
+
+    for dimensao in DIMENSOES:
+        if dimensao not in params:
+            continue
+        if dimensao not in campos:
+            raise FiltroInvalido(f"filter {dimensao} is not available for table {model.__name__}.")
+        valores = [valor.strip() for valor in params[dimensao].split(",") if valor.strip()]
+        if dimensao == "ano":
+            valores = [inteiro("ano", valor) for valor in valores]
+        else:
+            valores = list(dimensao_do_model(model, dimensao).objects.filter(nome__in = valores).values_list("id", flat = True))
+        resultado[f"{dimensao}__in"] = valores
+
+    if "ano_min" in params:
+        resultado["ano__gte"] = inteiro("ano_min", params["ano_min"])
+    if "ano_max" in params:
+        resultado["ano__lte"] = inteiro("ano_max", params["ano_max"])
+    return resultado
+
+
+def agregar(queryset, params) -> list:
+    """Agrega no banco os dados já filtrados:
+    1) por: campos de agrupamento separados por vírgula (ex: ano ou pais,ano)
+    2) campo: métrica a agregar; por padrão todas as métricas da tabela
+    3) funcao: sum (padrão), avg, min, max ou count
+    4) top: retorna só os N grupos com maior valor da (primeira) métrica
+    """
+    model = queryset.model
+    por, selecionadas, funcao, top = parametros_agregacao(model, params)
+
+    #o agrupamento é pelo id das dimensões, lendo só o índice; os grupos são poucos, então
+    #os ids são trocados pelos nomes e a ordenação é feita aqui, sem JOIN com as dimensões
+    anotacoes = {campo: FUNCOES[funcao](campo) for campo in selecionadas}
+    linhas = list(queryset.values(*por).annotate(**anotacoes).order_by())
+    for campo in por:
+        dimensao = dimensao_do_model(model, campo)
+        if dimensao is not None:
+            nomes = dict(dimensao.objects.filter(id__in = {linha[campo] for linha in linhas}).values_list("id", "nome"))
+            for linha in linhas:
+                linha[campo] = nomes[linha[campo]]
+    return ordenar(linhas, por, selecionadas, funcao, top)
+
+
+def parametros_agregacao(model, params) -> tuple:
+    """Valida os parâmetros do agregar para a tabela. Retorna (por, métricas, funcao, top)."""
+    campos = campos_do_model(model)
+    metricas = metricas_do_model(model)
+
+    por = [campo.strip() for campo in params.get("por", "ano").split(",") if campo.strip()]
+    for campo in por:
+        if campo not in DIMENSOES or campo not in campos:
+            raise FiltroInvalido(f"por must be a comma separated list of: {','.join(d for d in DIMENSOES if d in campos)}")
+
+    selecionadas = [campo.strip() for campo in params.get("campo", ",".join(metricas)).split(",") if campo.strip()]
+    for campo in selecionadas:
+        if campo not in metricas:
+            raise FiltroInvalido(f"campo must be one of these: {','.join(metricas)}")
+
+    funcao = params.get("funcao", "sum")
+    if funcao not in FUNCOES:
+        raise FiltroInvalido(f"funcao must be one of these: {','.join(FUNCOES)}")
+
+    top = inteiro("top", params["top"]) if "top" in params else None
+    if top is not None and top <= 0:
+        raise FiltroInvalido("top must be a positive integer.")
+    return por, selecionadas, funcao, top
+
+
+def ordenar(linhas:list, por:list, selecionadas:list, funcao:str, top:int = None) -> list:
+    """Ordena os grupos já agregados (com os nomes das dimensões), aplica o top e formata as métricas."""
+    linhas.sort(key = lambda linha: [linha[campo] for campo in por])
+    if top is not None:
+        #sort estável: no empate da métrica fica a ordem dos campos de agrupamento
+        primeira = selecionadas[0]
+        linhas.sort(key = lambda linha: (linha[primeira] is None, -(linha[primeira] or 0)))
+        linhas = linhas[:top]
+
+    #as métricas saem como string com duas casas, no mesmo formato do listar-tabela
+    return [
+        {chave: decimal(valor) if chave in selecionadas and funcao != "count" else valor for chave, valor in linha.items()}
+        for linha in linhas
+    ]
+
+
+def decimal(valor) -> str:
+    if valor is None:
+        return None
+    return format(Decimal(str(valor)).quantize(CENTAVOS), "f")
+
+
+def inteiro(nome:str, valor:str) -> int:
+    try:
+        return int(valor)
+    except ValueError:
+        raise FiltroInvalido(f"{nome} must be an integer.")
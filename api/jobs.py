@@ -0,0 +1,165 @@
+"""Execução das atualizações em segundo plano.
+
+As atualizações rodam num pool de threads do próprio processo, sem broker externo.
+O progresso de cada fonte fica num registro em memória e é publicado a cada etapa para os
+outros processos da API: no cache compartilhado (api.cache) e, enquanto a carga não está
+dentro da transação de escrita, em Atualizacao.detalhes. Ao final o pipeline grava em
+detalhes as métricas de cada fonte.
+
+detalhes também registra o processo (host e pid) que executa a atualização; recuperar()
+marca como ERRO as que ficaram EM ANDAMENTO porque esse processo terminou no meio da carga.
+"""
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from api.cache import cache
+from api.models import Atualizacao
+from scripts import run
+
+_executor = None
+_lock = threading.Lock()
+_progresso = {}
+
+
+def executor() -> ThreadPoolExecutor:
+    """Pool criado sob demanda com INGESTAO_WORKERS threads (padrão 1, uma carga por vez).
+    Ao criá-lo, as atualizacoes deixadas EM ANDAMENTO por um processo anterior são recuperadas."""
+    global _executor
+    with _lock:
+        criar = _executor is None
+        if criar:
+            _executor = ThreadPoolExecutor(
+                max_workers = getattr(settings, "INGESTAO_WORKERS", 1),
+                thread_name_prefix = "ingestao")
+    if criar:
+        recuperar()
+    return _executor
+
+
+def processo() -> dict:
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def registrar(atualizacao_id:int, fonte:str, etapa:str, **info):
+    """Callback passado ao pipeline, guarda a etapa atual de cada fonte e a publica."""
+    with _lock:
+        fontes = _progresso.setdefault(atualizacao_id, {})
+        fontes[fonte] = {"etapa": etapa, **info}
+        fontes = {fonte: dict(info) for fonte, info in fontes.items()}
+    publicar(atualizacao_id, fontes)
+
+
+def publicar(atualizacao_id:int, fontes:dict):
+    """Leva o progresso aos outros processos. Dentro da transação da carga o UPDATE só seria visível
+    depois do commit (e esperaria pela trava de escrita numa outra conexão), então ali só vai ao cache."""
+    cache().set(f"progresso:{atualizacao_id}", fontes, timeout = None)
+    if not connection.in_atomic_block:
+        Atualizacao.objects.filter(id = atualizacao_id, status = "EM ANDAMENTO").update(
+            detalhes = json.dumps({"processo": processo(), "fontes": fontes}))
+
+
+def progresso(atualizacao_id:int):
+    """Progresso por fonte de uma atualização em andamento, ou None se nenhum processo a está executando."""
+    with _lock:
+        if atualizacao_id in _progresso:
+            return {fonte: dict(info) for fonte, info in _progresso[atualizacao_id].items()}
+    return cache().get(f"progresso:{atualizacao_id}")
+
+
+def vivo(dono:dict) -> bool:
+    """O processo registrado em detalhes ainda existe? Só dá para saber no mesmo host;
+    nos outros ele é considerado vivo."""
+    if dono.get("host") != socket.gethostname():
+        return True
+    if dono.get("pid") == os.getpid():
+        return True
+    try:
+        os.kill(dono["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recuperar() -> list:
+    """Marca como ERRO as atualizacoes EM ANDAMENTO cujo processo terminou antes delas.
+    Retorna os ids marcados."""
+    marcadas = []
+    for atualizacao_id, gravado in Atualizacao.objects.filter(status = "EM ANDAMENTO").values_list("id", "detalhes"):
+        try:
+            detalhes = json.loads(gravado) if gravado else {}
+        except ValueError:
+            continue
+        dono = detalhes.get("processo")
+        if not dono:
+            continue
+        with _lock:
+            executando = atualizacao_id in _progresso
+        if executando or vivo(dono):
+            continue
+        detalhes["erro"] = f"process {dono.get('pid')} on {dono.get('host')} ended before the update finished."
+        if Atualizacao.objects.filter(id = atualizacao_id, status = "EM ANDAMENTO").update(
+                status = "ERRO", detalhes = json.dumps(detalhes)):
+            cache().delete(f"progresso:{atualizacao_id}")
+            marcadas.append(atualizacao_id)
+    return marcadas
+
+
+def descartar(atualizacao_id:int):
+    """Remove o progresso de uma atualização que terminou."""
+    with _lock:
+        _progresso.pop(atualizacao_id, None)
+    cache().delete(f"progresso:{atualizacao_id}")
+
+
+def enfileirar(atualizacao:Atualizacao, **opcoes):
+    """Coloca a atualização na fila do pool. opcoes são repassadas ao scripts.run.
+    O processo que vai executá-la fica registrado em detalhes desde já, na transação corrente;
+    a entrega ao pool só acontece depois do commit, então se a transação desfizer (ex: a escrita
+    não pegou a trava) não fica nem a atualizacao nem o seu progresso."""
+    pool = executor()
+    Atualizacao.objects.filter(id = atualizacao.id, status = "EM ANDAMENTO").update(
+        detalhes = json.dumps({"processo": processo(), "fontes": {}}))
+
+    def entregar():
+        with _lock:
+            _progresso[atualizacao.id] = {}
+        cache().set(f"progresso:{atualizacao.id}", {}, timeout = None)
+        pool.submit(executar, atualizacao.id, **opcoes)
+
+    transaction.on_commit(entregar)
+
+
+def executar(atualizacao_id:int, **opcoes):
+    """Roda o pipeline para a atualização e garante o progresso final e o erro em detalhes.
+    O pipeline grava em detalhes as métricas de cada fonte; se ele parou antes disso,
+    fica o último progresso registrado aqui."""
+    erro = None
+    try:
+        atualizacao = Atualizacao.objects.get(id = atualizacao_id)
+        run(atualizacao,
+            callback = lambda fonte, etapa, **info: registrar(atualizacao_id, fonte, etapa, **info),
+            **opcoes)
+    except Exception as ex:
+        print(f"Erro inesperado na atualizacao {atualizacao_id}: {ex}")
+        erro = str(ex.__cause__ or ex)
+        Atualizacao.objects.filter(id = atualizacao_id, status = "EM ANDAMENTO").update(status = "ERRO")
+    finally:
+        gravado = Atualizacao.objects.filter(id = atualizacao_id).values_list("detalhes", flat = True).first()
+        detalhes = json.loads(gravado) if gravado else {}
+        #sem duracao_s o pipeline parou antes de gravar as métricas: fica o último progresso
+        if "duracao_s" not in detalhes:
+            detalhes = {"fontes": progresso(atualizacao_id)}
+        if erro is not None:
+            detalhes["erro"] = erro
+        Atualizacao.objects.filter(id = atualizacao_id).update(detalhes = json.dumps(detalhes))
+        descartar(atualizacao_id)
+        #a thread do pool não passa pelo ciclo de request do Django, então a conexão é fechada aqui
+        connection.close()
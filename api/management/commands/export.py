@@ -0,0 +1,45 @@
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from api import compacto, exports, serializer
+from api.models import Atualizacao
+
+TABELAS = ['Producao','Processamento','Comercializacao','Importacao','Exportacao']
+
+
+class Command(BaseCommand):
+    help = "Exporta as tabelas de uma atualizacao em csv, parquet ou arrow, um arquivo por tabela."
+
+    def add_arguments(self, parser):
+        parser.add_argument("atualizacao", type = int, help = "pk da atualizacao")
+        parser.add_argument("--formato", choices = list(exports.EXTENSOES), default = "parquet")
+        parser.add_argument("--dir", default = "exports", help = "diretório de destino")
+        parser.add_argument("--tabelas", default = ",".join(t.lower() for t in TABELAS),
+                            help = "tabelas separadas por vírgula")
+
+    def handle(self, *args, **options):
+        try:
+            atualizacao = Atualizacao.objects.get(pk = options["atualizacao"])
+        except Atualizacao.DoesNotExist:
+            raise CommandError(f"Atualizacao object id {options['atualizacao']} does not exists.")
+
+        tabelas = [t.strip().lower().capitalize() for t in options["tabelas"].split(",") if t.strip()]
+        for table in tabelas:
+            if table not in TABELAS:
+                raise CommandError(f"table parameter must be one of these: {','.join(TABELAS)}")
+
+        os.makedirs(options["dir"], exist_ok = True)
+        for table in tabelas:
+            model = apps.get_model("api", table)
+            destino = os.path.join(options["dir"], f"{table.lower()}_{atualizacao.id}.{exports.EXTENSOES[options['formato']]}")
+            if atualizacao.armazenamento == "compacto":
+                items = compacto.filtrar(model, atualizacao, {})
+            else:
+                items = model.objects.da_versao(atualizacao).order_by("pk")
+            try:
+                exports.escrever(items, getattr(serializer, f"{table}Serializer"), options["formato"], destino)
+            except exports.FormatoIndisponivel as ex:
+                raise CommandError(str(ex))
+            self.stdout.write(destino)
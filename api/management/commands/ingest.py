@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import jobs
+from api.metricas import ETAPAS
+from api.models import Atualizacao
+from scripts import ARMAZENAMENTOS, MODOS, ORIGENS, DefaultEmbrapaPipeline, carregar_sources, run
+
+
+class Command(BaseCommand):
+    help = ("Cria uma atualizacao e executa a carga das fontes do sources.json nela, sem passar pelo pool da API. "
+            "Ao final mostra as linhas e linhas/s de cada fonte.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sources", help = "fontes separadas por vírgula, aceita curingas (ex: producao,exportacao_*); "
+                                                 "as demais são herdadas da última atualizacao com SUCESSO")
+        parser.add_argument("--modo", choices = MODOS, default = "completo")
+        parser.add_argument("--armazenamento", choices = ARMAZENAMENTOS, default = "linhas",
+                            help = "compacto grava uma série por entidade em vez de uma linha por ano (só carga completa)")
+        parser.add_argument("--workers", type = int, default = 1,
+                            help = "processos que transformam os CSVs em paralelo (parse_workers)")
+        parser.add_argument("--batch-size", type = int, default = 1000, help = "linhas por INSERT")
+        parser.add_argument("--chunk-rows", type = int, default = settings.INGESTAO_CHUNK_ROWS,
+                            help = "lê cada CSV em blocos desse número de linhas")
+        parser.add_argument("--origem", choices = ORIGENS, default = settings.INGESTAO_ORIGEM,
+                            help = "de onde vêm os CSVs; fora de 'rede' nenhuma requisição HTTP é feita")
+        parser.add_argument("--arquivo", default = settings.INGESTAO_ARQUIVO,
+                            help = ".zip ou .tar com os CSVs, para --origem arquivo")
+        parser.add_argument("--offline", action = "store_true",
+                            help = "não acessa a rede; sem --origem usa os CSVs já baixados em cache/")
+        parser.add_argument("--dry-run", action = "store_true",
+                            help = "só transforma os CSVs já disponíveis, sem baixar nem gravar no banco")
+
+    def handle(self, *args, **options):
+        origem = options["origem"]
+        if options["offline"] and origem == "rede":
+            origem = "cache"
+
+        try:
+            fontes = [f.strip() for f in options["sources"].split(",") if f.strip()] if options["sources"] else None
+            sources = carregar_sources(fontes)
+            opcoes = {
+                "modo": options["modo"],
+                "armazenamento": options["armazenamento"],
+                "parse_workers": options["workers"],
+                "batch_size": options["batch_size"],
+                "chunk_rows": options["chunk_rows"],
+                "origem": origem,
+                "arquivo": options["arquivo"],
+            }
+            pipeline = DefaultEmbrapaPipeline(parcial = fontes is not None, **opcoes)
+        except ValueError as ex:
+            raise CommandError(str(ex))
+
+        if options["dry_run"]:
+            return self.simular(pipeline, sources)
+
+        atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+        #o progresso fica visível no consultar-update da API, como nas cargas do pool
+        jobs.publicar(atualizacao.id, {})
+        try:
+            run(atualizacao, fontes = fontes, callback = lambda fonte, etapa, **info: jobs.registrar(atualizacao.id, fonte, etapa, **info),
+                **opcoes)
+        except Exception as ex:
+            raise CommandError(f"Atualizacao {atualizacao.id}: {ex.__cause__ or ex}")
+        finally:
+            jobs.descartar(atualizacao.id)
+        self.relatorio(atualizacao)
+
+    def simular(self, pipeline:DefaultEmbrapaPipeline, sources:dict):
+        """Transforma cada fonte a partir do arquivo que a origem usaria, sem baixar nada."""
+        self.stdout.write(f"{'fonte':35} {'arquivo':45} {'linhas':>8} {'segundos':>9} {'linhas/s':>10}")
+        with tempfile.TemporaryDirectory() as diretorio:
+            for fonte, source in sources.items():
+                csv_file_path = source['test_file'] if pipeline.origem == "teste" else source['dst_file']
+                try:
+                    if pipeline.origem == "arquivo":
+                        csv_file_path = os.path.join(diretorio, os.path.basename(source['dst_file']))
+                        with open(csv_file_path, "wb") as destino:
+                            pipeline.extrair(os.path.basename(source['dst_file']), destino)
+                    inicio = time.perf_counter()
+                    linhas = len(pipeline.transform(source, csv_file_path)["df"])
+                    segundos = time.perf_counter() - inicio
+                except (OSError, ValueError) as ex:
+                    self.stdout.write(f"{fonte:35} {ex}")
+                    continue
+                self.stdout.write(f"{fonte:35} {csv_file_path:45} {linhas:>8} {segundos:>9.3f} {linhas / segundos:>10.0f}")
+
+    def relatorio(self, atualizacao:Atualizacao):
+        atualizacao.refresh_from_db()
+        detalhes = json.loads(atualizacao.detalhes or "{}")
+        self.stdout.write(f"{'fonte':35} {'etapa':>11} {'linhas':>8} {'segundos':>9} {'linhas/s':>10}")
+        total = 0
+        for fonte, info in (detalhes.get("fontes") or {}).items():
+            metricas = info.get("metricas") or {}
+            linhas = metricas.get("linhas", 0)
+            segundos = sum(metricas.get(chave, 0) for chave in ETAPAS)
+            total += linhas
+            self.stdout.write(f"{fonte:35} {info.get('etapa', ''):>11} {linhas:>8} {segundos:>9.3f} {metricas.get('linhas_por_s', 0):>10.0f}")
+        duracao = detalhes.get("duracao_s") or 0
+        vazao = f"{total / duracao:.0f} linhas/s" if duracao else "-"
+        self.stdout.write(f"Atualizacao {atualizacao.id}: {atualizacao.status}, {total} linhas em {duracao:.2f}s ({vazao})")
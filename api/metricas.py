@@ -0,0 +1,77 @@
+"""Métricas das cargas no formato texto do Prometheus.
+
+As métricas saem do detalhes gravado pelo pipeline na última atualizacao finalizada
+(SUCESSO ou ERRO), mais a contagem de atualizacoes por status.
+"""
+import json
+
+from django.db.models import Count
+
+from api.models import Atualizacao
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#etapas com tempo medido, como aparecem nas métricas de cada fonte em detalhes
+ETAPAS = {
+    "download_s": "download",
+    "read_csv_s": "read_csv",
+    "reshape_s": "reshape",
+    "insert_s": "insert",
+    "copia_s": "copia"
+}
+
+#demais métricas por fonte: {chave em detalhes: (nome da métrica, descrição)}
+POR_FONTE = {
+    "linhas": ("embrapa_ingestao_linhas", "Linhas gravadas por fonte."),
+    "bytes": ("embrapa_ingestao_bytes", "Tamanho do CSV de cada fonte."),
+    "linhas_por_s": ("embrapa_ingestao_linhas_por_segundo", "Linhas por segundo na carga de cada fonte.")
+}
+
+
+def escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def rotulos(**valores) -> str:
+    return "{" + ",".join(f'{nome}="{escapar(valor)}"' for nome, valor in valores.items()) + "}"
+
+
+def serie(linhas:list, nome:str, descricao:str, amostras:list):
+    """Acrescenta em linhas uma métrica gauge com as amostras [(rótulos, valor)]."""
+    linhas.append(f"# HELP {nome} {descricao}")
+    linhas.append(f"# TYPE {nome} gauge")
+    for rotulo, valor in amostras:
+        linhas.append(f"{nome}{rotulo} {valor}")
+
+
+def prometheus() -> str:
+    linhas = []
+    por_status = Atualizacao.objects.values("status").annotate(total = Count("id")).order_by("status")
+    serie(linhas, "embrapa_atualizacoes", "Atualizacoes por status.",
+          [(rotulos(status = linha["status"]), linha["total"]) for linha in por_status])
+
+    atualizacao = (Atualizacao.objects.filter(status__in = ["SUCESSO", "ERRO"], detalhes__isnull = False)
+                   .order_by("-id").first())
+    if atualizacao is None:
+        return "\n".join(linhas) + "\n"
+    try:
+        detalhes = json.loads(atualizacao.detalhes)
+    except ValueError:
+        detalhes = {}
+
+    if detalhes.get("duracao_s") is not None:
+        serie(linhas, "embrapa_ingestao_duracao_segundos", "Duração total da última carga finalizada.",
+              [(rotulos(atualizacao = atualizacao.id, status = atualizacao.status), detalhes["duracao_s"])])
+
+    fontes = {fonte: info.get("metricas") or {} for fonte, info in (detalhes.get("fontes") or {}).items()}
+    serie(linhas, "embrapa_ingestao_etapa_segundos", "Tempo de cada etapa da carga por fonte.", [
+        (rotulos(atualizacao = atualizacao.id, fonte = fonte, etapa = etapa), metricas[chave])
+        for fonte, metricas in fontes.items()
+        for chave, etapa in ETAPAS.items() if metricas.get(chave) is not None
+    ])
+    for chave, (nome, descricao) in POR_FONTE.items():
+        serie(linhas, nome, descricao, [
+            (rotulos(atualizacao = atualizacao.id, fonte = fonte), metricas[chave])
+            for fonte, metricas in fontes.items() if metricas.get(chave) is not None
+        ])
+    return "\n".join(linhas) + "\n"
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Atualizacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField()),
+                ('status', models.TextField()),
+                ('detalhes', models.TextField(null=True)),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='derivadas', to='api.atualizacao')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Comercializacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produto', models.TextField()),
+                ('ano', models.IntegerField()),
+                ('quantidade_litros', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.atualizacao')),
+                ('substituido_em', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.atualizacao')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Exportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classificacao', models.TextField()),
+                ('pais', models.TextField()),
+                ('ano', models.IntegerField()),
+                ('quantidade', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('valor_dolares', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.atualizacao')),
+                ('substituido_em', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.atualizacao')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Importacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classificacao', models.TextField()),
+                ('pais', models.TextField()),
+                ('ano', models.IntegerField()),
+                ('quantidade', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('valor_dolares', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.atualizacao')),
+                ('substituido_em', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.atualizacao')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Processamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classificacao', models.TextField()),
+                ('cultivar', models.TextField()),
+                ('ano', models.IntegerField()),
+                ('quantidade_kg', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.atualizacao')),
+                ('substituido_em', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.atualizacao')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Producao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produto', models.TextField()),
+                ('ano', models.IntegerField()),
+                ('quantidade_litros', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.atualizacao')),
+                ('substituido_em', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.atualizacao')),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comercializacao',
+            index=models.Index(fields=['atualizacao', 'ano', 'produto', 'quantidade_litros', 'substituido_em'], name='comercializacao_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comercializacao',
+            index=models.Index(fields=['atualizacao', 'produto'], name='comercializacao_produto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='exportacao_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'pais'], name='exportacao_pais_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='importacao_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'pais'], name='importacao_pais_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'cultivar', 'quantidade_kg', 'substituido_em'], name='processamento_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'cultivar'], name='processamento_cultivar_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producao',
+            index=models.Index(fields=['atualizacao', 'ano', 'produto', 'quantidade_litros', 'substituido_em'], name='producao_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producao',
+            index=models.Index(fields=['atualizacao', 'produto'], name='producao_produto_idx'),
+        ),
+    ]
@@ -0,0 +1,311 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+#(tabela, campo, dimensão) dos campos de texto que passam a referenciar as tabelas de dimensão
+CAMPOS = [
+    ("producao", "produto", "Produto"),
+    ("processamento", "classificacao", "Classificacao"),
+    ("processamento", "cultivar", "Cultivar"),
+    ("comercializacao", "produto", "Produto"),
+    ("importacao", "classificacao", "Classificacao"),
+    ("importacao", "pais", "Pais"),
+    ("exportacao", "classificacao", "Classificacao"),
+    ("exportacao", "pais", "Pais"),
+]
+
+
+def preencher(apps, schema_editor):
+    """Cria uma linha de dimensão por nome distinto e aponta as linhas de dados para ela,
+    com um UPDATE por nome."""
+    for tabela, campo, dimensao in CAMPOS:
+        model = apps.get_model("api", tabela)
+        Dimensao = apps.get_model("api", dimensao)
+        nomes = sorted(model.objects.values_list(campo, flat = True).distinct())
+        Dimensao.objects.bulk_create([Dimensao(nome = nome) for nome in nomes], ignore_conflicts = True)
+        for nome, id in Dimensao.objects.filter(nome__in = nomes).values_list("nome", "id"):
+            model.objects.filter(**{campo: nome}).update(**{f"{campo}_ref": id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Classificacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Cultivar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Pais',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Produto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.TextField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='comercializacao',
+            name='comercializacao_ano_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comercializacao',
+            name='comercializacao_produto_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='exportacao',
+            name='exportacao_cls_ano_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='exportacao',
+            name='exportacao_pais_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='importacao',
+            name='importacao_cls_ano_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='importacao',
+            name='importacao_pais_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='processamento',
+            name='processamento_cls_ano_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='processamento',
+            name='processamento_cultivar_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='producao',
+            name='producao_ano_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='producao',
+            name='producao_produto_idx',
+        ),
+        migrations.AddField(
+            model_name='producao',
+            name='produto_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.produto'),
+        ),
+        migrations.AddField(
+            model_name='processamento',
+            name='classificacao_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.AddField(
+            model_name='processamento',
+            name='cultivar_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.cultivar'),
+        ),
+        migrations.AddField(
+            model_name='comercializacao',
+            name='produto_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.produto'),
+        ),
+        migrations.AddField(
+            model_name='importacao',
+            name='classificacao_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.AddField(
+            model_name='importacao',
+            name='pais_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais'),
+        ),
+        migrations.AddField(
+            model_name='exportacao',
+            name='classificacao_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.AddField(
+            model_name='exportacao',
+            name='pais_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais'),
+        ),
+        migrations.RunPython(preencher),
+        migrations.RemoveField(
+            model_name='producao',
+            name='produto',
+        ),
+        migrations.RenameField(
+            model_name='producao',
+            old_name='produto_ref',
+            new_name='produto',
+        ),
+        migrations.AlterField(
+            model_name='producao',
+            name='produto',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.produto'),
+        ),
+        migrations.RemoveField(
+            model_name='processamento',
+            name='classificacao',
+        ),
+        migrations.RenameField(
+            model_name='processamento',
+            old_name='classificacao_ref',
+            new_name='classificacao',
+        ),
+        migrations.AlterField(
+            model_name='processamento',
+            name='classificacao',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.RemoveField(
+            model_name='processamento',
+            name='cultivar',
+        ),
+        migrations.RenameField(
+            model_name='processamento',
+            old_name='cultivar_ref',
+            new_name='cultivar',
+        ),
+        migrations.AlterField(
+            model_name='processamento',
+            name='cultivar',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.cultivar'),
+        ),
+        migrations.RemoveField(
+            model_name='comercializacao',
+            name='produto',
+        ),
+        migrations.RenameField(
+            model_name='comercializacao',
+            old_name='produto_ref',
+            new_name='produto',
+        ),
+        migrations.AlterField(
+            model_name='comercializacao',
+            name='produto',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.produto'),
+        ),
+        migrations.RemoveField(
+            model_name='importacao',
+            name='classificacao',
+        ),
+        migrations.RenameField(
+            model_name='importacao',
+            old_name='classificacao_ref',
+            new_name='classificacao',
+        ),
+        migrations.AlterField(
+            model_name='importacao',
+            name='classificacao',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.RemoveField(
+            model_name='importacao',
+            name='pais',
+        ),
+        migrations.RenameField(
+            model_name='importacao',
+            old_name='pais_ref',
+            new_name='pais',
+        ),
+        migrations.AlterField(
+            model_name='importacao',
+            name='pais',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais'),
+        ),
+        migrations.RemoveField(
+            model_name='exportacao',
+            name='classificacao',
+        ),
+        migrations.RenameField(
+            model_name='exportacao',
+            old_name='classificacao_ref',
+            new_name='classificacao',
+        ),
+        migrations.AlterField(
+            model_name='exportacao',
+            name='classificacao',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao'),
+        ),
+        migrations.RemoveField(
+            model_name='exportacao',
+            name='pais',
+        ),
+        migrations.RenameField(
+            model_name='exportacao',
+            old_name='pais_ref',
+            new_name='pais',
+        ),
+        migrations.AlterField(
+            model_name='exportacao',
+            name='pais',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais'),
+        ),
+        migrations.AddIndex(
+            model_name='comercializacao',
+            index=models.Index(fields=['atualizacao', 'ano', 'produto', 'quantidade_litros', 'substituido_em'], name='comercializacao_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comercializacao',
+            index=models.Index(fields=['atualizacao', 'produto'], name='comercializacao_produto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='exportacao_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'pais'], name='exportacao_pais_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='importacao_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'pais'], name='importacao_pais_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'ano', 'cultivar', 'quantidade_kg', 'substituido_em'], name='processamento_cls_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'cultivar'], name='processamento_cultivar_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producao',
+            index=models.Index(fields=['atualizacao', 'ano', 'produto', 'quantidade_litros', 'substituido_em'], name='producao_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producao',
+            index=models.Index(fields=['atualizacao', 'produto'], name='producao_produto_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_dimensoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoExportacaoPais',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.IntegerField()),
+                ('quantidade', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('valor_dolares', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.atualizacao')),
+                ('pais', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumoProcessamentoClassificacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.IntegerField()),
+                ('quantidade_kg', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.atualizacao')),
+                ('classificacao', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumoTotalAnual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.IntegerField()),
+                ('tabela', models.TextField()),
+                ('quantidade', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('valor_dolares', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('atualizacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.atualizacao')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_resumos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='atualizacao',
+            name='armazenamento',
+            field=models.TextField(default='linhas'),
+        ),
+        migrations.CreateModel(
+            name='SerieCompacta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabela', models.TextField()),
+                ('ano_inicial', models.IntegerField()),
+                ('valores', models.BinaryField()),
+                ('atualizacao', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.atualizacao')),
+                ('classificacao', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.classificacao')),
+                ('cultivar', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.cultivar')),
+                ('pais', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.pais')),
+                ('produto', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.produto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['atualizacao', 'tabela'], name='seriecompacta_tabela_idx')],
+            },
+        ),
+    ]
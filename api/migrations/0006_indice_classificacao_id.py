@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_armazenamento_compacto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'id', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='exportacao_cls_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'id', 'ano', 'pais', 'quantidade', 'valor_dolares', 'substituido_em'], name='importacao_cls_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'classificacao', 'id', 'ano', 'cultivar', 'quantidade_kg', 'substituido_em'], name='processamento_cls_id_idx'),
+        ),
+    ]
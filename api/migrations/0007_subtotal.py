@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_indice_classificacao_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comercializacao',
+            name='subtotal',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='processamento',
+            name='subtotal',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='producao',
+            name='subtotal',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='seriecompacta',
+            name='subtotal',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_subtotal'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='exportacao',
+            name='exportacao_cls_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='importacao',
+            name='importacao_cls_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='processamento',
+            name='processamento_cls_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='exportacao',
+            index=models.Index(fields=['atualizacao', 'classificacao'], name='exportacao_cls_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importacao',
+            index=models.Index(fields=['atualizacao', 'classificacao'], name='importacao_cls_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processamento',
+            index=models.Index(fields=['atualizacao', 'classificacao'], name='processamento_cls_idx'),
+        ),
+    ]
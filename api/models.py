@@ -5,40 +5,257 @@ class Atualizacao(models.Model):
     ts = models.DateTimeField()
     status = models.TextField()
     detalhes = models.TextField(null=True)
+    #atualizacao usada como base quando a carga é diferencial. Só as diferenças para ela são gravadas.
+    base = models.ForeignKey(to = 'self', null=True, blank=True, on_delete=models.PROTECT, related_name='derivadas')
+    #"linhas" grava uma linha por (entidade, ano) nas tabelas de dados; "compacto" uma SerieCompacta por entidade
+    armazenamento = models.TextField(default="linhas")
+
+    def cadeia(self) -> list:
+        """Retorna os ids das atualizacoes necessárias para reconstruir esta versão:
+        ela mesma seguida das suas bases, até chegar numa carga completa."""
+        ids = [self.id]
+        base_id = self.base_id
+        while base_id is not None:
+            ids.append(base_id)
+            base_id = Atualizacao.objects.filter(id = base_id).values_list("base_id", flat = True).first()
+        return ids
+
+
+class DimensaoManager(models.Manager):
+    def ids(self, nomes) -> dict:
+        """Retorna {nome: id} dos nomes informados, criando numa única inserção os que ainda não existem."""
+        #dict em vez de set para criar os ids na ordem em que os nomes aparecem
+        nomes = list(dict.fromkeys(nomes))
+        ids = dict(self.filter(nome__in = nomes).values_list("nome", "id"))
+        faltantes = [nome for nome in nomes if nome not in ids]
+        if faltantes:
+            self.bulk_create([self.model(nome = nome) for nome in faltantes], ignore_conflicts = True)
+            ids.update(self.filter(nome__in = faltantes).values_list("nome", "id"))
+        return ids
+
+
+class Dimensao(models.Model):
+    """Valores de uma dimensão (país, produto, cultivar ou classificação) gravados uma única vez.
+    As tabelas de dados guardam só o id; a API continua devolvendo o nome."""
+    nome = models.TextField(unique = True)
+
+    objects = DimensaoManager()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.nome
+
+
+class Pais(Dimensao):
+    pass
+
+class Produto(Dimensao):
+    pass
+
+class Cultivar(Dimensao):
+    pass
+
+class Classificacao(Dimensao):
+    pass
+
+
+class VersaoQuerySet(models.QuerySet):
+    def da_versao(self, atualizacao:Atualizacao):
+        """Linhas vigentes na atualizacao informada. Numa carga diferencial as linhas
+        ficam na atualizacao que as inseriu e são marcadas com substituido_em quando
+        mudam ou somem, então a versão é a soma das linhas da cadeia que não foram
+        substituídas por nenhuma atualizacao da própria cadeia."""
+        cadeia = atualizacao.cadeia()
+        if len(cadeia) == 1:
+            return self.filter(atualizacao_id = atualizacao.id)
+        return self.filter(atualizacao_id__in = cadeia).exclude(substituido_em_id__in = cadeia)
+
 
 class Producao(models.Model):
     atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE)
-    produto = models.TextField()
+    produto = models.ForeignKey(to = Produto, on_delete=models.PROTECT, related_name='+', db_index=False)
     ano = models.IntegerField()
     quantidade_litros = models.DecimalField(decimal_places=2,max_digits=20)
+    #linha de categoria do CSV (ex: VINHO DE MESA, TINTAS), com a soma dos itens abaixo dela: fica fora dos resumos
+    subtotal = models.BooleanField(default=False)
+    substituido_em = models.ForeignKey(to = Atualizacao, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    objects = VersaoQuerySet.as_manager()
+
+    class Meta:
+        #o índice simples de atualizacao (FK) atende o listar-tabela paginado por id;
+        #o de cobertura atende filtros por classificacao/ano e agregações lendo só o índice;
+        #o de igualdade por dimensão mantém a ordem por id (rowid no fim do índice), sem ordenação extra.
+        #As dimensões não têm índice próprio: são consultadas sempre junto com a atualizacao.
+        indexes = [
+            models.Index(fields = ["atualizacao", "ano", "produto", "quantidade_litros", "substituido_em"], name = "producao_ano_idx"),
+            models.Index(fields = ["atualizacao", "produto"], name = "producao_produto_idx"),
+        ]
 
 class Processamento(models.Model):
     atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE)
-    classificacao = models.TextField()
-    cultivar = models.TextField()
+    classificacao = models.ForeignKey(to = Classificacao, on_delete=models.PROTECT, related_name='+', db_index=False)
+    cultivar = models.ForeignKey(to = Cultivar, on_delete=models.PROTECT, related_name='+', db_index=False)
     ano = models.IntegerField()
     quantidade_kg = models.DecimalField(decimal_places=2,max_digits=20)
+    #linha de categoria do CSV (ex: VINHO DE MESA, TINTAS), com a soma dos itens abaixo dela: fica fora dos resumos
+    subtotal = models.BooleanField(default=False)
+    substituido_em = models.ForeignKey(to = Atualizacao, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    objects = VersaoQuerySet.as_manager()
+
+    class Meta:
+        #o índice simples de atualizacao (FK) atende o listar-tabela paginado por id;
+        #o de cobertura atende filtros por classificacao/ano e agregações lendo só o índice;
+        #o estreito de classificacao (rowid no fim do índice) atende o listar-tabela filtrado por
+        #classificacao já na ordem do id (o ano no meio do outro exigiria ordenar o resultado);
+        #o de igualdade por dimensão mantém a ordem por id (rowid no fim do índice), sem ordenação extra.
+        #As dimensões não têm índice próprio: são consultadas sempre junto com a atualizacao.
+        indexes = [
+            models.Index(fields = ["atualizacao", "classificacao", "ano", "cultivar", "quantidade_kg", "substituido_em"],
+                         name = "processamento_cls_ano_idx"),
+            models.Index(fields = ["atualizacao", "cultivar"], name = "processamento_cultivar_idx"),
+            models.Index(fields = ["atualizacao", "classificacao"], name = "processamento_cls_idx"),
+        ]
 
 class Comercializacao(models.Model):
     atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE)
-    produto = models.TextField()
+    produto = models.ForeignKey(to = Produto, on_delete=models.PROTECT, related_name='+', db_index=False)
     ano =   models.IntegerField()
     quantidade_litros = models.DecimalField(decimal_places=2,max_digits=20)
+    #linha de categoria do CSV (ex: VINHO DE MESA, TINTAS), com a soma dos itens abaixo dela: fica fora dos resumos
+    subtotal = models.BooleanField(default=False)
+    substituido_em = models.ForeignKey(to = Atualizacao, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    objects = VersaoQuerySet.as_manager()
+
+    class Meta:
+        #o índice simples de atualizacao (FK) atende o listar-tabela paginado por id;
+        #o de cobertura atende filtros por classificacao/ano e agregações lendo só o índice;
+        #o de igualdade por dimensão mantém a ordem por id (rowid no fim do índice), sem ordenação extra.
+        #As dimensões não têm índice próprio: são consultadas sempre junto com a atualizacao.
+        indexes = [
+            models.Index(fields = ["atualizacao", "ano", "produto", "quantidade_litros", "substituido_em"], name = "comercializacao_ano_idx"),
+            models.Index(fields = ["atualizacao", "produto"], name = "comercializacao_produto_idx"),
+        ]
 
 class Importacao(models.Model):
     atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE)
-    classificacao = models.TextField()
-    pais = models.TextField()
+    classificacao = models.ForeignKey(to = Classificacao, on_delete=models.PROTECT, related_name='+', db_index=False)
+    pais = models.ForeignKey(to = Pais, on_delete=models.PROTECT, related_name='+', db_index=False)
     ano = models.IntegerField()
     quantidade = models.DecimalField(decimal_places=2,max_digits=20)
     valor_dolares = models.DecimalField(decimal_places=2,max_digits=20)
+    substituido_em = models.ForeignKey(to = Atualizacao, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    objects = VersaoQuerySet.as_manager()
+
+    class Meta:
+        #o índice simples de atualizacao (FK) atende o listar-tabela paginado por id;
+        #o de cobertura atende filtros por classificacao/ano e agregações lendo só o índice;
+        #o estreito de classificacao (rowid no fim do índice) atende o listar-tabela filtrado por
+        #classificacao já na ordem do id (o ano no meio do outro exigiria ordenar o resultado);
+        #o de igualdade por dimensão mantém a ordem por id (rowid no fim do índice), sem ordenação extra.
+        #As dimensões não têm índice próprio: são consultadas sempre junto com a atualizacao.
+        indexes = [
+            models.Index(fields = ["atualizacao", "classificacao", "ano", "pais", "quantidade", "valor_dolares", "substituido_em"],
+                         name = "importacao_cls_ano_idx"),
+            models.Index(fields = ["atualizacao", "pais"], name = "importacao_pais_idx"),
+            models.Index(fields = ["atualizacao", "classificacao"], name = "importacao_cls_idx"),
+        ]
 
 class Exportacao(models.Model):
     atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE)
-    classificacao = models.TextField()
-    pais = models.TextField()
+    classificacao = models.ForeignKey(to = Classificacao, on_delete=models.PROTECT, related_name='+', db_index=False)
+    pais = models.ForeignKey(to = Pais, on_delete=models.PROTECT, related_name='+', db_index=False)
+    ano = models.IntegerField()
+    quantidade = models.DecimalField(decimal_places=2,max_digits=20)
+    valor_dolares = models.DecimalField(decimal_places=2,max_digits=20)
+    substituido_em = models.ForeignKey(to = Atualizacao, null=True, on_delete=models.SET_NULL, related_name='+')
+
+    objects = VersaoQuerySet.as_manager()
+
+    class Meta:
+        #o índice simples de atualizacao (FK) atende o listar-tabela paginado por id;
+        #o de cobertura atende filtros por classificacao/ano e agregações lendo só o índice;
+        #o estreito de classificacao (rowid no fim do índice) atende o listar-tabela filtrado por
+        #classificacao já na ordem do id (o ano no meio do outro exigiria ordenar o resultado);
+        #o de igualdade por dimensão mantém a ordem por id (rowid no fim do índice), sem ordenação extra.
+        #As dimensões não têm índice próprio: são consultadas sempre junto com a atualizacao.
+        indexes = [
+            models.Index(fields = ["atualizacao", "classificacao", "ano", "pais", "quantidade", "valor_dolares", "substituido_em"],
+                         name = "exportacao_cls_ano_idx"),
+            models.Index(fields = ["atualizacao", "pais"], name = "exportacao_pais_idx"),
+            models.Index(fields = ["atualizacao", "classificacao"], name = "exportacao_cls_idx"),
+        ]
+
+
+
+
+class SerieCompacta(models.Model):
+    """Armazenamento compacto de uma linha do CSV numa versão: em vez de uma linha por ano na tabela
+    de dados, a série inteira empacotada em valores, float64 little-endian no formato (ano, métrica),
+    do ano_inicial em diante e com NaN nos anos sem valor. As métricas são os DecimalField da tabela,
+    na ordem do model; as dimensões que a tabela não tem ficam nulas e subtotal marca as linhas de
+    categoria, como nas tabelas de dados.
+    O float64 é exato até o centavo para |valor| < 2**46 (16 dígitos), mais que os 15 dígitos
+    significativos com que o Django lê os DecimalField do SQLite nas tabelas de dados."""
+    atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE, related_name='+', db_index=False)
+    tabela = models.TextField()
+    classificacao = models.ForeignKey(to = Classificacao, null=True, on_delete=models.PROTECT, related_name='+', db_index=False)
+    produto = models.ForeignKey(to = Produto, null=True, on_delete=models.PROTECT, related_name='+', db_index=False)
+    cultivar = models.ForeignKey(to = Cultivar, null=True, on_delete=models.PROTECT, related_name='+', db_index=False)
+    pais = models.ForeignKey(to = Pais, null=True, on_delete=models.PROTECT, related_name='+', db_index=False)
+    ano_inicial = models.IntegerField()
+    valores = models.BinaryField()
+    subtotal = models.BooleanField(default=False)
+
+    class Meta:
+        #as leituras são sempre de uma tabela de uma atualizacao, na ordem do id (rowid no fim do índice)
+        indexes = [
+            models.Index(fields = ["atualizacao", "tabela"], name = "seriecompacta_tabela_idx"),
+        ]
+
+
+class Resumo(models.Model):
+    """Agregado de uma versão gravado ao final da carga (DefaultEmbrapaPipeline.gravar_resumos),
+    para que as leituras não precisem varrer as tabelas de dados.
+    tabelas são as tabelas de origem (None para todas) e por os campos de agrupamento;
+    as métricas da origem são somadas no campo de mesmo nome ou, para as quantidades, em quantidade."""
+    atualizacao = models.ForeignKey(to = Atualizacao, on_delete=models.CASCADE, related_name='+')
     ano = models.IntegerField()
+
+    tabelas = None
+    por = ["ano"]
+
+    class Meta:
+        abstract = True
+
+class ResumoTotalAnual(Resumo):
+    #quantidade na unidade da tabela (litros, kg...); valor_dolares só em Importacao e Exportacao
+    tabela = models.TextField()
+    quantidade = models.DecimalField(decimal_places=2,max_digits=20)
+    valor_dolares = models.DecimalField(decimal_places=2,max_digits=20, null=True)
+
+    por = ["tabela", "ano"]
+
+class ResumoExportacaoPais(Resumo):
+    pais = models.ForeignKey(to = Pais, on_delete=models.PROTECT, related_name='+', db_index=False)
     quantidade = models.DecimalField(decimal_places=2,max_digits=20)
     valor_dolares = models.DecimalField(decimal_places=2,max_digits=20)
 
+    tabelas = ["Exportacao"]
+    por = ["pais", "ano"]
+
+class ResumoProcessamentoClassificacao(Resumo):
+    classificacao = models.ForeignKey(to = Classificacao, on_delete=models.PROTECT, related_name='+', db_index=False)
+    quantidade_kg = models.DecimalField(decimal_places=2,max_digits=20)
+
+    tabelas = ["Processamento"]
+    por = ["classificacao", "ano"]
 
+#tabelas de dados e resumos calculados a partir delas
+TABELAS = ["Producao", "Processamento", "Comercializacao", "Importacao", "Exportacao"]
+RESUMOS = [ResumoTotalAnual, ResumoExportacaoPais, ResumoProcessamentoClassificacao]
@@ -1,33 +1,126 @@
 from api.models import (
-    Producao,Processamento,Comercializacao,Importacao,Exportacao,Atualizacao)
+    Producao,Processamento,Comercializacao,Importacao,Exportacao,Atualizacao,Dimensao,
+    ResumoTotalAnual,ResumoExportacaoPais,ResumoProcessamentoClassificacao)
 from rest_framework import serializers
+from django.db import models
+from functools import lru_cache
+
+def nome():
+    """As dimensões são gravadas como id e devolvidas pelo nome."""
+    return serializers.SlugRelatedField(slug_field = "nome", read_only = True)
 
 class ProducaoSerializer(serializers.ModelSerializer):
+    produto = nome()
+
     class Meta:
         model = Producao
-        fields = '__all__'
+        exclude = ['substituido_em', 'subtotal']
 
 class ProcessamentoSerializer(serializers.ModelSerializer):
+    classificacao = nome()
+    cultivar = nome()
+
     class Meta:
         model = Processamento
-        fields = '__all__'
+        exclude = ['substituido_em', 'subtotal']
 
 class ComercializacaoSerializer(serializers.ModelSerializer):
+    produto = nome()
+
     class Meta:
         model = Comercializacao
-        fields = '__all__'
+        exclude = ['substituido_em', 'subtotal']
 
 class ImportacaoSerializer(serializers.ModelSerializer):
+    classificacao = nome()
+    pais = nome()
+
     class Meta:
         model = Importacao
-        fields = '__all__'
+        exclude = ['substituido_em']
 
 class ExportacaoSerializer(serializers.ModelSerializer):
+    classificacao = nome()
+    pais = nome()
+
     class Meta:
         model = Exportacao
-        fields = '__all__'
+        exclude = ['substituido_em']
+
+class ResumoTotalAnualSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ResumoTotalAnual
+        fields = ['tabela', 'ano', 'quantidade', 'valor_dolares']
+
+class ResumoExportacaoPaisSerializer(serializers.ModelSerializer):
+    pais = nome()
+
+    class Meta:
+        model = ResumoExportacaoPais
+        fields = ['pais', 'ano', 'quantidade', 'valor_dolares']
+
+class ResumoProcessamentoClassificacaoSerializer(serializers.ModelSerializer):
+    classificacao = nome()
+
+    class Meta:
+        model = ResumoProcessamentoClassificacao
+        fields = ['classificacao', 'ano', 'quantidade_kg']
 
 class AtualizacaoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Atualizacao
         fields = '__all__'
+
+
+class LeituraRapida:
+    """Caminho de leitura otimizado para as tabelas de dados.
+
+    Em vez de instanciar um model e rodar o to_representation de cada campo por linha,
+    busca tuplas com .values_list() e só converte os campos que precisam (Decimal vira
+    string, como o DecimalField do DRF faz; o valor já vem quantizado do banco). A saída é idêntica à do ModelSerializer
+    informado, com os campos na mesma ordem. O nome das dimensões vem do JOIN com a tabela de cada uma.
+    """
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.campos = list(serializer_class().fields.keys())
+        self.colunas_db = [coluna(model._meta.get_field(campo)) for campo in self.campos]
+        self.decimais = [
+            i for i, campo in enumerate(self.campos)
+            if isinstance(model._meta.get_field(campo), models.DecimalField)
+        ]
+
+    def tuplas(self, queryset, chunk_size:int = None):
+        """Tuplas já convertidas, na ordem de self.campos."""
+        linhas = queryset.values_list(*self.colunas_db)
+        linhas = linhas.iterator(chunk_size = chunk_size) if chunk_size else linhas
+        decimais = self.decimais
+        for linha in linhas:
+            linha = list(linha)
+            for i in decimais:
+                linha[i] = None if linha[i] is None else format(linha[i], "f")
+            yield linha
+
+    def linhas(self, queryset, chunk_size:int = None):
+        """Uma dict por linha, no mesmo formato do ModelSerializer(many = True)."""
+        campos = self.campos
+        for linha in self.tuplas(queryset, chunk_size):
+            yield dict(zip(campos, linha))
+
+    def colunas(self, queryset) -> dict:
+        """Layout colunar: {campo: [valores]}, mais compacto para consumo em DataFrames."""
+        valores = list(zip(*self.tuplas(queryset)))
+        return {campo: list(valores[i]) if valores else [] for i, campo in enumerate(self.campos)}
+
+
+def coluna(field) -> str:
+    """Caminho do values_list de um campo: o nome, para as dimensões, ou a coluna do próprio model."""
+    if field.is_relation and issubclass(field.related_model, Dimensao):
+        return f"{field.name}__nome"
+    return field.attname
+
+
+@lru_cache(maxsize = None)
+def leitura_rapida(serializer_class) -> LeituraRapida:
+    """LeituraRapida de um serializer, montada uma única vez por classe."""
+    return LeituraRapida(serializer_class)
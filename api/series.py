@@ -0,0 +1,105 @@
+"""Índice em memória das séries por entidade, usado pelo endpoint serie/.
+
+Para cada (atualizacao, tabela) a versão é lida uma única vez, na primeira consulta, e vira
+arrays contíguos do numpy ordenados por entidade e ano, mais um dict {entidade: trecho}.
+A entidade é a tupla com os nomes das dimensões da tabela (ex: (classificacao, pais)), então
+uma consulta é um lookup no dict e um recorte dos arrays, sem ir ao banco.
+
+Os índices ficam no processo, até settings.SERIES_INDICES_MAX; ao passar disso o menos
+usado é descartado. Valem enquanto a geração da atualizacao no cache de respostas não muda. Funciona com as atualizacoes em linhas e compactas (api.compacto).
+
+Os CSVs com categorias repetem nomes (ex: Tinto em VINHO DE MESA e em VINHO FINO DE MESA) e as
+tabelas não guardam a categoria: uma entidade com mais de uma linha no mesmo ano não tem uma
+série única, e a consulta a ela levanta SerieAmbigua em vez de misturar as séries.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from api import compacto, exports, serializer
+from api.cache import geracao
+from api.filters import dimensao_do_model, metricas_do_model
+
+_lock = threading.Lock()
+_indices = OrderedDict()
+
+
+class SerieAmbigua(Exception):
+    """A entidade tem mais de uma série na versão."""
+
+
+class IndiceSeries:
+    """Séries de uma tabela numa versão. anos e valores (uma coluna por métrica) estão ordenados
+    por entidade e ano; posicoes traz o trecho [inicio, fim) de cada entidade e ambiguas as
+    entidades com ano repetido."""
+
+    def __init__(self, model, df):
+        self.dimensoes = [campo for campo in df.columns if campo in ("classificacao", "pais", "produto", "cultivar")
+                          and dimensao_do_model(model, campo) is not None]
+        self.metricas = metricas_do_model(model)
+        ordem = df.sort_values(self.dimensoes + ["ano"], kind = "stable", ignore_index = True)
+        self.anos = np.ascontiguousarray(ordem["ano"].to_numpy(dtype = np.int64))
+        self.valores = np.ascontiguousarray(ordem[self.metricas].to_numpy(dtype = float))
+        repetidas = ordem.duplicated(self.dimensoes + ["ano"], keep = False).to_numpy()
+        self.ambiguas = set(ordem.loc[repetidas, self.dimensoes].itertuples(index = False, name = None))
+        self.posicoes = {}
+        for chave, linhas in ordem.groupby(self.dimensoes, sort = False).indices.items():
+            chave = chave if isinstance(chave, tuple) else (chave,)
+            self.posicoes[chave] = (int(linhas[0]), int(linhas[-1]) + 1)
+
+    def serie(self, chave:tuple, ano_min:int = None, ano_max:int = None):
+        """(anos, valores) da entidade, views dos arrays do índice, ou None se ela não existe na versão.
+        Levanta SerieAmbigua se a entidade tem mais de uma série."""
+        trecho = self.posicoes.get(chave)
+        if trecho is None:
+            return None
+        if chave in self.ambiguas:
+            raise SerieAmbigua(f"{dict(zip(self.dimensoes, chave))} matches more than one series in this version "
+                               "(the same name appears under different categories of the source file).")
+        anos = self.anos[trecho[0]:trecho[1]]
+        inicio = 0 if ano_min is None else int(np.searchsorted(anos, ano_min, side = "left"))
+        fim = len(anos) if ano_max is None else int(np.searchsorted(anos, ano_max, side = "right"))
+        return anos[inicio:fim], self.valores[trecho[0] + inicio:trecho[0] + fim]
+
+
+def construir(model, atualizacao) -> IndiceSeries:
+    """Lê a tabela inteira da versão, pelo mesmo caminho do exportar-tabela."""
+    if atualizacao.armazenamento == "compacto":
+        items = compacto.filtrar(model, atualizacao, {})
+    else:
+        items = model.objects.da_versao(atualizacao)
+    return IndiceSeries(model, exports.dataframe(items, getattr(serializer, f"{model.__name__}Serializer")))
+
+
+def indice(model, atualizacao_id:int, carregar) -> IndiceSeries:
+    """Índice da tabela na atualizacao, construído na primeira consulta. carregar() retorna a
+    atualizacao; só é chamado quando o índice não está em memória. Só as atualizacoes com
+    SUCESSO ficam guardadas: as demais ainda podem mudar.
+    Cada índice guarda a geração da atualizacao no cache compartilhado (api.cache): deletada por
+    outro processo, a geração muda e o índice deixa de valer aqui também."""
+    chave = (atualizacao_id, model.__name__)
+    atual = geracao(atualizacao_id)
+    with _lock:
+        if chave in _indices and _indices[chave][0] == atual:
+            _indices.move_to_end(chave)
+            return _indices[chave][1]
+    atualizacao = carregar()
+    #construído fora da trava: uma carga lenta não bloqueia as consultas aos outros índices
+    novo = construir(model, atualizacao)
+    if atualizacao.status != "SUCESSO":
+        return novo
+    with _lock:
+        _indices[chave] = (atual, novo)
+        _indices.move_to_end(chave)
+        while len(_indices) > settings.SERIES_INDICES_MAX:
+            _indices.popitem(last = False)
+    return novo
+
+
+def descartar(atualizacao_id:int):
+    """Remove da memória os índices da atualizacao (ex: quando ela é deletada)."""
+    with _lock:
+        for chave in [chave for chave in _indices if chave[0] == atualizacao_id]:
+            del _indices[chave]
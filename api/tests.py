@@ -1,3 +1,1071 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import io
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import ProtectedError, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from api import cache, exports, jobs, series
+from api.filters import filtrar
+from api.models import (
+    Atualizacao, Classificacao, Exportacao, Pais, Processamento, Producao,
+    ResumoExportacaoPais, ResumoProcessamentoClassificacao, ResumoTotalAnual, SerieCompacta)
+from api.serializer import ExportacaoSerializer, coluna, leitura_rapida
+from api.views import stream_json
+from scripts import DefaultEmbrapaPipeline
+
+EXPORTACAO_CSV = (
+    "Id;País;2020;2020;2021;2021\n"
+    "1;Alemanha;10;100;20;200\n"
+    "2;Angola;0;0;5;55\n"
+)
+
+PROCESSAMENTO_CSV = (
+    "id\tcontrol\tcultivar\t2020\t2021\n"
+    "1\tTINTAS\tTINTAS\t100\tnd\n"
+    "2\tti_alicante\tAlicante Bouschet\t*\t30\n"
+)
+
+
+with open("sources.json") as f:
+    SOURCES = json.load(f)['sources']
+
+#o cache de respostas dos testes fica num diretório só desta execução, ligado antes do banco de teste
+#ser criado: o padrão é compartilhado com a API rodando na máquina, e os pks dos testes se repetem
+CACHE_DOS_TESTES = tempfile.TemporaryDirectory(prefix = "testes_respostas_")
+override_settings(CACHES = {**settings.CACHES, cache.ALIAS: {
+    **settings.CACHES[cache.ALIAS], "BACKEND": "api.cache.ArquivosLimitados", "LOCATION": CACHE_DOS_TESTES.name}}).enable()
+
+
+def escrever_csv(diretorio:str, nome:str, conteudo:str) -> str:
+    caminho = os.path.join(diretorio, nome)
+    with open(caminho, "w", encoding = "utf-8") as f:
+        f.write(conteudo)
+    return caminho
+
+
+class CargaEmLoteTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def carregar(self, pipeline, fonte, csv_file_path, model):
+        atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+        pipeline.handle(SOURCES[fonte], csv_file_path, atualizacao)
+        return list(model.objects.filter(atualizacao = atualizacao)
+                    .order_by("id").values_list(*[f.name for f in model._meta.fields if f.name not in ("id", "atualizacao")]))
+
+    def test_transform_pareia_quantidade_e_valor_por_posicao(self):
+        resultado = DefaultEmbrapaPipeline().transform(SOURCES["exportacao_espumantes"],
+                                                       escrever_csv(self.tmp.name, "exp.csv", EXPORTACAO_CSV))
+        self.assertEqual(resultado["prod_table"], "Exportacao")
+        self.assertEqual(resultado["constantes"], {"classificacao": "espumantes"})
+        self.assertEqual(resultado["df"].to_dict("records"), [
+            {"pais": "Alemanha", "ano": 2020, "quantidade": 10, "valor_dolares": 100},
+            {"pais": "Angola", "ano": 2020, "quantidade": 0, "valor_dolares": 0},
+            {"pais": "Alemanha", "ano": 2021, "quantidade": 20, "valor_dolares": 200},
+            {"pais": "Angola", "ano": 2021, "quantidade": 5, "valor_dolares": 55},
+        ])
+
+        #uma fonte nova só precisa da entrada no sources.json
+        source = {"prod_table": "Producao", "delimiter": ",", "dimensoes": {"produto": "Item"}, "valores": ["quantidade_litros"]}
+        df = DefaultEmbrapaPipeline().transform(source, escrever_csv(self.tmp.name, "nova.csv", "Item,1999,2000\nSuco,1,\n"))["df"]
+        self.assertEqual(df.to_dict("records"), [{"produto": "Suco", "ano": 1999, "quantidade_litros": 1},
+                                                 {"produto": "Suco", "ano": 2000, "quantidade_litros": 0}])
+        with self.assertRaises(ValueError):
+            DefaultEmbrapaPipeline().transform(SOURCES["exportacao_espumantes"],
+                                               escrever_csv(self.tmp.name, "impar.csv", "Id;País;2020;2020;2021\n1;A;1;2;3\n"))
+
+    def test_limpeza_numerica(self):
+        csv_file_path = escrever_csv(self.tmp.name, "proc.csv", (
+            "id\tcontrol\tcultivar\t2020\t2021\t2022\n"
+            "1\tTINTAS\tTINTAS\t100\tnd\t12.5\n"
+            "2\tti_alicante\tAlicante Bouschet\t*\t\t?\n"
+        ))
+        resultado = DefaultEmbrapaPipeline().transform(SOURCES["processamento_americanas"], csv_file_path)
+        self.assertEqual(resultado["df"]["quantidade_kg"].tolist(), [100, 0, 0, 0, 12.5, 0])
+        self.assertEqual(resultado["limpeza"], {"celulas": 6, "vazios": 1, "sentinelas": {"nd": 1, "*": 1}, "invalidos": 1})
+
+        source = {**SOURCES["processamento_americanas"], "sentinelas": {"nd": -1}}
+        resultado = DefaultEmbrapaPipeline().transform(source, csv_file_path)
+        self.assertEqual(resultado["df"]["quantidade_kg"].tolist(), [100, 0, -1, 0, 12.5, 0])
+        self.assertEqual(resultado["limpeza"]["invalidos"], 2)
+
+    def test_arquivos_de_teste(self):
+        #os CSVs versionados em test_data/ são os usados pelos benchmarks
+        for fonte, source in SOURCES.items():
+            resultado = DefaultEmbrapaPipeline().transform(source, source["test_file"])
+            self.assertGreater(len(resultado["df"]), 0, fonte)
+            self.assertEqual(resultado["limpeza"]["invalidos"], 0, fonte)
+
+    def test_benchmark_de_limpeza(self):
+        from benchmarks import limpeza
+        saida = io.StringIO()
+        with mock.patch("sys.argv", ["limpeza.py", "--dir", "test_data", "--repeticoes", "1"]), redirect_stdout(saida):
+            limpeza.main()
+        linhas = saida.getvalue().splitlines()[1:]
+        self.assertEqual(len(linhas), 4)
+        self.assertNotIn("não encontrado", saida.getvalue())
+
+    def test_lote_grava_as_mesmas_linhas_que_o_loop(self):
+        casos = [
+            ("exportacao_espumantes", escrever_csv(self.tmp.name, "exp.csv", EXPORTACAO_CSV), Exportacao),
+            ("processamento_americanas", escrever_csv(self.tmp.name, "proc.csv", PROCESSAMENTO_CSV), Processamento),
+        ]
+        for fonte, csv_file_path, model in casos:
+            loop = self.carregar(DefaultEmbrapaPipeline(bulk = False), fonte, csv_file_path, model)
+            lote = self.carregar(DefaultEmbrapaPipeline(batch_size = 3), fonte, csv_file_path, model)
+            self.assertEqual(len(lote), 4)
+            self.assertEqual(loop, lote)
+
+
+class ServidorCSV:
+    """Servidor HTTP local que faz o papel do site da EMBRAPA nos testes.
+    arquivos é um dict {caminho: conteúdo}; falhas é um dict {caminho: nº de respostas 500 antes de servir}."""
+
+    def __init__(self, arquivos:dict, falhas:dict = None):
+        self.arquivos = arquivos
+        self.falhas = dict(falhas or {})
+        self.requisicoes = []
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor.requisicoes.append(self.path)
+                if servidor.falhas.get(self.path, 0) > 0:
+                    servidor.falhas[self.path] -= 1
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                if self.path not in servidor.arquivos:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                conteudo = servidor.arquivos[self.path].encode("utf-8")
+                etag = f'"{hashlib.md5(conteudo).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(conteudo)))
+                self.end_headers()
+                self.wfile.write(conteudo)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class DownloaderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def pipeline(self, **kwargs):
+        return DefaultEmbrapaPipeline(manifest_file = os.path.join(self.tmp.name, "cache", "manifest.json"), **kwargs)
+
+    def sources(self, servidor, nomes):
+        return {
+            nome: {
+                "url": f"{servidor.url}/{nome}.csv",
+                "dst_file": os.path.join(self.tmp.name, "cache", f"{nome}.csv"),
+            }
+            for nome in nomes
+        }
+
+    def test_baixa_todas_as_fontes_em_paralelo(self):
+        arquivos = {f"/fonte_{i}.csv": EXPORTACAO_CSV * (i + 1) for i in range(6)}
+        servidor = ServidorCSV(arquivos)
+        self.addCleanup(servidor.close)
+        sources = self.sources(servidor, [f"fonte_{i}" for i in range(6)])
+
+        status = self.pipeline(download_workers = 3, chunk_size = 16).downloader(sources)
+
+        self.assertEqual(set(status.values()), {"baixado"})
+        for nome, source in sources.items():
+            with open(source["dst_file"], encoding = "utf-8") as f:
+                self.assertEqual(f.read(), arquivos[f"/{nome}.csv"])
+        self.assertFalse([x for x in os.listdir(os.path.join(self.tmp.name, "cache")) if x.endswith(".part")])
+
+    def test_tenta_novamente_com_backoff(self):
+        servidor = ServidorCSV({"/instavel.csv": EXPORTACAO_CSV}, falhas = {"/instavel.csv": 2})
+        self.addCleanup(servidor.close)
+        sources = self.sources(servidor, ["instavel"])
+
+        status = self.pipeline(retries = 2, backoff = 0.01).downloader(sources)
+
+        self.assertEqual(status, {"instavel": "baixado"})
+        self.assertEqual(servidor.requisicoes.count("/instavel.csv"), 3)
+
+    def test_falha_nao_sobrescreve_o_cache(self):
+        servidor = ServidorCSV({})
+        self.addCleanup(servidor.close)
+        sources = self.sources(servidor, ["inexistente"])
+        os.makedirs(os.path.join(self.tmp.name, "cache"))
+        escrever_csv(os.path.join(self.tmp.name, "cache"), "inexistente.csv", "antigo")
+
+        status = self.pipeline(retries = 1, backoff = 0.01).downloader(sources)
+
+        self.assertEqual(status, {"inexistente": "erro"})
+        with open(sources["inexistente"]["dst_file"], encoding = "utf-8") as f:
+            self.assertEqual(f.read(), "antigo")
+
+        #um erro de disco ao gravar também não deixa o .part
+        servidor.arquivos["/inexistente.csv"] = EXPORTACAO_CSV
+        replace = os.replace
+
+        def disco_cheio(origem, destino):
+            if destino == sources["inexistente"]["dst_file"]:
+                raise OSError("No space left on device")
+            replace(origem, destino)
+
+        with mock.patch("scripts.os.replace", side_effect = disco_cheio):
+            status = self.pipeline(retries = 1, backoff = 0.01).downloader(sources)
+        self.assertEqual(status, {"inexistente": "erro"})
+        self.assertFalse([x for x in os.listdir(os.path.join(self.tmp.name, "cache")) if x.endswith(".part")])
+        with open(sources["inexistente"]["dst_file"], encoding = "utf-8") as f:
+            self.assertEqual(f.read(), "antigo")
+
+    def test_requisicao_condicional_nao_baixa_arquivo_inalterado(self):
+        servidor = ServidorCSV({"/fonte.csv": EXPORTACAO_CSV})
+        self.addCleanup(servidor.close)
+        sources = self.sources(servidor, ["fonte"])
+        pipeline = self.pipeline()
+
+        self.assertEqual(pipeline.downloader(sources), {"fonte": "baixado"})
+        entrada = pipeline.carregar_manifest()["fonte"]
+        self.assertEqual(entrada["sha256"], hashlib.sha256(EXPORTACAO_CSV.encode("utf-8")).hexdigest())
+        self.assertEqual(entrada["content_length"], len(EXPORTACAO_CSV.encode("utf-8")))
+
+        self.assertEqual(pipeline.downloader(sources), {"fonte": "inalterado"})
+
+        servidor.arquivos["/fonte.csv"] = PROCESSAMENTO_CSV
+        self.assertEqual(pipeline.downloader(sources), {"fonte": "baixado"})
+        with open(sources["fonte"]["dst_file"], encoding = "utf-8") as f:
+            self.assertEqual(f.read(), PROCESSAMENTO_CSV)
+
+
+class RunTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.servidor = ServidorCSV({
+            "/exportacao_espumantes.csv": EXPORTACAO_CSV,
+            "/processamento_americanas.csv": PROCESSAMENTO_CSV,
+        })
+        self.addCleanup(self.servidor.close)
+        self.sources = {
+            nome: {
+                **SOURCES[nome],
+                "url": f"{self.servidor.url}/{nome}.csv",
+                "dst_file": os.path.join(self.tmp.name, "cache", f"{nome}.csv"),
+            }
+            for nome in ["exportacao_espumantes", "processamento_americanas"]
+        }
+
+    def executar(self, **opcoes):
+        atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+        DefaultEmbrapaPipeline(manifest_file = os.path.join(self.tmp.name, "cache", "manifest.json"), **opcoes).run(self.sources, atualizacao)
+        return atualizacao
+
+    def linhas(self, model, atualizacao):
+        campos = [coluna(f) for f in model._meta.fields if f.name not in ("id", "atualizacao", "substituido_em")]
+        return sorted(model.objects.da_versao(atualizacao).values_list(*campos))
+
+    def test_fonte_inalterada_e_copiada_sem_reprocessar(self):
+        primeira = self.executar()
+        self.servidor.arquivos["/processamento_americanas.csv"] = PROCESSAMENTO_CSV.replace("100", "101")
+
+        with mock.patch.object(DefaultEmbrapaPipeline, "transform", autospec = True,
+                               side_effect = DefaultEmbrapaPipeline.transform) as transform:
+            segunda = self.executar()
+        self.assertEqual([chamada.args[1]["prod_table"] for chamada in transform.call_args_list], ["Processamento"])
+
+        campos = ("classificacao", "pais", "ano", "quantidade", "valor_dolares")
+        self.assertEqual(
+            list(Exportacao.objects.filter(atualizacao = primeira).order_by("id").values_list(*campos)),
+            list(Exportacao.objects.filter(atualizacao = segunda).order_by("id").values_list(*campos)))
+        self.assertEqual(Processamento.objects.filter(atualizacao = segunda, quantidade_kg = 101).count(), 1)
+
+    def test_carga_diferencial_grava_apenas_o_delta(self):
+        primeira = self.executar()
+        self.servidor.arquivos["/exportacao_espumantes.csv"] = (
+            "Id;País;2020;2020;2021;2021\n"
+            "1;Alemanha;10;100;25;250\n"
+            "3;Argentina;1;11;2;22\n"
+        )
+
+        segunda = self.executar(modo = "diferencial")
+        self.assertEqual(segunda.base, primeira)
+        #Alemanha/2021 alterada + Argentina 2020/2021 inseridas; Processamento inalterado
+        self.assertEqual(Exportacao.objects.filter(atualizacao = segunda).count(), 3)
+        self.assertEqual(Processamento.objects.filter(atualizacao = segunda).count(), 0)
+        self.assertEqual(Exportacao.objects.filter(substituido_em = segunda).count(), 3)
+
+        terceira = self.executar(modo = "diferencial")
+        self.assertEqual(terceira.base, segunda)
+        self.assertEqual(Exportacao.objects.filter(atualizacao = terceira).count(), 0)
+
+        completa = self.executar()
+        for model in (Exportacao, Processamento):
+            self.assertEqual(self.linhas(model, segunda), self.linhas(model, completa))
+            self.assertEqual(self.linhas(model, terceira), self.linhas(model, completa))
+        self.assertEqual(len(self.linhas(Exportacao, primeira)), 4)
+        self.assertIn(("espumantes", "Angola", 2021, 5, 55), self.linhas(Exportacao, primeira))
+
+        with self.assertRaises(ProtectedError):
+            primeira.delete()
+
+    def test_nomes_repetidos_em_categorias(self):
+        #em test_data/producao.csv os mesmos produtos aparecem em todas as categorias
+        csv = pd.read_csv(SOURCES["producao"]["test_file"], delimiter = ";", dtype = {"1970": "int64"})
+        repetido = csv.index[csv["produto"] == "Produto comum 1"]
+        self.assertGreater(len(repetido), 1)
+        self.sources = {"producao": {**SOURCES["producao"], "test_file": os.path.join(self.tmp.name, "producao.csv"),
+                                     "dst_file": os.path.join(self.tmp.name, "cache", "producao.csv")}}
+        csv.to_csv(self.sources["producao"]["test_file"], sep = ";", index = False)
+
+        primeira = self.executar(origem = "teste")
+        comum = Producao.objects.filter(atualizacao = primeira, produto__nome = "Produto comum 1")
+        self.assertEqual(comum.count(), len(repetido) * (len(csv.columns) - 3))
+
+        #só a linha alterada, numa das categorias, entra no delta
+        csv.loc[repetido[1], "1970"] += 1
+        csv.to_csv(self.sources["producao"]["test_file"], sep = ";", index = False)
+        segunda = self.executar(origem = "teste", modo = "diferencial")
+        self.assertEqual(list(Producao.objects.filter(atualizacao = segunda).values_list("produto__nome", "ano")),
+                         [("Produto comum 1", 1970)])
+        self.assertEqual(Producao.objects.filter(substituido_em = segunda).count(), 1)
+        self.assertEqual(len(self.linhas(Producao, segunda)), len(self.linhas(Producao, primeira)))
+
+    def test_resumos_sem_as_linhas_de_categoria(self):
+        #em test_data/ cada linha de categoria é a soma dos seus itens
+        self.sources = {fonte: {**SOURCES[fonte], "dst_file": os.path.join(self.tmp.name, "cache", f"{fonte}.csv")}
+                        for fonte in ("producao", "processamento_viniferas", "processamento_sem_classificacao")}
+        esperado = {}
+        for fonte, source in self.sources.items():
+            csv = pd.read_csv(source["test_file"], delimiter = source["delimiter"])
+            anos = [coluna for coluna in csv.columns if coluna.isdigit()]
+            valores = csv[anos].apply(pd.to_numeric, errors = "coerce").fillna(0).to_numpy()
+            categoria = (csv["control"] == csv[next(iter(source["dimensoes"].values()))]).to_numpy()
+            self.assertEqual(valores[categoria].sum(), valores[~categoria].sum(), fonte)
+            esperado[source["prod_table"]] = esperado.get(source["prod_table"], 0) + valores[~categoria].sum()
+
+        #blocos de 7 linhas: categorias partidas entre blocos
+        for opcoes in ({}, {"chunk_rows": 7}):
+            atualizacao = self.executar(origem = "teste", **opcoes)
+            totais = dict(ResumoTotalAnual.objects.filter(atualizacao = atualizacao).values("tabela")
+                          .annotate(total = Sum("quantidade")).values_list("tabela", "total"))
+            self.assertEqual({tabela: float(total) for tabela, total in totais.items()}, esperado, opcoes)
+
+        #uma categoria sem itens (ex: Sem classificação) é uma linha comum
+        csv = pd.DataFrame({"control": ["TINTAS", "ti_a", "Sem classificação"], "cultivar": ["TINTAS", "A", "Sem classificação"]})
+        self.assertEqual(DefaultEmbrapaPipeline().subtotais(SOURCES["processamento_americanas"], csv).tolist(), [True, False, False])
+
+    def test_serie_de_nome_repetido_em_categorias(self):
+        #em test_data/producao.csv "Produto comum 1" aparece em todas as categorias e "Produto 003" só em uma
+        self.sources = {"producao": {**SOURCES["producao"], "dst_file": os.path.join(self.tmp.name, "cache", "producao.csv")}}
+        for armazenamento in ("linhas", "compacto"):
+            atualizacao = self.executar(origem = "teste", armazenamento = armazenamento)
+            series.descartar(atualizacao.id)
+            url = f"/api/serie/producao/{atualizacao.id}/"
+            self.assertEqual(self.client.get(url, {"produto": "Produto comum 1"}).status_code, 409, armazenamento)
+            unica = self.client.get(url, {"produto": "Produto 003"}).json()
+            self.assertEqual(unica["anos"], list(range(1970, 2024)), armazenamento)
+
+    def test_carga_parcial_em_blocos(self):
+        primeira = self.executar()
+        self.servidor.arquivos["/exportacao_espumantes.csv"] = EXPORTACAO_CSV.replace("5;55", "6;66")
+        self.sources.pop("processamento_americanas")
+        with mock.patch.object(DefaultEmbrapaPipeline, "inserir", autospec = True, side_effect = DefaultEmbrapaPipeline.inserir) as inserir:
+            parcial = self.executar(parcial = True, chunk_rows = 1)
+        #uma gravação por bloco de uma linha do CSV (dois anos), sem juntar a fonte inteira
+        self.assertEqual([len(chamada.args[3]) for chamada in inserir.call_args_list], [2, 2])
+        self.assertEqual(parcial.base, primeira)
+        self.assertEqual(Exportacao.objects.filter(substituido_em = parcial).count(), 4)
+        self.assertEqual(self.linhas(Processamento, parcial), self.linhas(Processamento, primeira))
+        exportacao = self.linhas(Exportacao, parcial)
+        self.assertEqual(len(exportacao), 4)
+        self.assertIn(("espumantes", "Angola", 2021, 6, 66), exportacao)
+        self.assertIn(("espumantes", "Alemanha", 2020, 10, 100), exportacao)
+
+    def test_metricas_gravadas_em_detalhes(self):
+        primeira = self.executar()
+        self.servidor.arquivos["/processamento_americanas.csv"] = PROCESSAMENTO_CSV.replace("100", "101")
+        segunda = self.executar(chunk_rows = 1)
+
+        detalhes = json.loads(primeira.detalhes)
+        self.assertGreater(detalhes["duracao_s"], 0)
+        metricas = detalhes["fontes"]["exportacao_espumantes"]["metricas"]
+        self.assertEqual(metricas["linhas"], 4)
+        self.assertEqual(metricas["bytes"], len(EXPORTACAO_CSV.encode()))
+        for etapa in ("download_s", "read_csv_s", "reshape_s", "insert_s", "linhas_por_s"):
+            self.assertGreater(metricas[etapa], 0)
+
+        fontes = json.loads(segunda.detalhes)["fontes"]
+        self.assertEqual(fontes["exportacao_espumantes"]["metricas"]["linhas"], 4)
+        self.assertIn("copia_s", fontes["exportacao_espumantes"]["metricas"])
+        self.assertEqual(fontes["processamento_americanas"]["metricas"]["linhas"], 4)
+        self.assertEqual(fontes["processamento_americanas"]["limpeza"]["sentinelas"], {"nd": 1, "*": 1})
+
+        texto = self.client.get("/api/metricas/").content.decode()
+        self.assertIn('embrapa_atualizacoes{status="SUCESSO"} 2', texto)
+        self.assertIn(f'embrapa_ingestao_linhas{{atualizacao="{segunda.id}",fonte="processamento_americanas"}} 4', texto)
+        self.assertIn(f'embrapa_ingestao_etapa_segundos{{atualizacao="{segunda.id}",fonte="exportacao_espumantes",etapa="copia"}}', texto)
+
+    def test_carga_em_blocos(self):
+        completa = self.executar()
+        os.remove(os.path.join(self.tmp.name, "cache", "manifest.json"))
+        em_blocos = self.executar(chunk_rows = 1)
+        for model in (Exportacao, Processamento):
+            self.assertEqual(self.linhas(model, completa), self.linhas(model, em_blocos))
+
+        self.servidor.arquivos["/exportacao_espumantes.csv"] = EXPORTACAO_CSV.replace("5;55", "6;66")
+        diferencial = self.executar(modo = "diferencial", chunk_rows = 1)
+        self.assertEqual(Exportacao.objects.filter(atualizacao = diferencial).count(), 1)
+        self.assertEqual(Exportacao.objects.filter(substituido_em = diferencial).count(), 1)
+        self.assertIn(("espumantes", "Angola", 2021, 6, 66), self.linhas(Exportacao, diferencial))
+
+        with self.assertRaises(ValueError):
+            DefaultEmbrapaPipeline(chunk_rows = 1, parse_workers = 2)
+
+    def test_transformacao_em_pool_de_processos(self):
+        serial = self.executar()
+        os.remove(os.path.join(self.tmp.name, "cache", "manifest.json"))
+        paralela = self.executar(parse_workers = 2, parse_min_bytes = 0)
+        for model in (Exportacao, Processamento):
+            self.assertEqual(self.linhas(model, serial), self.linhas(model, paralela))
+        self.assertEqual(Exportacao.objects.filter(atualizacao = paralela).count(), 4)
+
+        #CSVs pequenos não pagam a partida do pool
+        os.remove(os.path.join(self.tmp.name, "cache", "manifest.json"))
+        with mock.patch("scripts.ProcessPoolExecutor") as pool:
+            self.executar(parse_workers = 2)
+        pool.assert_not_called()
+
+    def test_carga_parcial_herda_as_demais_fontes(self):
+        completa = self.executar()
+        self.servidor.arquivos["/exportacao_espumantes.csv"] = EXPORTACAO_CSV.replace("5;55", "6;66")
+        self.servidor.arquivos["/processamento_americanas.csv"] = PROCESSAMENTO_CSV.replace("100", "101")
+        self.sources.pop("processamento_americanas")
+
+        parcial = self.executar(parcial = True, chunk_rows = 1)
+        self.assertEqual(parcial.base, completa)
+        self.assertEqual(Exportacao.objects.filter(atualizacao = parcial).count(), 4)
+        self.assertEqual(Processamento.objects.filter(atualizacao = parcial).count(), 0)
+        self.assertEqual(self.linhas(Processamento, parcial), self.linhas(Processamento, completa))
+        self.assertIn(("espumantes", "Angola", 2021, 6, 66), self.linhas(Exportacao, parcial))
+        self.assertEqual(len(self.linhas(Exportacao, parcial)), 4)
+        self.assertEqual(len(self.linhas(Exportacao, completa)), 4)
+
+        #a fonte inalterada desde a cadeia da base não é reprocessada
+        with mock.patch.object(DefaultEmbrapaPipeline, "transform", autospec = True) as transform:
+            outra = self.executar(parcial = True)
+        transform.assert_not_called()
+        self.assertEqual(self.linhas(Exportacao, outra), self.linhas(Exportacao, parcial))
+
+    def resumos(self, atualizacao) -> list:
+        """Os resumos gravados na carga e os mesmos agregados calculados no banco sobre a versão."""
+        exportacao = Exportacao.objects.da_versao(atualizacao)
+        #as linhas de categoria (TINTAS) repetem a soma dos itens e ficam fora dos resumos
+        processamento = Processamento.objects.da_versao(atualizacao).filter(subtotal = False)
+        totais = ([("Exportacao", *linha) for linha in exportacao.values_list("ano").annotate(Sum("quantidade"), Sum("valor_dolares"))] +
+                  [("Processamento", *linha, None) for linha in processamento.values_list("ano").annotate(Sum("quantidade_kg"))])
+        gravados = [
+            ResumoTotalAnual.objects.filter(atualizacao = atualizacao).values_list("tabela", "ano", "quantidade", "valor_dolares"),
+            ResumoExportacaoPais.objects.filter(atualizacao = atualizacao).values_list("pais__nome", "ano", "quantidade", "valor_dolares"),
+            ResumoProcessamentoClassificacao.objects.filter(atualizacao = atualizacao).values_list("classificacao__nome", "ano", "quantidade_kg"),
+        ]
+        calculados = [
+            totais,
+            exportacao.values_list("pais__nome", "ano").annotate(Sum("quantidade"), Sum("valor_dolares")),
+            processamento.values_list("classificacao__nome", "ano").annotate(Sum("quantidade_kg")),
+        ]
+        return [sorted(gravados) for gravados in gravados], [sorted(calculados) for calculados in calculados]
+
+    def test_resumos_gravados_ao_final_da_carga(self):
+        completa = self.executar()
+        self.servidor.arquivos["/exportacao_espumantes.csv"] = EXPORTACAO_CSV.replace("5;55", "6;66")
+        #Processamento inalterado desde a base: o resumo dele vem do banco
+        diferencial = self.executar(modo = "diferencial", chunk_rows = 1)
+        self.servidor.arquivos["/processamento_americanas.csv"] = PROCESSAMENTO_CSV.replace("*\t30", "*\t31")
+        #Exportacao inalterada: copiada, e o resumo dela vem do banco
+        copiada = self.executar()
+        self.sources.pop("exportacao_espumantes")
+        parcial = self.executar(parcial = True)
+
+        for atualizacao in (completa, diferencial, copiada, parcial):
+            gravados, calculados = self.resumos(atualizacao)
+            self.assertEqual(gravados, calculados)
+            self.assertTrue(all(gravados))
+        self.assertIn(("Processamento", 2021, 31, None), self.resumos(copiada)[0][0])
+
+        url = f"/api/resumo/exportacao-pais/{copiada.id}/"
+        self.assertEqual(self.client.get(url, {"pais": "Angola"}).json(), [
+            {"pais": "Angola", "ano": 2020, "quantidade": "0.00", "valor_dolares": "0.00"},
+            {"pais": "Angola", "ano": 2021, "quantidade": "6.00", "valor_dolares": "66.00"}])
+        totais = self.client.get(f"/api/resumo/total-anual/{copiada.id}/", {"tabela": "processamento"}).json()
+        self.assertEqual(totais[1], {"tabela": "Processamento", "ano": 2021, "quantidade": "31.00", "valor_dolares": None})
+        self.assertEqual(self.client.get(f"/api/resumo/inexistente/{copiada.id}/").status_code, 400)
+
+    def test_armazenamento_compacto(self):
+        #o cache de respostas não volta com o rollback do banco entre os testes
+        cache.cache().clear()
+        linhas = self.executar()
+        #fontes inalteradas não são copiadas de uma atualizacao em linhas
+        compacta = self.executar(armazenamento = "compacto")
+        self.assertEqual(compacta.armazenamento, "compacto")
+        self.assertEqual(SerieCompacta.objects.filter(atualizacao = compacta).count(), 4)
+        self.assertEqual(Exportacao.objects.filter(atualizacao = compacta).count(), 0)
+        self.assertEqual(self.resumos(compacta)[0], self.resumos(linhas)[0])
+
+        def sem_id(resposta):
+            return sorted(tuple(linha[campo] for campo in linha if campo not in ("id", "atualizacao")) for linha in resposta)
+
+        for table, params in [("exportacao", {}), ("processamento", {}), ("exportacao", {"pais": "Angola", "ano_min": 2021})]:
+            esperado = self.client.get(f"/api/listar-tabela/{table}/{linhas.id}/", params).json()
+            self.assertEqual(sem_id(self.client.get(f"/api/listar-tabela/{table}/{compacta.id}/", params).json()), sem_id(esperado))
+            params = {**params, "por": "ano", "funcao": "sum"}
+            self.assertEqual(self.client.get(f"/api/agregar-tabela/{table}/{compacta.id}/", params).json(),
+                             self.client.get(f"/api/agregar-tabela/{table}/{linhas.id}/", params).json())
+
+        #a página traz só entidades inteiras: Alemanha (2 anos) cabe em 3 linhas, Angola fica para a próxima
+        url = f"/api/listar-tabela/exportacao/{compacta.id}/"
+        pagina = self.client.get(url, {"limit": 3}).json()
+        self.assertEqual([linha["pais"] for linha in pagina["results"]], ["Alemanha", "Alemanha"])
+        pagina = self.client.get(url, {"limit": 3, "cursor": pagina["next_cursor"]}).json()
+        self.assertEqual(([linha["pais"] for linha in pagina["results"]], pagina["next_cursor"]), (["Angola", "Angola"], None))
+        self.assertEqual(len(pd.read_csv(io.StringIO(b"".join(self.client.get(
+            f"/api/exportar-tabela/exportacao/{compacta.id}/").streaming_content).decode()))), 4)
+
+        with self.assertRaises(ValueError):
+            DefaultEmbrapaPipeline(armazenamento = "compacto", modo = "diferencial")
+
+    def test_armazenamento_compacto_no_limite_de_precisao(self):
+        #no SQLite o Django lê os DecimalField com 15 dígitos significativos; o float64 do compacto
+        #é exato até o centavo abaixo de 2**46 (16 dígitos)
+        cache.cache().clear()
+        casos = [("9999999999999.99", ("linhas", "compacto")), ("70368744177663.99", ("compacto",))]
+        for valor, armazenamentos in casos:
+            self.servidor.arquivos["/exportacao_espumantes.csv"] = EXPORTACAO_CSV.replace("10;100", f"{valor};0.01")
+            for armazenamento in armazenamentos:
+                atualizacao = self.executar(armazenamento = armazenamento)
+                linha = self.client.get(f"/api/listar-tabela/exportacao/{atualizacao.id}/", {"pais": "Alemanha", "ano": 2020}).json()[0]
+                self.assertEqual((linha["quantidade"], linha["valor_dolares"]), (valor, "0.01"), armazenamento)
+
+    def test_serie_por_entidade(self):
+        linhas = self.executar()
+        compacta = self.executar(armazenamento = "compacto")
+        for atualizacao in (linhas, compacta):
+            #os índices ficam no processo e os ids das atualizacoes se repetem entre os testes
+            series.descartar(atualizacao.id)
+            url = f"/api/serie/exportacao/{atualizacao.id}/"
+            self.assertEqual(self.client.get(url, {"pais": "Angola", "classificacao": "espumantes"}).json(), {
+                "classificacao": "espumantes", "pais": "Angola", "anos": [2020, 2021],
+                "quantidade": ["0.00", "5.00"], "valor_dolares": ["0.00", "55.00"]})
+            self.assertEqual(self.client.get(url, {"pais": "Alemanha", "classificacao": "espumantes",
+                                                   "campo": "valor_dolares", "ano_min": 2021}).json(),
+                             {"classificacao": "espumantes", "pais": "Alemanha", "anos": [2021], "valor_dolares": ["200.00"]})
+            self.assertEqual(self.client.get(url, {"pais": "Chile", "classificacao": "espumantes"}).status_code, 404)
+            self.assertEqual(self.client.get(url, {"pais": "Angola"}).status_code, 400)
+
+        #a partir da primeira consulta à tabela as séries saem do índice, sem consultas ao banco
+        url = f"/api/serie/processamento/{linhas.id}/"
+        self.client.get(url, {"classificacao": "americanas", "cultivar": "TINTAS"})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {"classificacao": "americanas", "cultivar": "Alicante Bouschet"}).json()["quantidade_kg"],
+                             ["0.00", "30.00"])
+        #deletada por outro processo da API: aqui só a geração no cache compartilhado muda
+        with mock.patch("api.series.descartar"):
+            self.client.delete(f"/api/deletar-update/{compacta.id}/")
+        self.assertEqual(self.client.get(f"/api/serie/exportacao/{compacta.id}/",
+                                         {"pais": "Angola", "classificacao": "espumantes"}).status_code, 400)
+
+    def test_origens_sem_rede(self):
+        for nome, source in self.sources.items():
+            source["test_file"] = escrever_csv(self.tmp.name, f"{nome}.csv", self.servidor.arquivos[f"/{nome}.csv"])
+        teste = self.executar(origem = "teste")
+        self.assertEqual(self.servidor.requisicoes, [])
+        self.assertEqual(Exportacao.objects.filter(atualizacao = teste).count(), 4)
+
+        #mesmo conteúdo do manifest: inalterado e copiado da atualizacao anterior
+        cache = self.executar(origem = "cache")
+        self.assertIn("copia_s", json.loads(cache.detalhes)["fontes"]["exportacao_espumantes"]["metricas"])
+
+        pacote = os.path.join(self.tmp.name, "fontes.zip")
+        with zipfile.ZipFile(pacote, "w") as f:
+            f.writestr("csv/exportacao_espumantes.csv", EXPORTACAO_CSV.replace("5;55", "6;66"))
+            f.writestr("csv/processamento_americanas.csv", PROCESSAMENTO_CSV)
+        arquivo = self.executar(origem = "arquivo", arquivo = pacote)
+        self.assertIn(("espumantes", "Angola", 2021, 6, 66), self.linhas(Exportacao, arquivo))
+        self.assertEqual(self.servidor.requisicoes, [])
+
+        with self.assertRaises(ValueError):
+            DefaultEmbrapaPipeline(origem = "arquivo")
+
+    def test_comando_ingest(self):
+        #o comando lê o sources.json e o cache/ do diretório atual
+        for nome, source in self.sources.items():
+            source["test_file"] = escrever_csv(self.tmp.name, f"{nome}.csv", self.servidor.arquivos[f"/{nome}.csv"])
+            source["dst_file"] = f"cache/{nome}.csv"
+        escrever_csv(self.tmp.name, "sources.json", json.dumps({"sources": self.sources}))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp.name)
+
+        saida = io.StringIO()
+        call_command("ingest", sources = "exportacao_*", dry_run = True, origem = "teste", stdout = saida)
+        self.assertFalse(Atualizacao.objects.exists())
+        self.assertIn("exportacao_espumantes", saida.getvalue())
+
+        call_command("ingest", sources = "exportacao_*", origem = "teste", batch_size = 2, stdout = saida, stderr = io.StringIO())
+        atualizacao = Atualizacao.objects.get()
+        self.assertEqual(atualizacao.status, "SUCESSO")
+        self.assertEqual(Exportacao.objects.filter(atualizacao = atualizacao).count(), 4)
+        self.assertFalse(Processamento.objects.exists())
+        self.assertIn(f"Atualizacao {atualizacao.id}: SUCESSO, 4 linhas", saida.getvalue())
+        self.assertEqual(self.servidor.requisicoes, [])
+
+        with self.assertRaises(CommandError):
+            call_command("ingest", sources = "producao", stdout = saida)
+
+
+class IngestaoAssincronaTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.cache().clear()
+
+    def esperar(self, condicao, timeout = 5):
+        limite = time.monotonic() + timeout
+        while not condicao():
+            self.assertLess(time.monotonic(), limite, "timeout")
+            time.sleep(0.01)
+
+    def test_endpoint_responde_antes_da_carga_terminar(self):
+        liberar = threading.Event()
+
+        def run_falso(atualizacao, callback, **opcoes):
+            callback("producao", "processando")
+            self.assertTrue(liberar.wait(5))
+            callback("producao", "concluido")
+            Atualizacao.objects.filter(id = atualizacao.id).update(status = "SUCESSO")
+
+        with mock.patch("api.jobs.run", run_falso):
+            response = self.client.get("/api/buscar-dados-embrapa-e-criar-update/")
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()["status"], "EM ANDAMENTO")
+            url = f"/api/consultar-update/{response.json()['id']}/"
+
+            self.esperar(lambda: self.client.get(url).json().get("progresso", {}).get("producao"))
+            consulta = self.client.get(url).json()
+            self.assertEqual(consulta["status"], "EM ANDAMENTO")
+            self.assertEqual(consulta["progresso"], {"producao": {"etapa": "processando"}})
+            #outro processo da API vê o progresso pelo detalhes e pelo cache compartilhado
+            self.assertEqual(json.loads(consulta["detalhes"])["fontes"], {"producao": {"etapa": "processando"}})
+            self.assertEqual(json.loads(consulta["detalhes"])["processo"]["pid"], os.getpid())
+            with mock.patch.dict(jobs._progresso, clear = True):
+                self.assertEqual(self.client.get(url).json()["progresso"], {"producao": {"etapa": "processando"}})
+
+            liberar.set()
+            self.esperar(lambda: "progresso" not in self.client.get(url).json())
+
+        consulta = self.client.get(url).json()
+        self.assertEqual(consulta["status"], "SUCESSO")
+        self.assertNotIn("progresso", consulta)
+        self.assertEqual(json.loads(consulta["detalhes"])["fontes"], {"producao": {"etapa": "concluido"}})
+
+    def test_erro_na_carga_fica_registrado(self):
+        def run_falso(atualizacao, callback, **opcoes):
+            raise Exception("falha no download")
+
+        with mock.patch("api.jobs.run", run_falso):
+            response = self.client.get("/api/buscar-dados-embrapa-e-criar-update/")
+            url = f"/api/consultar-update/{response.json()['id']}/"
+            self.esperar(lambda: "erro" in json.loads(self.client.get(url).json()["detalhes"] or "{}"))
+
+        consulta = self.client.get(url).json()
+        self.assertEqual(consulta["status"], "ERRO")
+        self.assertEqual(json.loads(consulta["detalhes"])["erro"], "falha no download")
+
+    def test_trava_ao_enfileirar_nao_deixa_atualizacao_orfa(self):
+        executor = mock.MagicMock()
+        travada = OperationalError("database is locked")
+        #a criação passa e a escrita do processo em detalhes, já no enfileirar, não pega a trava
+        with mock.patch("api.jobs.executor", return_value = executor), \
+                mock.patch("django.db.models.query.QuerySet.update", side_effect = travada):
+            response = self.client.get("/api/buscar-dados-embrapa-e-criar-update/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Atualizacao.objects.exists())
+        executor.submit.assert_not_called()
+        self.assertEqual(jobs._progresso, {})
+
+    def test_carga_de_um_processo_que_terminou_vira_erro(self):
+        #pid de um processo que já terminou
+        morto = subprocess.Popen(["true"])
+        morto.wait()
+        detalhes = {"processo": {"host": socket.gethostname(), "pid": morto.pid}, "fontes": {"producao": {"etapa": "gravando"}}}
+        orfa = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO", detalhes = json.dumps(detalhes))
+        viva = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO",
+                                          detalhes = json.dumps({**detalhes, "processo": {"host": socket.gethostname(), "pid": os.getpid()}}))
+
+        consulta = self.client.get(f"/api/consultar-update/{orfa.id}/").json()
+        self.assertEqual(consulta["status"], "ERRO")
+        self.assertIn("ended before the update finished", json.loads(consulta["detalhes"])["erro"])
+        self.assertEqual(self.client.get(f"/api/consultar-update/{viva.id}/").json()["status"], "EM ANDAMENTO")
+
+
+class LeituraDuranteCargaTestCase(SimpleTestCase):
+    """O banco de teste fica em memória, sem WAL; aqui duas conexões com as OPTIONS do DATABASES
+    abrem um arquivo, uma fazendo o papel da transação do run e a outra o de uma leitura da API."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.caminho = os.path.join(self.tmp.name, "concorrencia.sqlite3")
+
+    def conexao(self, **opcoes):
+        padrao = connections["default"]
+        conexao = type(padrao)({**padrao.settings_dict, "NAME": self.caminho,
+                                "OPTIONS": {**padrao.settings_dict["OPTIONS"], **opcoes}}, alias = "concorrencia")
+        self.addCleanup(conexao.close)
+        return conexao
+
+    def carga_em_andamento(self, carga):
+        with carga.cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS fato (valor INTEGER)")
+            cursor.execute("DELETE FROM fato")
+            cursor.execute("INSERT INTO fato VALUES (1)")
+        carga.set_autocommit(False)
+        with carga.cursor() as cursor:
+            #um cache pequeno faz a transação despejar páginas no arquivo, como numa carga grande
+            cursor.execute("PRAGMA cache_size = 10")
+            cursor.executemany("INSERT INTO fato VALUES (%s)", [(i,) for i in range(50000)])
+
+    def contar(self, leitura) -> int:
+        with leitura.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM fato")
+            return cursor.fetchone()[0]
+
+    def test_leitura_nao_espera_a_carga(self):
+        carga, leitura = self.conexao(), self.conexao()
+        self.carga_em_andamento(carga)
+        with leitura.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+
+        inicio = time.perf_counter()
+        self.assertEqual(self.contar(leitura), 1)
+        self.assertLess(time.perf_counter() - inicio, 1)
+        carga.commit()
+        self.assertEqual(self.contar(leitura), 50001)
+
+    def test_sem_wal_a_leitura_fica_bloqueada(self):
+        carga = self.conexao(init_command = "PRAGMA journal_mode=DELETE;")
+        leitura = self.conexao(init_command = "PRAGMA journal_mode=DELETE;", timeout = 0.1)
+        self.carga_em_andamento(carga)
+        with self.assertRaisesMessage(OperationalError, "database is locked"):
+            self.contar(leitura)
+        carga.rollback()
+
+
+class EscritaDuranteCargaTestCase(SimpleTestCase):
+    """Um run de verdade segura a transação num banco em arquivo, com as OPTIONS do DATABASES,
+    enquanto a API lê e tenta escrever. O banco em memória dos outros testes volta no final."""
+    databases = {"default"}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        memoria = connections["default"]
+        nome = mock.patch.dict(memoria.settings_dict, {"NAME": os.path.join(self.tmp.name, "api.sqlite3")})
+        nome.start()
+        self.addCleanup(nome.stop)
+        connections["default"] = type(memoria)(memoria.settings_dict, alias = "default")
+        self.addCleanup(connections.__setitem__, "default", memoria)
+        self.addCleanup(lambda: connections["default"].close())
+        #os pks do banco em arquivo se repetem nos outros testes
+        self.addCleanup(lambda: cache.cache().clear())
+        call_command("migrate", verbosity = 0)
+
+        csv = escrever_csv(self.tmp.name, "exportacao_espumantes.csv", EXPORTACAO_CSV)
+        self.sources = {"exportacao_espumantes": {**SOURCES["exportacao_espumantes"], "test_file": csv,
+                                                  "dst_file": os.path.join(self.tmp.name, "cache", "exportacao_espumantes.csv")}}
+
+    def executar(self, atualizacao):
+        DefaultEmbrapaPipeline(origem = "teste", manifest_file = os.path.join(self.tmp.name, "cache", "manifest.json")).run(self.sources, atualizacao)
+
+    def test_escritas_da_api_nao_esperam_a_carga(self):
+        primeira = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+        self.executar(primeira)
+        segunda = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+
+        #a segunda carga para dentro da transação, com a trava de escrita, até liberar
+        dentro, liberar = threading.Event(), threading.Event()
+        gravar_resumos = DefaultEmbrapaPipeline.gravar_resumos
+
+        def segurar(pipeline, *args):
+            dentro.set()
+            liberar.wait(10)
+            return gravar_resumos(pipeline, *args)
+
+        def carga():
+            try:
+                self.executar(segunda)
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(DefaultEmbrapaPipeline, "gravar_resumos", autospec = True, side_effect = segurar), \
+                self.settings(SQLITE_TIMEOUT_REQUISICAO = 0.2):
+            thread = threading.Thread(target = carga)
+            thread.start()
+            try:
+                self.assertTrue(dentro.wait(10))
+                inicio = time.perf_counter()
+                leitura = self.client.get(f"/api/listar-tabela/exportacao/{primeira.id}/")
+                self.assertEqual(leitura.status_code, 200)
+                self.assertEqual(len(leitura.json()), 4)
+
+                criar = self.client.get("/api/buscar-dados-embrapa-e-criar-update/")
+                self.assertEqual(criar.status_code, 503)
+                self.assertEqual(criar["Retry-After"], "5")
+                self.assertEqual(self.client.delete(f"/api/deletar-update/{primeira.id}/").status_code, 503)
+                self.assertLess(time.perf_counter() - inicio, 5)
+            finally:
+                liberar.set()
+                thread.join()
+
+        segunda.refresh_from_db()
+        self.assertEqual(segunda.status, "SUCESSO")
+        self.assertEqual(Atualizacao.objects.count(), 2)
+        self.assertEqual(self.client.delete(f"/api/deletar-update/{primeira.id}/").status_code, 204)
+
+
+class ListTableTestCase(TestCase):
+
+    def setUp(self):
+        #os pks voltam a se repetir entre os testes por causa do rollback
+        cache.cache().clear()
+        self.atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "SUCESSO")
+        self.espumantes = Classificacao.objects.ids(["espumantes"])["espumantes"]
+        paises = Pais.objects.ids([f"País {i}" for i in range(5)] + ["Zâmbia"])
+        self.zambia = paises["Zâmbia"]
+        Exportacao.objects.bulk_create([
+            Exportacao(atualizacao = self.atualizacao, classificacao_id = self.espumantes, pais_id = paises[f"País {i % 5}"],
+                       ano = 2000 + i, quantidade = i, valor_dolares = i * 10.5)
+            for i in range(25)
+        ])
+        self.url = f"/api/listar-tabela/exportacao/{self.atualizacao.id}/"
+
+    def test_leitura_rapida_identica_ao_model_serializer(self):
+        Exportacao.objects.create(atualizacao = self.atualizacao, classificacao_id = self.espumantes, pais_id = self.zambia,
+                                  ano = 1970, quantidade = "123456789012345678.99", valor_dolares = "0.10")
+        items = Exportacao.objects.da_versao(self.atualizacao).order_by("pk")
+        leitura = leitura_rapida(ExportacaoSerializer)
+        esperado = ExportacaoSerializer(items, many = True).data
+        self.assertEqual(list(leitura.linhas(items)), esperado)
+        self.assertEqual(json.dumps(list(leitura.linhas(items))), json.dumps(esperado))
+
+        colunar = self.client.get(self.url, {"formato": "colunar"}).json()
+        self.assertEqual(colunar["valor_dolares"], [linha["valor_dolares"] for linha in esperado])
+
+    def test_paginacao_por_cursor(self):
+        completa = self.client.get(self.url).json()
+        self.assertEqual(len(completa), 25)
+
+        paginas, cursor = [], 0
+        while cursor is not None:
+            resposta = self.client.get(self.url, {"limit": 10, "cursor": cursor}).json()
+            paginas.extend(resposta["results"])
+            cursor = resposta["next_cursor"]
+        self.assertEqual(paginas, completa)
+
+        self.assertEqual(self.client.get(self.url, {"limit": 0}).status_code, 400)
+
+    def test_filtros(self):
+        linhas = self.client.get(self.url, {"pais": "País 1,País 2", "ano_min": 2005, "ano_max": 2016}).json()
+        self.assertEqual([(l["pais"], l["ano"]) for l in linhas],
+                         [("País 1", 2006), ("País 2", 2007), ("País 1", 2011), ("País 2", 2012), ("País 1", 2016)])
+        self.assertEqual(len(self.client.get(self.url, {"ano": 2003}).json()), 1)
+        self.assertEqual(self.client.get(self.url, {"cultivar": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"ano_min": "x"}).status_code, 400)
+
+    def test_agregacoes(self):
+        url = f"/api/agregar-tabela/exportacao/{self.atualizacao.id}/"
+        por_pais = self.client.get(url, {"por": "pais", "campo": "valor_dolares", "top": 2}).json()
+        #País 4 = 4+9+14+19+24 = 70 * 10.5; País 3 = 65 * 10.5
+        self.assertEqual(por_pais, [{"pais": "País 4", "valor_dolares": "735.00"},
+                                    {"pais": "País 3", "valor_dolares": "682.50"}])
+
+        por_ano = self.client.get(url, {"ano_max": 2001}).json()
+        self.assertEqual(por_ano, [{"ano": 2000, "quantidade": "0.00", "valor_dolares": "0.00"},
+                                   {"ano": 2001, "quantidade": "1.00", "valor_dolares": "10.50"}])
+
+        contagem = self.client.get(url, {"por": "classificacao", "funcao": "count", "campo": "quantidade"}).json()
+        self.assertEqual(contagem, [{"classificacao": "espumantes", "quantidade": 25}])
+        self.assertEqual(self.client.get(url, {"por": "cultivar"}).status_code, 400)
+
+    def test_cache_de_respostas(self):
+        primeira = self.client.get(self.url, {"pais": "País 1"})
+        with self.assertNumQueries(0):
+            segunda = self.client.get(self.url, {"pais": "País 1"})
+        self.assertEqual(segunda.json(), primeira.json())
+        self.assertEqual(segunda["ETag"], primeira["ETag"])
+
+        revalidacao = self.client.get(self.url, {"pais": "País 1"}, HTTP_IF_NONE_MATCH = primeira["ETag"])
+        self.assertEqual(revalidacao.status_code, 304)
+        self.assertNotEqual(self.client.get(self.url, {"pais": "País 2"})["ETag"], primeira["ETag"])
+
+        #atualizacao ainda em andamento não entra no cache
+        em_andamento = Atualizacao.objects.create(ts = timezone.now(), status = "EM ANDAMENTO")
+        url = f"/api/listar-tabela/exportacao/{em_andamento.id}/"
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).json(), [])
+
+        self.assertEqual(self.client.delete(f"/api/deletar-update/{self.atualizacao.id}/").status_code, 204)
+        self.assertEqual(self.client.get(self.url, {"pais": "País 1"}).status_code, 400)
+
+    def test_cache_limitado_pelo_total_de_bytes(self):
+        with tempfile.TemporaryDirectory() as diretorio, self.settings(CACHE_RESPOSTAS_TOTAL_BYTES = 2500):
+            limitado = cache.ArquivosLimitados(diretorio, {})
+            for i in range(3):
+                #bytes aleatórios não encolhem com a compressão do FileBasedCache
+                limitado.set(f"resposta:{i}", os.urandom(1000))
+                os.utime(limitado._key_to_file(f"resposta:{i}"), ns = (i, i))
+            self.assertIsNone(limitado.get("resposta:0"))
+            self.assertIsNotNone(limitado.get("resposta:1"))
+            self.assertIsNotNone(limitado.get("resposta:2"))
+            self.assertLessEqual(sum(os.path.getsize(nome) for nome in limitado._list_cache_files()), 2500)
+
+    def test_cache_isolado_da_api_da_maquina(self):
+        self.assertEqual(cache.cache()._dir, os.path.abspath(CACHE_DOS_TESTES.name))
+        self.client.get(self.url)
+        self.assertTrue(os.listdir(CACHE_DOS_TESTES.name))
+
+        #um migrate sem nada a aplicar não descarta as respostas
+        chave = f"geracao:{self.atualizacao.id}"
+        geracao = cache.cache().get(chave)
+        self.assertIsNotNone(geracao)
+        call_command("migrate", verbosity = 0)
+        self.assertEqual(cache.cache().get(chave), geracao)
+        cache.limpar(plan = [("migracao", False)])
+        self.assertIsNone(cache.cache().get(chave))
+
+    def test_exportacao(self):
+        url = f"/api/exportar-tabela/exportacao/{self.atualizacao.id}/"
+        resposta = self.client.get(url, {"ano_max": 2002})
+        self.assertTrue(resposta.streaming)
+        df = pd.read_csv(io.BytesIO(b"".join(resposta.streaming_content)))
+        self.assertEqual(list(df.columns), list(self.client.get(self.url).json()[0]))
+        self.assertEqual(df["valor_dolares"].tolist(), [0.0, 10.5, 21.0])
+
+        vazia = b"".join(self.client.get(url, {"ano": 1900}).streaming_content).decode()
+        self.assertEqual(vazia, "id,classificacao,pais,ano,quantidade,valor_dolares,atualizacao\n")
+        self.assertEqual(self.client.get(url, {"formato": "xlsx"}).status_code, 400)
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            if importlib.util.find_spec("pyarrow") is None:
+                self.assertEqual(self.client.get(url, {"formato": "parquet"}).status_code, 501)
+                with self.assertRaises(CommandError):
+                    call_command("export", self.atualizacao.id, dir = diretorio, stdout = io.StringIO())
+            else:
+                resposta = self.client.get(url, {"formato": "parquet"})
+                self.assertTrue(resposta.streaming)
+                parquet = pd.read_parquet(io.BytesIO(b"".join(resposta.streaming_content)))
+                pd.testing.assert_frame_equal(parquet, exports.dataframe(
+                    Exportacao.objects.da_versao(self.atualizacao).order_by("pk"), ExportacaoSerializer))
+
+            call_command("export", self.atualizacao.id, formato = "csv", tabelas = "exportacao", dir = diretorio, stdout = io.StringIO())
+            self.assertEqual(len(pd.read_csv(os.path.join(diretorio, f"exportacao_{self.atualizacao.id}.csv"))), 25)
+
+    def test_streaming(self):
+        completa = self.client.get(self.url).json()
+        resposta = self.client.get(self.url, {"stream": "true"})
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(json.loads(b"".join(resposta.streaming_content)), completa)
+
+        items = Exportacao.objects.da_versao(self.atualizacao).order_by("pk")
+        self.assertEqual(json.loads("".join(stream_json(items, leitura_rapida(ExportacaoSerializer), chunk_size = 7))), completa)
+
+
+class PlanoDeConsultaTestCase(TestCase):
+    """Garante que as consultas mais usadas continuam indo pelos índices de api/models.py."""
+
+    def setUp(self):
+        self.atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "SUCESSO")
+        classificacoes = Classificacao.objects.ids(["vinho", "suco"])
+        paises = Pais.objects.ids([f"País {i}" for i in range(7)])
+        self.vinho = classificacoes["vinho"]
+        Exportacao.objects.bulk_create([
+            Exportacao(atualizacao = self.atualizacao, classificacao_id = classificacoes["vinho" if i % 2 else "suco"],
+                       pais_id = paises[f"País {i % 7}"],
+                       ano = 1970 + i % 50, quantidade = i, valor_dolares = i)
+            for i in range(500)
+        ])
+
+    def plano(self, queryset) -> str:
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return "\n".join(linha[-1] for linha in cursor.fetchall())
+
+    def assertSemVarredura(self, plano:str):
+        for linha in plano.splitlines():
+            if linha.startswith("SCAN"):
+                #SCAN só é aceito sobre um índice de cobertura (leitura só do índice)
+                self.assertIn("COVERING INDEX", linha, plano)
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plano)
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN é do SQLite")
+    def test_consultas_usam_indices(self):
+        items = Exportacao.objects.da_versao(self.atualizacao)
+
+        pagina = self.plano(items.filter(pk__gt = 100).order_by("pk")[:50])
+        self.assertIn("SEARCH", pagina)
+        self.assertSemVarredura(pagina)
+
+        por_classificacao = self.plano(filtrar(items, {"classificacao": "vinho"}).order_by("pk"))
+        self.assertIn("USING INDEX exportacao_cls_idx (atualizacao_id=? AND classificacao_id=?)", por_classificacao)
+        self.assertSemVarredura(por_classificacao)
+
+        #com o intervalo de anos o de cobertura recorta antes e só o trecho selecionado é ordenado
+        por_ano = self.plano(filtrar(items, {"classificacao": "vinho", "ano_min": "1980"}).order_by("pk"))
+        self.assertIn("USING COVERING INDEX exportacao_cls_ano_idx (atualizacao_id=? AND classificacao_id=? AND ano>?)", por_ano)
+        self.assertNotIn("SCAN", por_ano)
+
+        por_pais = self.plano(filtrar(items, {"pais": "País 1"}).order_by("pk"))
+        self.assertIn("USING INDEX exportacao_pais_idx (atualizacao_id=? AND pais_id=?)", por_pais)
+        self.assertSemVarredura(por_pais)
+
+        soma = self.plano(items.filter(classificacao = self.vinho).values("ano").annotate(total = Sum("valor_dolares")).order_by("ano"))
+        self.assertIn("USING COVERING INDEX exportacao_cls_ano_idx", soma)
+        self.assertSemVarredura(soma)
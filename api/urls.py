@@ -1,6 +1,6 @@
 
 from django.urls import path, include
-from api.views import get_data_from_embraba_and_create_update, delete_update, list_table,get_update_state
+from api.views import get_data_from_embraba_and_create_update, delete_update, list_table,get_update_state,aggregate_table,summary_table,export_table,time_series,metrics
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 urlpatterns = [
@@ -8,6 +8,11 @@ urlpatterns = [
     path('deletar-update/<int:pk>/',delete_update),
     path('consultar-update/<int:pk>/',get_update_state),
     path('listar-tabela/<str:table>/<int:pk_atualizacao>/',list_table),
+    path('agregar-tabela/<str:table>/<int:pk_atualizacao>/',aggregate_table),
+    path('resumo/<str:resumo>/<int:pk_atualizacao>/',summary_table),
+    path('exportar-tabela/<str:table>/<int:pk_atualizacao>/',export_table),
+    path('serie/<str:table>/<int:pk_atualizacao>/',time_series),
+    path('metricas/',metrics),
     path('schema/', SpectacularAPIView.as_view(), name='schema'),
     path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
@@ -6,50 +6,179 @@ from rest_framework import status as http_status
 from rest_framework.decorators import api_view
 
 from api.serializer import *
+import json
+from itertools import islice
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from django.db import OperationalError, connection, transaction
+from django.db.models import ProtectedError
+from django.conf import settings
+from contextlib import contextmanager
 
-from scripts import run
+from scripts import ARMAZENAMENTOS, MODOS, carregar_sources
+from api import jobs
+from api.cache import em_cache, invalidar
+from api.filters import FiltroInvalido, filtrar, agregar, inteiro
+from api import compacto, exports, metricas, series
+from django.views.decorators.http import require_GET
+
+#tamanho de página padrão e máximo da paginação por cursor do list_table
+LIMITE_PADRAO = 1000
+LIMITE_MAXIMO = 10000
+
+#resumos gravados ao final de cada carga, pelo nome usado em resumo/<nome>/<pk>/
+RESUMOS_POR_NOME = {
+    "total-anual": ResumoTotalAnual,
+    "exportacao-pais": ResumoExportacaoPais,
+    "processamento-classificacao": ResumoProcessamentoClassificacao
+}
+
+
+class BancoOcupado(Exception):
+    """Uma escrita da requisição não conseguiu a trava de escrita do SQLite a tempo (ex: uma carga em andamento)."""
+
+
+@contextmanager
+def escrita_curta():
+    """As escritas feitas dentro do bloco esperam a trava de escrita no máximo
+    SQLITE_TIMEOUT_REQUISICAO segundos, não o SQLITE_TIMEOUT das cargas; ao estourar, levanta BancoOcupado."""
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA busy_timeout")
+        anterior = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.SQLITE_TIMEOUT_REQUISICAO * 1000)}")
+    try:
+        yield
+    except OperationalError as ex:
+        if "locked" not in str(ex):
+            raise
+        raise BancoOcupado("database is busy with another write (probably an update being loaded), try again later.") from ex
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA busy_timeout = {anterior}")
+
+
+def ocupado(ex:BancoOcupado) -> Response:
+    return Response({"details":str(ex)}, status = http_status.HTTP_503_SERVICE_UNAVAILABLE, headers = {"Retry-After": "5"})
 
 
 @api_view(['GET'])
 def get_data_from_embraba_and_create_update(request):
     """Cria um objeto chamado atualização que servirá para um 'versionamento' das mesmas.
-    Posteriormente roda o método run.
-    Após a execução os dados referentes a esta atualizacao são informados
+    Posteriormente coloca o método run na fila de execução em segundo plano.
+    A resposta é imediata, com a atualizacao EM ANDAMENTO; o andamento pode ser
+    acompanhado em consultar-update/<pk>/.
+
+    O parâmetro opcional ?modo=diferencial grava apenas as diferenças para a última atualizacao com SUCESSO.
+    O parâmetro opcional ?fontes=producao,exportacao_* carrega só essas fontes (aceita curingas);
+    as demais continuam valendo pela última atualizacao com SUCESSO.
+    O parâmetro opcional ?armazenamento=compacto grava uma série por entidade em vez de uma linha por ano
+    (só na carga completa de todas as fontes).
     """
-    atualizacao = Atualizacao.objects.create(ts = datetime.now(),status="EM ANDAMENTO")
-    run(atualizacao)
+    modo = request.query_params.get("modo", "completo")
+    if modo not in MODOS:
+        return Response({"details":f"modo parameter must be one of these: {','.join(MODOS)}"},
+                        status = http_status.HTTP_400_BAD_REQUEST)
+    armazenamento = request.query_params.get("armazenamento", "linhas")
+    if armazenamento not in ARMAZENAMENTOS:
+        return Response({"details":f"armazenamento parameter must be one of these: {','.join(ARMAZENAMENTOS)}"},
+                        status = http_status.HTTP_400_BAD_REQUEST)
+    fontes = None
+    if request.query_params.get("fontes"):
+        fontes = [f.strip() for f in request.query_params["fontes"].split(",") if f.strip()]
+        try:
+            carregar_sources(fontes)
+        except ValueError as ex:
+            return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
+    if armazenamento == "compacto" and (modo == "diferencial" or fontes is not None):
+        return Response({"details":"compact storage only supports full loads (modo completo, without fontes)."},
+                        status = http_status.HTTP_400_BAD_REQUEST)
+    try:
+        #criar e registrar o processo numa transação só: se a trava estourar no meio, nada fica gravado
+        with escrita_curta(), transaction.atomic():
+            atualizacao = Atualizacao.objects.create(ts = datetime.now(),status="EM ANDAMENTO")
+            jobs.enfileirar(atualizacao, modo = modo, fontes = fontes, armazenamento = armazenamento, chunk_rows = settings.INGESTAO_CHUNK_ROWS,
+                            origem = settings.INGESTAO_ORIGEM, arquivo = settings.INGESTAO_ARQUIVO)
+    except BancoOcupado as ex:
+        return ocupado(ex)
     d = {
         "id": atualizacao.id,
         "ts":atualizacao.ts,
         "status":atualizacao.status,
         "detalhes":atualizacao.detalhes
     }
-    return Response(data = d)
+    return Response(data = d, status = http_status.HTTP_202_ACCEPTED)
+
+def finalizada(atualizacao:Atualizacao) -> bool:
+    """A atualizacao não muda mais: terminou e o pool já gravou os detalhes."""
+    return atualizacao.status in ("SUCESSO", "ERRO") and atualizacao.detalhes is not None and jobs.progresso(atualizacao.id) is None
+
 
 @api_view(['GET'])
+@em_cache(finalizada)
 def get_update_state(request,pk):
-    """Serve para consultar a atualização passando a chave primaria da mesma."""
+    """Serve para consultar a atualização passando a chave primaria da mesma.
+    Enquanto ela estiver EM ANDAMENTO, progresso traz a etapa atual de cada fonte; se o processo
+    que a executava terminou no meio da carga ela passa a ERRO.
+    Depois de finalizada a resposta vem do cache, com ETag."""
     item = Atualizacao.objects.get(id = pk)
-    return Response(AtualizacaoSerializer(item).data)
+    data = AtualizacaoSerializer(item).data
+    progresso = jobs.progresso(item.id)
+    if progresso is None and item.status == "EM ANDAMENTO":
+        try:
+            with escrita_curta():
+                recuperada = item.id in jobs.recuperar()
+        except BancoOcupado:
+            #outra escrita em andamento: a recuperação fica para a próxima consulta
+            recuperada = False
+        if recuperada:
+            item.refresh_from_db()
+            data = AtualizacaoSerializer(item).data
+    if progresso is not None:
+        data["progresso"] = progresso
+    return Response(data)
 
 
 
 @api_view(['DELETE'])
 def delete_update(request,pk):
-    """Deleta o update em CASCADE. """
+    """Deleta o update em CASCADE. Uma atualizacao que é base de uma carga diferencial não pode ser deletada.
+    Com uma carga gravando, retorna 503 em vez de esperar por ela."""
     try:
-        Atualizacao.objects.get(id = pk).delete()
+        with escrita_curta():
+            Atualizacao.objects.get(id = pk).delete()
+        invalidar(pk)
+        series.descartar(pk)
         return Response(status = http_status.HTTP_204_NO_CONTENT)
     except Atualizacao.DoesNotExist:
-        return Response(d = {"details":f"pk {pk} not found."}, status = http_status.HTTP_404_NOT_FOUND)
+        return Response({"details":f"pk {pk} not found."}, status = http_status.HTTP_404_NOT_FOUND)
+    except ProtectedError:
+        return Response({"details":f"pk {pk} is the base of a differential update and cannot be deleted."},
+                        status = http_status.HTTP_409_CONFLICT)
+    except BancoOcupado as ex:
+        return ocupado(ex)
     except Exception as ex:
-        return Response(d = {"details":f"Unexpected Error. {ex}"}, status = http_status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({"details":f"Unexpected Error. {ex}"}, status = http_status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     
 @api_view(['GET'])
+@em_cache()
 def list_table(request,table,pk_atualizacao):
         """Lista todos os dados de uma tabela específica, sendo obrigatório passar o pk de atualização.
            Caso a tabela chamada seja atualização,serão mostradas todas as atualizacoes.
+
+           Parâmetros opcionais para tabelas grandes:
+           1) ?limit=N&cursor=<id> pagina pelo id (keyset). A resposta traz results e next_cursor,
+              que deve ser passado como cursor na próxima chamada; next_cursor nulo indica o fim.
+           2) ?stream=true envia a lista completa em partes, sem montá-la inteira em memória.
+           3) ?formato=colunar devolve {campo: [valores]} em vez de uma lista de objetos.
+           4) filtros: ano, ano_min, ano_max, pais, produto, cultivar e classificacao
+              (vários valores separados por vírgula), quando existem na tabela.
+
+           Numa atualizacao com armazenamento compacto as linhas saem por entidade e ano, o id é o da
+           série da entidade e a paginação traz sempre entidades inteiras.
+
+           Para uma atualizacao com SUCESSO a resposta (exceto o stream) fica em cache e traz um ETag;
+           If-None-Match com o mesmo ETag retorna 304.
         """
         try:
             choices = ['Producao','Comercializacao','Processamento','Importacao','Exportacao','Atualizacao']
@@ -61,9 +190,224 @@ def list_table(request,table,pk_atualizacao):
                  return Response(data = AtualizacaoSerializer(items, many = True).data)
             
             atualizacao = Atualizacao.objects.get(pk = pk_atualizacao)
-            items = globals().get(table).objects.filter(atualizacao = atualizacao)
-            serializer = globals().get(f"{table}Serializer")(items,many=True)
-            return Response(serializer.data)
+            items = dados(table, atualizacao, request.query_params)
+            leitura = leitura_da_versao(atualizacao, globals().get(f"{table}Serializer"))
+
+            if request.query_params.get("stream") in ("true", "1"):
+                return StreamingHttpResponse(stream_json(items, leitura), content_type = "application/json")
+
+            if "limit" in request.query_params or "cursor" in request.query_params:
+                try:
+                    limit = int(request.query_params.get("limit", LIMITE_PADRAO))
+                    cursor = int(request.query_params.get("cursor", 0))
+                    if not 0 < limit <= LIMITE_MAXIMO:
+                        raise ValueError
+                except ValueError:
+                    return Response({"details":f"limit must be an integer between 1 and {LIMITE_MAXIMO} and cursor an integer."},
+                                    status = http_status.HTTP_400_BAD_REQUEST)
+                if atualizacao.armazenamento == "compacto":
+                    pagina, proximo = leitura.pagina(items, cursor, limit)
+                    return Response({"results": pagina, "next_cursor": proximo})
+                pagina = list(leitura.linhas(items.filter(pk__gt = cursor)[:limit]))
+                return Response({
+                    "results": pagina,
+                    "next_cursor": pagina[-1]["id"] if len(pagina) == limit else None
+                })
+
+            if request.query_params.get("formato") == "colunar":
+                return Response(leitura.colunas(items))
+            return Response(list(leitura.linhas(items)))
+        except FiltroInvalido as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
+        except Atualizacao.DoesNotExist:
+              return Response({"details":f"Atualizacao object id {pk_atualizacao} does not exists."}, 
+                              status = http_status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@em_cache()
+def aggregate_table(request,table,pk_atualizacao):
+        """Agrega no banco os dados de uma tabela para uma atualizacao.
+           Aceita os mesmos filtros do listar-tabela (ano, ano_min, ano_max, pais, produto, cultivar, classificacao) e:
+           1) por: campos de agrupamento separados por vírgula, padrão ano
+           2) campo: métrica a agregar, padrão todas as métricas da tabela
+           3) funcao: sum (padrão), avg, min, max ou count
+           4) top: apenas os N grupos com maior valor da métrica
+
+           Ex: soma por ano: ?por=ano ; 10 países que mais importaram em dólares: ?por=pais&campo=valor_dolares&top=10
+        """
+        try:
+            choices = ['Producao','Comercializacao','Processamento','Importacao','Exportacao']
+            table = str(table).lower().capitalize()
+            if table not in choices:
+                return Response({"details":f"table parameter must be one of these: {','.join(choices)}"},
+                                status = http_status.HTTP_400_BAD_REQUEST)
+
+            atualizacao = Atualizacao.objects.get(pk = pk_atualizacao)
+            items = dados(table, atualizacao, request.query_params)
+            if atualizacao.armazenamento == "compacto":
+                return Response(compacto.agregar(items, request.query_params))
+            return Response(agregar(items, request.query_params))
+        except FiltroInvalido as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
+        except Atualizacao.DoesNotExist:
+              return Response({"details":f"Atualizacao object id {pk_atualizacao} does not exists."}, 
+                              status = http_status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@em_cache()
+def summary_table(request,resumo,pk_atualizacao):
+        """Lê um resumo já calculado ao final da carga da atualizacao, sem agregar as tabelas de dados:
+           1) total-anual: total de cada tabela por ano; ?tabela=producao traz só uma tabela
+           2) exportacao-pais: quantidade e valor exportados por país e ano
+           3) processamento-classificacao: kg processados por classificação e ano
+           Aceita os filtros ano, ano_min, ano_max, pais e classificacao quando existem no resumo.
+        """
+        try:
+            if resumo not in RESUMOS_POR_NOME:
+                return Response({"details":f"resumo parameter must be one of these: {','.join(RESUMOS_POR_NOME)}"},
+                                status = http_status.HTTP_400_BAD_REQUEST)
+            model = RESUMOS_POR_NOME[resumo]
+            atualizacao = Atualizacao.objects.get(pk = pk_atualizacao)
+            items = filtrar(model.objects.filter(atualizacao = atualizacao), request.query_params)
+            if "tabela" in request.query_params and model is ResumoTotalAnual:
+                items = items.filter(tabela = str(request.query_params["tabela"]).lower().capitalize())
+            leitura = leitura_rapida(globals().get(f"{model.__name__}Serializer"))
+            return Response(list(leitura.linhas(items.order_by("pk"))))
+        except FiltroInvalido as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
+        except Atualizacao.DoesNotExist:
+              return Response({"details":f"Atualizacao object id {pk_atualizacao} does not exists."}, 
+                              status = http_status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def export_table(request,table,pk_atualizacao):
+        """Exporta uma tabela de uma atualizacao para carga direta em DataFrames.
+           ?formato=csv (padrão), parquet ou arrow (Arrow IPC), sempre enviados em streaming; parquet e
+           arrow dependem do pyarrow instalado no servidor. Aceita os mesmos filtros do listar-tabela.
+
+           Ex: pd.read_parquet(".../api/exportar-tabela/producao/1/?formato=parquet")
+        """
+        try:
+            choices = ['Producao','Comercializacao','Processamento','Importacao','Exportacao']
+            table = str(table).lower().capitalize()
+            if table not in choices:
+                return Response({"details":f"table parameter must be one of these: {','.join(choices)}"},
+                                status = http_status.HTTP_400_BAD_REQUEST)
+            formato = request.query_params.get("formato", "csv")
+            if formato not in exports.EXTENSOES:
+                return Response({"details":f"formato must be one of these: {','.join(exports.EXTENSOES)}"},
+                                status = http_status.HTTP_400_BAD_REQUEST)
+
+            atualizacao = Atualizacao.objects.get(pk = pk_atualizacao)
+            items = dados(table, atualizacao, request.query_params)
+            serializer_class = globals().get(f"{table}Serializer")
+            nome = f"{table.lower()}_{atualizacao.id}.{exports.EXTENSOES[formato]}"
+
+            if formato == "csv":
+                partes = exports.csv_stream(items, serializer_class)
+            else:
+                partes = exports.binario_stream(items, serializer_class, formato)
+            response = StreamingHttpResponse(partes, content_type = exports.CONTENT_TYPES[formato])
+            response["Content-Disposition"] = f'attachment; filename="{nome}"'
+            return response
+        except exports.FormatoIndisponivel as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_501_NOT_IMPLEMENTED)
+        except FiltroInvalido as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
+        except Atualizacao.DoesNotExist:
+              return Response({"details":f"Atualizacao object id {pk_atualizacao} does not exists."}, 
+                              status = http_status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+def time_series(request,table,pk_atualizacao):
+        """Série ordenada por ano de uma entidade da tabela, para consumo direto em ML.
+           A entidade é dada por todas as dimensões da tabela (ex: ?pais=Angola&classificacao=espumantes
+           em exportacao, ?produto=... em producao). Parâmetros opcionais: campo (métricas separadas por
+           vírgula, padrão todas), ano_min e ano_max.
+
+           A resposta traz as dimensões, anos e uma lista de valores por métrica, na ordem dos anos.
+           Vem de um índice em memória da versão (api.series), montado na primeira consulta à tabela.
+           Um nome que aparece em mais de uma categoria do CSV (ex: Tinto em producao) não tem série
+           única e retorna 409.
+        """
+        try:
+            choices = ['Producao','Comercializacao','Processamento','Importacao','Exportacao']
+            table = str(table).lower().capitalize()
+            if table not in choices:
+                return Response({"details":f"table parameter must be one of these: {','.join(choices)}"},
+                                status = http_status.HTTP_400_BAD_REQUEST)
+            indice = series.indice(globals().get(table), pk_atualizacao, lambda: Atualizacao.objects.get(pk = pk_atualizacao))
+
+            faltantes = [dimensao for dimensao in indice.dimensoes if dimensao not in request.query_params]
+            if faltantes:
+                raise FiltroInvalido(f"the series of table {table} is identified by: {','.join(indice.dimensoes)}. Missing: {','.join(faltantes)}")
+            selecionadas = [campo.strip() for campo in request.query_params.get("campo", ",".join(indice.metricas)).split(",") if campo.strip()]
+            if not selecionadas or any(campo not in indice.metricas for campo in selecionadas):
+                raise FiltroInvalido(f"campo must be one of these: {','.join(indice.metricas)}")
+            ano_min = inteiro("ano_min", request.query_params["ano_min"]) if "ano_min" in request.query_params else None
+            ano_max = inteiro("ano_max", request.query_params["ano_max"]) if "ano_max" in request.query_params else None
+
+            chave = tuple(request.query_params[dimensao] for dimensao in indice.dimensoes)
+            serie = indice.serie(chave, ano_min, ano_max)
+            if serie is None:
+                return Response({"details":f"no series for {dict(zip(indice.dimensoes, chave))} in Atualizacao {pk_atualizacao}."},
+                                status = http_status.HTTP_404_NOT_FOUND)
+            anos, valores = serie
+            data = {**dict(zip(indice.dimensoes, chave)), "anos": anos.tolist()}
+            for campo in selecionadas:
+                #mesmo formato das métricas do listar-tabela: string com duas casas
+                data[campo] = [None if valor != valor else f"{valor:.2f}" for valor in valores[:, indice.metricas.index(campo)].tolist()]
+            return Response(data)
+        except series.SerieAmbigua as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_409_CONFLICT)
+        except FiltroInvalido as ex:
+              return Response({"details":str(ex)}, status = http_status.HTTP_400_BAD_REQUEST)
         except Atualizacao.DoesNotExist:
               return Response({"details":f"Atualizacao object id {pk_atualizacao} does not exists."}, 
-                              status = http_status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+                              status = http_status.HTTP_400_BAD_REQUEST)
+
+
+@require_GET
+def metrics(request):
+    """Métricas da última carga finalizada (tempos por etapa, linhas, bytes e linhas/s por fonte)
+    e contagem de atualizacoes por status, no formato texto do Prometheus."""
+    return HttpResponse(metricas.prometheus(), content_type = metricas.CONTENT_TYPE)
+
+
+def dados(table:str, atualizacao:Atualizacao, params):
+    """Linhas filtradas da tabela na versão, na ordem do id: um queryset ou, se a atualizacao
+    for compacta, uma api.compacto.ConsultaCompacta."""
+    model = globals().get(table)
+    if atualizacao.armazenamento == "compacto":
+        return compacto.filtrar(model, atualizacao, params)
+    return filtrar(model.objects.da_versao(atualizacao), params).order_by("pk")
+
+
+def leitura_da_versao(atualizacao:Atualizacao, serializer_class):
+    """LeituraRapida ou, se a atualizacao for compacta, LeituraCompacta do serializer."""
+    if atualizacao.armazenamento == "compacto":
+        return compacto.leitura_compacta(serializer_class)
+    return leitura_rapida(serializer_class)
+
+
+def stream_json(items, leitura:LeituraRapida, chunk_size:int = 2000):
+    """Gera um array JSON a partir do queryset, serializando chunk_size linhas por vez
+    a partir do .iterator(), assim a memória por requisição não depende do tamanho da tabela."""
+    yield "["
+    primeiro = True
+    for lote in lotes(leitura.linhas(items, chunk_size = chunk_size), chunk_size):
+        conteudo = json.dumps(lote, cls = JSONEncoder, ensure_ascii = False)[1:-1]
+        if conteudo:
+            yield conteudo if primeiro else "," + conteudo
+            primeiro = False
+    yield "]"
+
+
+def lotes(iteravel, tamanho:int):
+    iterador = iter(iteravel)
+    while lote := list(islice(iterador, tamanho)):
+        yield lote
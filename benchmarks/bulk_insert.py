@@ -0,0 +1,70 @@
+"""Benchmark da carga dos handlers do DefaultEmbrapaPipeline.
+
+Compara, para os mesmos CSVs, a carga antiga (um objects.create por linha)
+com a carga em lote (bulk_create em lotes de --batch-size) e imprime linhas/s.
+O benchmark roda em um banco de teste criado pelo Django, o db.sqlite3 não é tocado.
+
+Uso:
+    python benchmarks/bulk_insert.py --dir cache --batch-size 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+django.setup()
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Atualizacao
+from scripts import DefaultEmbrapaPipeline
+
+
+def medir(pipeline:DefaultEmbrapaPipeline, source:dict, csv_file_path:str, model):
+    """Executa o handle de uma fonte dentro de uma transação, como no run, e devolve (linhas, segundos)."""
+    atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "BENCHMARK")
+    inicio = time.perf_counter()
+    with transaction.atomic():
+        pipeline.handle(source, csv_file_path, atualizacao)
+    duracao = time.perf_counter() - inicio
+    linhas = model.objects.filter(atualizacao = atualizacao).count()
+    atualizacao.delete()
+    return linhas, duracao
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default = "cache", help = "diretório com os CSVs já baixados")
+    parser.add_argument("--batch-size", type = int, default = 1000)
+    args = parser.parse_args()
+
+    with open("sources.json") as f:
+        sources = json.load(f)['sources']
+
+    old_name = connection.creation.create_test_db(verbosity = 0)
+    try:
+        print(f"{'fonte':35} {'linhas':>8} {'loop (l/s)':>12} {'lote (l/s)':>12} {'ganho':>7}")
+        for fonte, source in sources.items():
+            csv_file_path = os.path.join(args.dir, os.path.basename(source['dst_file']))
+            if not os.path.exists(csv_file_path):
+                print(f"{fonte:35} arquivo {csv_file_path} não encontrado")
+                continue
+            model = django.apps.apps.get_model("api", source['prod_table'])
+
+            linhas, t_loop = medir(DefaultEmbrapaPipeline(bulk = False), source, csv_file_path, model)
+            _, t_lote = medir(DefaultEmbrapaPipeline(batch_size = args.batch_size), source, csv_file_path, model)
+            print(f"{fonte:35} {linhas:>8} {linhas / t_loop:>12.0f} {linhas / t_lote:>12.0f} {t_loop / t_lote:>6.1f}x")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark da carga de uma atualizacao em DataFrames.
+
+Carrega os CSVs em um banco de teste e, para cada tabela, compara o tempo de montar o
+DataFrame a partir do JSON do listar-tabela com o do csv e, se o pyarrow estiver
+instalado, do parquet e do arrow gerados por api/exports.py (tempo de leitura do cliente).
+
+Uso:
+    python benchmarks/export.py --dir cache --repeticoes 5
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+django.setup()
+
+import pandas as pd
+from django.db import connection
+from django.utils import timezone
+
+from api import exports
+from api import serializer as serializers
+from api.models import Atualizacao
+from benchmarks.serializer import cronometrar
+from scripts import DefaultEmbrapaPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default = "cache", help = "diretório com os CSVs já baixados")
+    parser.add_argument("--repeticoes", type = int, default = 5)
+    args = parser.parse_args()
+
+    with open("sources.json") as f:
+        sources = json.load(f)['sources']
+
+    formatos = ["csv"]
+    if importlib.util.find_spec("pyarrow") is not None:
+        formatos += ["parquet", "arrow"]
+
+    old_name = connection.creation.create_test_db(verbosity = 0)
+    try:
+        atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "SUCESSO")
+        pipeline = DefaultEmbrapaPipeline()
+        for fonte, source in sources.items():
+            csv_file_path = os.path.join(args.dir, os.path.basename(source['dst_file']))
+            if os.path.exists(csv_file_path):
+                pipeline.handle(source, csv_file_path, atualizacao)
+
+        leitores = {
+            "csv": pd.read_csv,
+            "parquet": pd.read_parquet,
+            "arrow": pd.read_feather
+        }
+        print(f"{'tabela':18} {'linhas':>8} {'json (s)':>9} " + " ".join(f"{f + ' (s)':>12}" for f in formatos))
+        for table in ["Producao", "Processamento", "Comercializacao", "Importacao", "Exportacao"]:
+            model = django.apps.apps.get_model("api", table)
+            serializer_class = getattr(serializers, f"{table}Serializer")
+            items = model.objects.da_versao(atualizacao).order_by("pk")
+
+            #o JSON traz os decimais como string, então o cliente ainda precisa converter os tipos
+            leitura = serializers.leitura_rapida(serializer_class)
+            corpo = json.dumps(list(leitura.linhas(items))).encode()
+            dtypes = exports.tipos(model, leitura.campos)
+            t_json = cronometrar(lambda: pd.DataFrame(json.loads(corpo), columns = leitura.campos).astype(dtypes), args.repeticoes)
+            tempos = []
+            for formato in formatos:
+                destino = io.BytesIO()
+                exports.escrever(items, serializer_class, formato, destino)
+                conteudo = destino.getvalue()
+                tempos.append(cronometrar(lambda: leitores[formato](io.BytesIO(conteudo)), args.repeticoes))
+            print(f"{table:18} {items.count():>8} {t_json:>9.4f} " + " ".join(f"{t:>12.4f}" for t in tempos))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+
+if __name__ == "__main__":
+    main()
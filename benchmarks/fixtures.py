@@ -0,0 +1,129 @@
+"""Gera os CSVs de teste (test_file do sources.json) no layout dos arquivos da EMBRAPA.
+
+Os arquivos de escala 1 têm o tamanho dos arquivos reais (número de linhas por fonte em
+LINHAS, anos de 1970 a 2023) e ficam versionados em test_data/. As escalas maiores repetem
+as entidades com sufixo (#2, #3...) e vão para test_data/x<escala>/, fora do git.
+Como nos arquivos reais, as fontes com a coluna control têm linhas de categoria seguidas dos
+seus itens, com o valor de cada ano igual à soma dos itens, e alguns nomes de item se repetem
+em todas as categorias (ex: Tinto e Branco em VINHO DE MESA e em VINHO FINO DE MESA), com um
+control diferente em cada uma.
+Os valores são determinísticos: a mesma escala gera sempre os mesmos arquivos.
+
+Uso:
+    python benchmarks/fixtures.py --escala 10
+"""
+import argparse
+import json
+import os
+import random
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ANOS = range(1970, 2024)
+
+#linhas por fonte nos arquivos reais da EMBRAPA
+LINHAS = {
+    "producao": 70,
+    "processamento_viniferas": 160,
+    "processamento_americanas": 70,
+    "processamento_mesa": 50,
+    "processamento_sem_classificacao": 20,
+    "comercializacao": 65,
+    "importacao": 130,
+    "exportacao": 140
+}
+
+#proporção de células com marcadores e vazias nas fontes de processamento
+MARCADORES = ["nd", "*"]
+
+#nas fontes com control: uma linha de categoria a cada CATEGORIA linhas, e os REPETIDOS
+#primeiros itens de cada categoria com o mesmo nome em todas elas
+CATEGORIA = 10
+REPETIDOS = 2
+
+
+def diretorio(escala:int) -> str:
+    return os.path.join(BASE_DIR, "test_data") if escala == 1 else os.path.join(BASE_DIR, "test_data", f"x{escala}")
+
+
+def valor(aleatorio:random.Random, processamento:bool) -> str:
+    sorteio = aleatorio.random()
+    if processamento and sorteio < 0.03:
+        return aleatorio.choice(MARCADORES)
+    if processamento and sorteio < 0.05:
+        return ""
+    if sorteio < 0.15:
+        return "0"
+    return str(aleatorio.randint(1, 5_000_000))
+
+
+def nome_e_control(dimensao:str, i:int, control:bool) -> tuple:
+    """Nome da entidade da linha i e o seu control (None nas fontes sem a coluna control)."""
+    if not control:
+        return f"{dimensao.capitalize()} {i:03d}", None
+    categoria, posicao = divmod(i, CATEGORIA)
+    if posicao == 0:
+        nome = f"CATEGORIA {categoria:02d}"
+        return nome, nome
+    if posicao <= REPETIDOS:
+        nome = f"{dimensao.capitalize()} comum {posicao}"
+    else:
+        nome = f"{dimensao.capitalize()} {i:03d}"
+    return nome, f"c{categoria:02d}_{nome}"
+
+
+def gerar_fonte(caminho:str, fonte:str, source:dict, escala:int):
+    aleatorio = random.Random(f"{fonte}:{escala}")
+    delimitador = source.get('delimiter', ";")
+    dimensao = next(iter(source['dimensoes'].values()))
+    n_valores = len(source['valores'])
+    processamento = source['prod_table'] == "Processamento"
+    base = LINHAS.get(fonte) or LINHAS[fonte.split("_")[0]]
+
+    #importação/exportação não têm a coluna control
+    control = source['prod_table'] not in ("Importacao", "Exportacao")
+
+    with open(caminho, "w", encoding = "utf-8", newline = "") as f:
+        cabecalho = ["id", "control", dimensao] if control else ["Id", dimensao]
+        cabecalho += [str(ano) for ano in ANOS for _ in range(n_valores)]
+        f.write(delimitador.join(cabecalho) + "\n")
+
+        id = 0
+        for copia in range(1, escala + 1):
+            sufixo = "" if copia == 1 else f" #{copia}"
+            linhas = [[valor(aleatorio, processamento) for _ in range(len(ANOS) * n_valores)] for _ in range(base)]
+            if control:
+                for categoria in range(0, base, CATEGORIA):
+                    itens = linhas[categoria + 1:categoria + CATEGORIA]
+                    linhas[categoria] = [str(sum(int(v) for v in celulas if v.isdigit())) for celulas in zip(*itens)]
+            for i, valores in enumerate(linhas):
+                id += 1
+                nome, ctl = nome_e_control(dimensao, i, control)
+                nome += sufixo
+                inicio = [str(id), ctl + sufixo, nome] if control else [str(id), nome]
+                f.write(delimitador.join(inicio + valores) + "\n")
+
+
+def gerar(escala:int = 1, forcar:bool = False) -> str:
+    """Gera os CSVs da escala que ainda não existem e retorna o diretório deles."""
+    with open(os.path.join(BASE_DIR, "sources.json")) as f:
+        sources = json.load(f)['sources']
+    destino = diretorio(escala)
+    os.makedirs(destino, exist_ok = True)
+    for fonte, source in sources.items():
+        caminho = os.path.join(destino, os.path.basename(source['test_file']))
+        if forcar or not os.path.exists(caminho):
+            gerar_fonte(caminho, fonte, source, escala)
+    return destino
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", type = int, default = 1)
+    parser.add_argument("--forcar", action = "store_true", help = "regera os arquivos que já existem")
+    args = parser.parse_args()
+    print(gerar(args.escala, args.forcar))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark da limpeza numérica dos CSVs de processamento.
+
+Para cada CSV de processamento compara a limpeza antiga (texto e um apply com
+isdigit célula a célula) com o DefaultEmbrapaPipeline.limpar (pd.to_numeric por coluna),
+e mostra quantas células cada uma zerou além das vazias.
+
+Uso:
+    python benchmarks/limpeza.py --dir cache --repeticoes 5
+"""
+import argparse
+import json
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+django.setup()
+
+import pandas as pd
+
+from benchmarks.serializer import cronometrar
+from scripts import COLUNA_ANO, SENTINELAS, DefaultEmbrapaPipeline
+
+
+def limpeza_antiga(valores:pd.DataFrame) -> pd.DataFrame:
+    """A limpeza dos antigos handle_processamento_*, aplicada a todas as colunas de ano.
+    map(str) no lugar do astype(str) original: no pandas 3 o astype(str) mantém NaN em vez de "nan"."""
+    return valores.apply(lambda coluna: coluna.map(str).apply(lambda x: 0 if not x.isdigit() else x).astype(float))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default = "cache", help = "diretório com os CSVs já baixados")
+    parser.add_argument("--repeticoes", type = int, default = 5)
+    args = parser.parse_args()
+
+    with open("sources.json") as f:
+        sources = json.load(f)['sources']
+
+    pipeline = DefaultEmbrapaPipeline()
+    print(f"{'fonte':35} {'células':>8} {'apply (s)':>10} {'to_numeric (s)':>15} {'ganho':>7} {'zeradas antes':>14} {'coagidas agora':>15}")
+    for fonte, source in sources.items():
+        if source['prod_table'] != "Processamento":
+            continue
+        csv_file_path = os.path.join(args.dir, os.path.basename(source['dst_file']))
+        if not os.path.exists(csv_file_path):
+            print(f"{fonte:35} arquivo {csv_file_path} não encontrado")
+            continue
+        df = pd.read_csv(csv_file_path, delimiter = source.get('delimiter', ";"))
+        valores = df[[coluna for coluna in df.columns if COLUNA_ANO.match(str(coluna))]]
+        sentinelas = source.get('sentinelas', SENTINELAS)
+
+        t_antiga = cronometrar(lambda: limpeza_antiga(valores), args.repeticoes)
+        t_nova = cronometrar(lambda: pipeline.limpar(valores, sentinelas), args.repeticoes)
+
+        numeros = valores.apply(pd.to_numeric, errors = "coerce")
+        zeradas = int(((limpeza_antiga(valores) == 0) & (numeros != 0) & valores.notna()).to_numpy().sum())
+        _, relatorio = pipeline.limpar(valores, sentinelas)
+        coagidas = sum(relatorio['sentinelas'].values()) + relatorio['invalidos']
+        print(f"{fonte:35} {valores.size:>8} {t_antiga:>10.4f} {t_nova:>15.4f} {t_antiga / t_nova:>6.1f}x {zeradas:>14} {coagidas:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Benchmark de memória da carga de um CSV grande, com e sem chunk_rows.
+
+Gera CSVs sintéticos no layout de exportação (um par quantidade/valor por ano desde 1970)
+com cada número de linhas de --linhas e, para cada um, roda DefaultEmbrapaPipeline.handle
+num processo novo, gravando num banco de teste em disco. Mostra o pico de memória (RSS)
+acima do processo já inicializado: com chunk_rows ele fica estável quando o arquivo cresce.
+
+Uso:
+    python benchmarks/memoria.py --linhas 20000,80000 --chunk-rows 2000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+ANOS = range(1970, 2025)
+
+
+def gerar_csv(caminho:str, linhas:int):
+    with open(caminho, "w", encoding = "utf-8") as f:
+        f.write("Id;País;" + ";".join(f"{ano};{ano}" for ano in ANOS) + "\n")
+        for i in range(linhas):
+            f.write(f"{i};País {i};" + ";".join(f"{(i + ano) % 997};{(i * ano) % 9973}" for ano in ANOS) + "\n")
+
+
+def pico_mb() -> float:
+    #ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def medir(csv_file_path:str, chunk_rows:int):
+    """Executado no processo filho: carrega o CSV e imprime um JSON com pico de memória e tempo."""
+    import django
+    django.setup()
+
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from api.models import Atualizacao
+    from scripts import DefaultEmbrapaPipeline
+
+    with open("sources.json") as f:
+        source = json.load(f)['sources']['exportacao_espumantes']
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        #o banco de teste padrão do SQLite fica em memória e cresceria com as linhas gravadas
+        connection.settings_dict['TEST']['NAME'] = os.path.join(diretorio, "memoria.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity = 0)
+        try:
+            atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "BENCHMARK")
+            pipeline = DefaultEmbrapaPipeline(chunk_rows = chunk_rows)
+            inicial = pico_mb()
+            inicio = time.perf_counter()
+            with transaction.atomic():
+                pipeline.handle(source, csv_file_path, atualizacao)
+            duracao = time.perf_counter() - inicio
+            print(json.dumps({"pico_mb": pico_mb() - inicial, "segundos": duracao}))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", default = "20000,80000", help = "linhas dos CSVs gerados, separadas por vírgula")
+    parser.add_argument("--chunk-rows", type = int, default = 2000)
+    parser.add_argument("--medir", nargs = 2, metavar = ("CSV", "CHUNK_ROWS"), help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        csv_file_path, chunk_rows = args.medir
+        return medir(csv_file_path, int(chunk_rows) or None)
+
+    print(f"{'linhas':>8} {'arquivo (MB)':>13} {'modo':>14} {'pico (MB)':>10} {'tempo (s)':>10}")
+    with tempfile.TemporaryDirectory() as diretorio:
+        for linhas in [int(n) for n in args.linhas.split(",")]:
+            csv_file_path = os.path.join(diretorio, f"exportacao_{linhas}.csv")
+            gerar_csv(csv_file_path, linhas)
+            tamanho = os.path.getsize(csv_file_path) / 1024 / 1024
+            for chunk_rows in [0, args.chunk_rows]:
+                saida = subprocess.run([sys.executable, os.path.abspath(__file__), "--medir", csv_file_path, str(chunk_rows)],
+                                       capture_output = True, text = True, check = True)
+                medida = json.loads(saida.stdout.strip().splitlines()[-1])
+                modo = f"blocos {chunk_rows}" if chunk_rows else "arquivo inteiro"
+                print(f"{linhas:>8} {tamanho:>13.1f} {modo:>14} {medida['pico_mb']:>10.1f} {medida['segundos']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
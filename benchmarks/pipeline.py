@@ -0,0 +1,338 @@
+"""Benchmark de ponta a ponta: carga pelo DefaultEmbrapaPipeline.run e leitura pelo list_table.
+
+Para cada escala de --escala os CSVs de benchmarks/fixtures.py (o test_file de cada fonte,
+escala 1 versionada em test_data/) são carregados num banco de teste em disco com o run
+completo e origem = "teste", sem download. Os tempos por fonte e etapa vêm do detalhes
+gravado pelo run. Em seguida cada tabela é lida pelo listar-tabela
+com --clientes threads simultâneas fazendo --requisicoes requisições cada uma, sem o
+cache de respostas (a não ser com --cache), e são medidos p50, p95 e requisições/s.
+
+Com --armazenamento compacto a carga grava uma SerieCompacta por entidade em vez de uma linha
+por ano, e a leitura passa pelo desempacotamento das séries (api.compacto).
+
+Com --workers 1,2 a carga é repetida (reprocessando todas as fontes) para cada número de
+parse_workers (com parse_min_bytes = 0, todas as fontes no pool), e são mostrados o tempo total, a soma de read_csv + reshape, a soma dos inserts e o
+custo de partida do pool (spawn + django.setup em cada processo), já incluído no total.
+
+Com --durante-carga a carga é repetida numa thread enquanto o Producao da primeira versão
+é lido em sequência, para comparar a latência das leituras com e sem uma carga em andamento.
+
+O resultado vai para benchmarks/resultados/<commit>.json; --comparar <arquivo> mostra a
+variação em relação a um resultado anterior, para enxergar regressões entre commits.
+
+Uso:
+    python benchmarks/pipeline.py --escala 1,10 --clientes 4 --requisicoes 10
+    python benchmarks/pipeline.py --comparar benchmarks/resultados/74bc059.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+TABELAS = ["Producao", "Processamento", "Comercializacao", "Importacao", "Exportacao"]
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", default = "1", help = "escalas das fixtures, separadas por vírgula")
+    parser.add_argument("--clientes", type = int, default = 4, help = "threads simultâneas no list_table")
+    parser.add_argument("--requisicoes", type = int, default = 10, help = "requisições por cliente e tabela")
+    parser.add_argument("--armazenamento", choices = ["linhas", "compacto"], default = "linhas",
+                        help = "como a carga grava as linhas")
+    parser.add_argument("--workers", help = "números de parse_workers a comparar, separados por vírgula (ex: 1,2,4)")
+    parser.add_argument("--durante-carga", action = "store_true", help = "mede leituras durante uma segunda carga")
+    parser.add_argument("--cache", action = "store_true", help = "mantém o cache de respostas ligado")
+    parser.add_argument("--saida", help = "arquivo do resultado (padrão: benchmarks/resultados/<commit>.json)")
+    parser.add_argument("--comparar", help = "resultado anterior para comparar")
+    return parser.parse_args()
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def percentil(tempos:list, p:float) -> float:
+    ordenados = sorted(tempos)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def carregar(sources:dict, diretorio:str, trabalho:str, armazenamento:str = "linhas", **opcoes) -> tuple:
+    """Executa o run completo com os CSVs de diretorio e retorna a atualizacao e o tempo total."""
+    from django.utils import timezone
+    from api.models import Atualizacao
+    from scripts import DefaultEmbrapaPipeline
+
+    #origem "teste" lê o test_file de cada fonte, aqui apontado para o diretório da escala
+    locais = {fonte: {**source,
+                      'test_file': os.path.join(diretorio, os.path.basename(source['test_file'])),
+                      'dst_file': os.path.join(trabalho, os.path.basename(source['dst_file']))}
+              for fonte, source in sources.items()}
+    atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "PENDENTE")
+    pipeline = DefaultEmbrapaPipeline(manifest_file = os.path.join(trabalho, "manifest.json"), origem = "teste",
+                                      armazenamento = armazenamento, **opcoes)
+    inicio = time.perf_counter()
+    pipeline.run(locais, atualizacao)
+    return atualizacao, time.perf_counter() - inicio
+
+
+def ler(table:str, pk:int, clientes:int, requisicoes:int) -> dict:
+    """Lê a tabela inteira pelo listar-tabela com clientes threads simultâneas."""
+    from django.db import connection
+    from django.test import Client
+
+    url = f"/api/listar-tabela/{table}/{pk}/"
+    tempos = []
+    erros = []
+    trava = threading.Lock()
+
+    def cliente():
+        client = Client()
+        try:
+            for _ in range(requisicoes):
+                inicio = time.perf_counter()
+                response = client.get(url)
+                duracao = time.perf_counter() - inicio
+                with trava:
+                    tempos.append(duracao)
+                    if response.status_code != 200:
+                        erros.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target = cliente) for _ in range(clientes)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - inicio
+    return {
+        "requisicoes": len(tempos),
+        "erros": len(erros),
+        "p50_s": round(percentil(tempos, 50), 4),
+        "p95_s": round(percentil(tempos, 95), 4),
+        "req_s": round(len(tempos) / total, 2)
+    }
+
+
+def ler_durante_carga(sources:dict, diretorio:str, trabalho:str, pk:int, armazenamento:str) -> dict:
+    """Repete a carga numa thread e lê o Producao da atualizacao pk até ela terminar."""
+    from django.db import connection
+    from django.test import Client
+
+    #sem o manifest as fontes são reprocessadas em vez de copiadas da primeira carga
+    os.remove(os.path.join(trabalho, "manifest.json"))
+    carga = {}
+
+    def executar():
+        try:
+            carga['atualizacao'], carga['duracao'] = carregar(sources, diretorio, trabalho, armazenamento)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target = executar)
+    client = Client()
+    tempos = []
+    erros = 0
+    thread.start()
+    while thread.is_alive():
+        inicio = time.perf_counter()
+        try:
+            erros += client.get(f"/api/listar-tabela/Producao/{pk}/").status_code != 200
+        except Exception:
+            erros += 1
+        tempos.append(time.perf_counter() - inicio)
+    thread.join()
+    return {
+        "carga_s": round(carga.get('duracao', 0), 4),
+        "requisicoes": len(tempos),
+        "erros": erros,
+        "p50_s": round(percentil(tempos, 50), 4) if tempos else None,
+        "p95_s": round(percentil(tempos, 95), 4) if tempos else None
+    }
+
+
+def partida_pool(workers:int) -> float:
+    """Tempo para o pool do run ficar pronto: spawn dos processos e django.setup em cada um."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import django
+
+    inicio = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn"),
+                               initializer = django.setup)
+    try:
+        #um sleep por processo, para que todos precisem partir
+        list(pool.map(time.sleep, [0.05] * workers))
+    finally:
+        pool.shutdown()
+    return time.perf_counter() - inicio - 0.05
+
+
+def medir_workers(sources:dict, diretorio:str, trabalho:str, args) -> dict:
+    """Carga completa com cada número de parse_workers, reprocessando todas as fontes."""
+    resultado = {}
+    print(f"{'workers':>8} {'total (s)':>10} {'transform (s)':>14} {'insert (s)':>11} {'partida pool (s)':>17}")
+    for workers in [int(n) for n in args.workers.split(",")]:
+        #sem o manifest as fontes são reprocessadas em vez de copiadas da carga anterior
+        if os.path.exists(os.path.join(trabalho, "manifest.json")):
+            os.remove(os.path.join(trabalho, "manifest.json"))
+        atualizacao, duracao = carregar(sources, diretorio, trabalho, args.armazenamento, parse_workers = workers,
+                                        parse_min_bytes = 0)
+        atualizacao.refresh_from_db()
+        fontes = [info.get("metricas") or {} for info in json.loads(atualizacao.detalhes)['fontes'].values()]
+        medida = {
+            "duracao_s": round(duracao, 4),
+            "transform_s": round(sum(m.get("read_csv_s", 0) + m.get("reshape_s", 0) for m in fontes), 4),
+            "insert_s": round(sum(m.get("insert_s", 0) for m in fontes), 4),
+            "partida_pool_s": round(partida_pool(workers), 4) if workers > 1 else 0
+        }
+        resultado[str(workers)] = medida
+        print(f"{workers:>8} {medida['duracao_s']:>10.3f} {medida['transform_s']:>14.3f} {medida['insert_s']:>11.3f} {medida['partida_pool_s']:>17.3f}")
+    return resultado
+
+
+def contar(table:str, atualizacao) -> int:
+    """Linhas (entidade, ano) da tabela na versão, também numa atualizacao compacta."""
+    from django.apps import apps
+    from api import compacto, serializer
+
+    model = apps.get_model("api", table)
+    if atualizacao.armazenamento == "compacto":
+        leitura = compacto.leitura_compacta(getattr(serializer, f"{table}Serializer"))
+        return sum(len(bloco) for bloco in leitura.blocos(compacto.filtrar(model, atualizacao, {})))
+    return model.objects.da_versao(atualizacao).count()
+
+
+def medir_escala(sources:dict, escala:int, args) -> dict:
+    from django.db import connection
+    from benchmarks.fixtures import gerar
+
+    diretorio = gerar(escala)
+    with tempfile.TemporaryDirectory() as trabalho:
+        #em disco, para que as threads de leitura vejam o mesmo banco
+        connection.settings_dict['TEST']['NAME'] = os.path.join(trabalho, "pipeline.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity = 0)
+        try:
+            atualizacao, duracao = carregar(sources, diretorio, trabalho, args.armazenamento)
+            atualizacao.refresh_from_db()
+            detalhes = json.loads(atualizacao.detalhes)
+            fontes = {fonte: info.get("metricas") or {} for fonte, info in detalhes['fontes'].items()}
+            linhas = sum(metricas.get("linhas", 0) for metricas in fontes.values())
+            print(f"\nescala {escala}: {linhas} linhas em {duracao:.2f}s ({linhas / duracao:.0f} linhas/s), status {atualizacao.status}")
+            print(f"{'fonte':35} {'linhas':>8} {'read_csv':>9} {'reshape':>9} {'insert':>9} {'linhas/s':>10}")
+            for fonte, metricas in fontes.items():
+                print(f"{fonte:35} {metricas.get('linhas', 0):>8} {metricas.get('read_csv_s', 0):>9.4f} "
+                      f"{metricas.get('reshape_s', 0):>9.4f} {metricas.get('insert_s', 0):>9.4f} {metricas.get('linhas_por_s', 0):>10.0f}")
+
+            leitura = {}
+            print(f"{'tabela':18} {'linhas':>8} {'p50 (s)':>9} {'p95 (s)':>9} {'req/s':>8} {'erros':>6}")
+            for table in TABELAS:
+                total = contar(table, atualizacao)
+                leitura[table] = {"linhas": total, **ler(table, atualizacao.id, args.clientes, args.requisicoes)}
+                medida = leitura[table]
+                print(f"{table:18} {total:>8} {medida['p50_s']:>9.4f} {medida['p95_s']:>9.4f} {medida['req_s']:>8.1f} {medida['erros']:>6}")
+
+            workers = medir_workers(sources, diretorio, trabalho, args) if args.workers else None
+
+            durante = None
+            if args.durante_carga:
+                durante = ler_durante_carga(sources, diretorio, trabalho, atualizacao.id, args.armazenamento)
+                print(f"Producao durante a carga ({durante['carga_s']:.2f}s): {durante['requisicoes']} leituras, "
+                      f"p50 {durante['p50_s']}s, p95 {durante['p95_s']}s, {durante['erros']} erros")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+    return {
+        "status": atualizacao.status,
+        "duracao_s": round(duracao, 4),
+        "linhas": linhas,
+        "linhas_por_s": round(linhas / duracao, 2),
+        "fontes": fontes,
+        "list_table": leitura,
+        "workers": workers,
+        "durante_carga": durante
+    }
+
+
+def comparar(atual:dict, anterior:dict):
+    """Mostra a variação do tempo de carga e do p50 do list_table em cada escala presente nos dois resultados."""
+    print(f"\ncomparação com {anterior['commit']} ({anterior['data']})")
+    for escala, medida in atual['escalas'].items():
+        antes = anterior['escalas'].get(escala)
+        if antes is None:
+            continue
+        variacao = (medida['duracao_s'] / antes['duracao_s'] - 1) * 100
+        print(f"escala {escala}: carga {antes['duracao_s']:.3f}s -> {medida['duracao_s']:.3f}s ({variacao:+.1f}%)")
+        for table, leitura in medida['list_table'].items():
+            if table in antes['list_table'] and antes['list_table'][table]['p50_s']:
+                p50 = antes['list_table'][table]['p50_s']
+                print(f"  {table:18} p50 {p50:.4f}s -> {leitura['p50_s']:.4f}s ({(leitura['p50_s'] / p50 - 1) * 100:+.1f}%)")
+
+
+def main():
+    args = argumentos()
+    cache_respostas = None
+    if not args.cache:
+        os.environ["CACHE_RESPOSTAS_BACKEND"] = "django.core.cache.backends.dummy.DummyCache"
+    else:
+        #um diretório só desta execução: o padrão é compartilhado com a API rodando na máquina
+        cache_respostas = tempfile.TemporaryDirectory(prefix = "benchmark_respostas_")
+        os.environ["CACHE_RESPOSTAS_LOCATION"] = cache_respostas.name
+
+    import django
+    django.setup()
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+    with open("sources.json") as f:
+        sources = json.load(f)['sources']
+
+    import numpy
+    import pandas
+    resultado = {
+        "commit": commit(),
+        "data": datetime.now(dt_timezone.utc).isoformat(timespec = "seconds"),
+        "ambiente": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "pandas": pandas.__version__,
+            "numpy": numpy.__version__,
+            "cpus": os.cpu_count()
+        },
+        "parametros": {"clientes": args.clientes, "requisicoes": args.requisicoes, "cache": args.cache,
+                       "durante_carga": args.durante_carga, "armazenamento": args.armazenamento,
+                       "workers": args.workers},
+        "escalas": {}
+    }
+    for escala in [int(n) for n in args.escala.split(",")]:
+        resultado['escalas'][str(escala)] = medir_escala(sources, escala, args)
+
+    saida = args.saida or os.path.join(BASE_DIR, "benchmarks", "resultados", f"{resultado['commit']}.json")
+    os.makedirs(os.path.dirname(saida), exist_ok = True)
+    with open(saida, "w", encoding = "utf-8") as f:
+        json.dump(resultado, f, indent = 2, ensure_ascii = False)
+    print(f"\nresultado gravado em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding = "utf-8") as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark do caminho de leitura do list_table.
+
+Carrega os CSVs em um banco de teste e, para cada tabela, compara o tempo de
+XxxSerializer(items, many = True).data com o da LeituraRapida (values_list),
+conferindo que as duas saídas são idênticas. O queryset do serializer traz as dimensões
+com select_related, como a LeituraRapida com o JOIN, para que a comparação meça só o
+custo da serialização e não as consultas de cada SlugRelatedField.
+
+Uso:
+    python benchmarks/serializer.py --dir cache --repeticoes 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+django.setup()
+
+from django.db import connection
+from django.utils import timezone
+
+from api import serializer as serializers
+from api.models import Atualizacao, Dimensao
+from scripts import DefaultEmbrapaPipeline
+
+
+def cronometrar(funcao, repeticoes:int) -> float:
+    """Menor tempo entre as repetições, em segundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default = "cache", help = "diretório com os CSVs já baixados")
+    parser.add_argument("--repeticoes", type = int, default = 5)
+    args = parser.parse_args()
+
+    with open("sources.json") as f:
+        sources = json.load(f)['sources']
+
+    old_name = connection.creation.create_test_db(verbosity = 0)
+    try:
+        atualizacao = Atualizacao.objects.create(ts = timezone.now(), status = "SUCESSO")
+        pipeline = DefaultEmbrapaPipeline()
+        for fonte, source in sources.items():
+            csv_file_path = os.path.join(args.dir, os.path.basename(source['dst_file']))
+            if os.path.exists(csv_file_path):
+                pipeline.handle(source, csv_file_path, atualizacao)
+
+        print(f"{'tabela':18} {'linhas':>8} {'serializer (s)':>15} {'rápida (s)':>11} {'ganho':>7}")
+        for table in ["Producao", "Processamento", "Comercializacao", "Importacao", "Exportacao"]:
+            model = django.apps.apps.get_model("api", table)
+            serializer_class = getattr(serializers, f"{table}Serializer")
+            leitura = serializers.leitura_rapida(serializer_class)
+            items = model.objects.da_versao(atualizacao).order_by("pk")
+            dimensoes = [f.name for f in model._meta.fields if f.is_relation and issubclass(f.related_model, Dimensao)]
+            com_dimensoes = items.select_related(*dimensoes)
+
+            lento = serializer_class(com_dimensoes, many = True).data
+            rapido = list(leitura.linhas(items))
+            assert json.dumps(lento) == json.dumps(rapido), f"saídas diferentes em {table}"
+
+            t_serializer = cronometrar(lambda: serializer_class(com_dimensoes.all(), many = True).data, args.repeticoes)
+            t_rapida = cronometrar(lambda: list(leitura.linhas(items.all())), args.repeticoes)
+            print(f"{table:18} {len(rapido):>8} {t_serializer:>15.4f} {t_rapida:>11.4f} {t_serializer / t_rapida:>6.1f}x")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,68 @@
-from django.shortcuts import render
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from abc import ABC, abstractmethod
 import pandas as pd
-from datetime import datetime
+import numpy as np
+import re
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import tempfile
+import time
+import hashlib
+import shutil
+import tarfile
+import zipfile
+import fnmatch
 
 import os
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+#o módulo é importado com o Django já configurado (manage.py, API ou benchmarks); os processos
+#do pool de parse_workers o configuram no initializer, antes de receberem a primeira fonte
 import django
-from django.db import transaction
-django.setup()
+from django.db import transaction, connection, reset_queries
+from django.apps import apps
 
-from api.models import (
-    Producao,Processamento,Comercializacao,Importacao,Exportacao,Atualizacao)
+from api.models import Atualizacao,Classificacao,Dimensao,SerieCompacta,RESUMOS,TABELAS
+from django.db import models
+from django.db.models import Sum, Value
 
 
+MODOS = ["completo", "diferencial"]
+
+#como as linhas são gravadas: uma por (entidade, ano) nas tabelas de dados ou uma SerieCompacta por entidade
+ARMAZENAMENTOS = ["linhas", "compacto"]
+
+#de onde o downloader obtém os CSVs: rede (url), cache (o dst_file já existente),
+#teste (o test_file de cada fonte) ou arquivo (um .zip/.tar com os CSVs já baixados)
+ORIGENS = ["rede", "cache", "teste", "arquivo"]
+
+#CSVs menores que isso são transformados no próprio processo mesmo com parse_workers > 1: a partida
+#do pool (spawn + django.setup, ~0,4s por processo) custa mais que o transform deles (~0,1s por MB)
+PARSE_MIN_BYTES = 16 * 1024 * 1024
+
+#colunas de valor dos CSVs: o ano, com sufixo .1, .2... quando o ano tem mais de uma coluna
+COLUNA_ANO = re.compile(r"^(\d{4})(\.\d+)?$")
+
+#coluna dos CSVs com categorias (producao, comercializacao, processamento): nas linhas de categoria
+#ela é igual ao nome (ex: VINHO DE MESA;VINHO DE MESA) e nos itens traz um prefixo (ex: vm_Tinto;Tinto)
+COLUNA_CONTROL = "control"
+
+#marcadores usados pela EMBRAPA no lugar de números (nd = não disponível, * = omitido) e o valor gravado
+#no lugar de cada um; podem ser trocados por fonte com a chave 'sentinelas' do sources.json
+SENTINELAS = {"nd": 0, "*": 0, "-": 0}
+
 
 class Pipeline(ABC):
     """Essa é a 'interface' para os Pipelines. Todas as classes que a implementão terão
       o método run"""
     @abstractmethod
-    def run(self,sources:dict,atualizacao:object):
+    def run(self,sources:dict,atualizacao:object,callback = None):
         """O método run será implementado em todas as subclasses. Ele servirá para 
         executar todo o pipeline de dados proposto.
         1) Deverá ser passado a ele um dict com os sources
-        2) Deverá ser passado um callback em que 
+        2) Poderá ser passado um callback(fonte, etapa, **info) em que o progresso
+        de cada fonte é informado
 
         """
         ...
@@ -34,63 +72,14 @@ class EmbrapaPipeline(Pipeline,ABC):
     Todos deverão implemtar os métodos abaixo"""
 
     @abstractmethod
-    def handle_producao(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_processamento_viniferas(self,csv_file_path:str,atualizacao:int):
-        ...
-    
-    @abstractmethod
-    def handle_processamento_americanas(self,csv_file_path:str,atualizacao:int):
-        ...
-    
-    @abstractmethod
-    def handle_processamento_mesa(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_processamento_sem_classificacao(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_comercializacao(self,csv_file_path:str,atualizacao:int):
+    def transform(self, source:dict, csv_file_path:str) -> dict:
+        """Transforma o CSV de uma fonte, descrita pela sua entrada do sources.json,
+        nas linhas que vão para o banco."""
         ...
 
     @abstractmethod
-    def handle_importacao_vinhos_de_mesa(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_importacao_espumantes(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_importacao_uvas_frescas(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_importacao_uvas_passas(self,csv_file_path:str,atualizacao:int):
-        ...
-    
-    @abstractmethod
-    def handle_importacao_suco_de_uva(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_exportacao_vinhos_de_mesa(self,csv_file_path:str,atualizacao:int):
-        ...
-    
-    @abstractmethod
-    def handle_exportacao_espumantes(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_exportacao_uvas_frescas(self,csv_file_path:str,atualizacao:int):
-        ...
-
-    @abstractmethod
-    def handle_exportacao_suco_de_uva(self,csv_file_path:str,atualizacao:int):
+    def handle(self, source:dict, csv_file_path:str, atualizacao:object):
+        """Transforma o CSV de uma fonte e grava o resultado na atualizacao."""
         ...
 
 class DefaultEmbrapaPipeline(EmbrapaPipeline):
@@ -98,629 +87,917 @@ class DefaultEmbrapaPipeline(EmbrapaPipeline):
     Ela serve para garantir que todo o fluxo, de download até o
     armazenamento no banco de dados seja realizado com sucesso."""
 
+    def __init__(self, batch_size:int = 1000, bulk:bool = True,
+                 download_workers:int = 4, timeout:float = 60, retries:int = 3,
+                 backoff:float = 1, chunk_size:int = 64 * 1024,
+                 manifest_file:str = "cache/manifest.json", modo:str = "completo",
+                 parse_workers:int = 1, chunk_rows:int = None, origem:str = "rede",
+                 arquivo:str = None, parcial:bool = False, armazenamento:str = "linhas",
+                 parse_min_bytes:int = PARSE_MIN_BYTES):
+        """batch_size define quantas linhas são enviadas por INSERT na carga em lote.
+        bulk = False mantém a carga antiga, linha a linha com objects.create.
+
+        download_workers, timeout, retries, backoff e chunk_size configuram o downloader.
+        O timeout pode ser sobrescrito por fonte com a chave 'timeout' do sources.json.
+        manifest_file é onde fica o manifest com ETag/Last-Modified/sha256 dos arquivos em cache.
+
+        modo = "completo" grava todas as linhas em cada atualizacao. modo = "diferencial" compara
+        com a última atualizacao com SUCESSO e grava apenas as linhas inseridas/alteradas,
+        marcando as alteradas/removidas com substituido_em.
+
+        parcial = True indica que sources tem só parte das fontes: a atualizacao passa a ter como base
+        a última com SUCESSO e as fontes que não estão em sources continuam valendo por ela.
+        No modo completo as linhas herdadas de cada fonte carregada são marcadas com substituido_em
+        e trocadas pelas do CSV; no diferencial só o delta é gravado, como numa carga diferencial normal.
+
+        parse_workers > 1 executa a transformação dos CSVs (read_csv/melt/merge) em paralelo,
+        num pool de processos; a escrita no banco continua sequencial, na transação do run.
+        Só os CSVs com parse_min_bytes ou mais vão para o pool, que nem é criado se não houver nenhum.
+
+        chunk_rows lê cada CSV em blocos de chunk_rows linhas; cada bloco é transformado, gravado e
+        descartado antes do próximo, então a memória depende do tamanho do bloco e não do arquivo.
+        Na carga diferencial os blocos já transformados são juntados antes da comparação com a base.
+        Não pode ser combinado com parse_workers > 1.
+
+        origem diz de onde vêm os CSVs (ver ORIGENS). Fora de "rede" nenhuma requisição HTTP é
+        feita: o dst_file é preenchido com o test_file, com o arquivo de mesmo nome dentro de
+        arquivo (.zip ou .tar) ou, em "cache", usado como já está.
+
+        armazenamento = "compacto" grava cada linha do CSV como uma SerieCompacta, com os valores de todos
+        os anos num único campo binário, em vez de uma linha por ano nas tabelas de dados. Só existe para
+        cargas completas: as fontes não são copiadas nem herdadas de outra atualizacao."""
+        if modo not in MODOS:
+            raise ValueError(f"modo must be one of these: {','.join(MODOS)}")
+        if origem not in ORIGENS:
+            raise ValueError(f"origem must be one of these: {','.join(ORIGENS)}")
+        if origem == "arquivo" and not arquivo:
+            raise ValueError("arquivo is required when origem is 'arquivo'.")
+        if armazenamento not in ARMAZENAMENTOS:
+            raise ValueError(f"armazenamento must be one of these: {','.join(ARMAZENAMENTOS)}")
+        if armazenamento == "compacto" and (modo == "diferencial" or parcial):
+            raise ValueError("compact storage only supports full loads (modo completo, without sources selection).")
+        if chunk_rows is not None and parse_workers > 1:
+            raise ValueError("chunk_rows cannot be combined with parse_workers > 1.")
+        self.batch_size = batch_size
+        self.bulk = bulk
+        self.download_workers = download_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.manifest_file = manifest_file
+        self.modo = modo
+        self.parse_workers = parse_workers
+        self.parse_min_bytes = parse_min_bytes
+        self.chunk_rows = chunk_rows
+        self.origem = origem
+        self.arquivo = arquivo
+        self.parcial = parcial
+        self.armazenamento = armazenamento
+        #{model da dimensão: {nome: id}} dos nomes já resolvidos nesta carga
+        self.ids_dimensoes = {}
+        #{model do resumo: [DataFrames parciais]} e {tabela: classificacoes} do que já foi somado nesta carga
+        self.resumos = {}
+        self.resumidas = {}
+
+    def salvar(self, model, atualizacao:object, df:pd.DataFrame, colunas:dict, **constantes):
+        """Persiste as linhas do DataFrame já transformado no model informado.
+        1) colunas é um dict no formato {campo do model: coluna do DataFrame}
+        2) constantes são campos com o mesmo valor para todas as linhas (ex: classificacao)
+
+        Se a atualizacao tiver uma base, na carga diferencial apenas as diferenças são gravadas
+        e na carga parcial completa as linhas herdadas da base são substituídas pelas do DataFrame.
+        """
+        df, colunas, constantes = self.codificar(model, df, colunas, constantes)
+        self.acumular(model, df, colunas, constantes)
+        if self.armazenamento == "compacto":
+            return self.inserir_compacto(model, atualizacao, df, colunas, **constantes)
+        if atualizacao.base_id is not None:
+            if self.modo == "diferencial":
+                return self.salvar_diferenca(model, atualizacao, df, colunas, **constantes)
+            self.substituir(model, atualizacao, **constantes)
+        return self.inserir(model, atualizacao, df, colunas, **constantes)
+
+    def codificar(self, model, df:pd.DataFrame, colunas:dict, constantes:dict) -> tuple:
+        """Troca os nomes das dimensões (pais, produto, cultivar, classificacao) pelos ids das tabelas
+        de dimensão. Retorna df, colunas e constantes com os campos *_id no lugar dos nomes."""
+        novas, codificadas, ids = {}, {}, {}
+        for campo, coluna in colunas.items():
+            field = model._meta.get_field(campo)
+            if field.is_relation and issubclass(field.related_model, Dimensao):
+                mapa = self.ids(field.related_model, df[coluna].unique())
+                novas[field.attname] = df[coluna].map(mapa)
+                codificadas[field.attname] = field.attname
+            else:
+                codificadas[campo] = coluna
+        for campo, valor in constantes.items():
+            field = model._meta.get_field(campo)
+            if field.is_relation and issubclass(field.related_model, Dimensao):
+                ids[field.attname] = self.ids(field.related_model, [valor])[valor]
+            else:
+                ids[campo] = valor
+        return (df.assign(**novas) if novas else df), codificadas, ids
+
+    def ids(self, dimensao, nomes) -> dict:
+        """{nome: id} da dimensão, com um mapa em memória: só os nomes ainda não vistos
+        nesta carga vão ao banco, numa consulta (e numa inserção para os novos)."""
+        mapa = self.ids_dimensoes.setdefault(dimensao, {})
+        faltantes = [nome for nome in nomes if nome not in mapa]
+        if faltantes:
+            mapa.update(dimensao.objects.ids(faltantes))
+        return mapa
+
+    def acumular(self, model, df:pd.DataFrame, colunas:dict, constantes:dict):
+        """Soma com groupby a parte do DataFrame em cada resumo que usa a tabela (api.models.RESUMOS).
+        As parciais de blocos e de fontes diferentes são somadas de novo em gravar_resumos."""
+        self.resumidas.setdefault(model, set()).add(constantes.get("classificacao_id"))
+        resumos = [resumo for resumo in RESUMOS if resumo.tabelas is None or model.__name__ in resumo.tabelas]
+        if not resumos:
+            return
+        dados = pd.DataFrame({campo: df[coluna].to_numpy() for campo, coluna in colunas.items()})
+        if "subtotal" in dados:
+            #as linhas de categoria repetem a soma dos itens
+            dados = dados[~dados["subtotal"].to_numpy(dtype = bool)]
+        dados = dados.assign(tabela = model.__name__, **constantes)
+        #arredondadas como no DecimalField, para a soma bater com a das linhas gravadas
+        decimais = [field.name for field in model._meta.concrete_fields if isinstance(field, models.DecimalField)]
+        dados[decimais] = dados[decimais].round(2)
+        for resumo in resumos:
+            metricas = somas(resumo, model)
+            parcial = dados.groupby(agrupamento(resumo), as_index = False)[list(metricas)].sum()
+            self.resumos.setdefault(resumo, []).append(parcial.rename(columns = metricas))
+
+    def gravar_resumos(self, atualizacao:object, copiadas:list) -> int:
+        """Fase final da carga: junta as parciais de cada resumo e grava uma linha por grupo.
+        O que não passou por um DataFrame nesta carga é somado no banco, só para essas linhas:
+        sem base, as fontes copiadas (copiadas são as entradas delas no sources.json);
+        com base, o que a versão herda da cadeia. Retorna o número de linhas gravadas."""
+        por_tabela = {}
+        for source in copiadas:
+            classificacao = source.get('classificacao')
+            por_tabela.setdefault(apps.get_model("api", source['prod_table']), set()).add(
+                self.ids(Classificacao, [classificacao])[classificacao] if classificacao else None)
+
+        total = 0
+        for resumo in RESUMOS:
+            partes = list(self.resumos.get(resumo, []))
+            for tabela in resumo.tabelas or TABELAS:
+                model = apps.get_model("api", tabela)
+                linhas = self.restantes(model, atualizacao, por_tabela.get(model, set()))
+                if linhas is not None:
+                    partes.append(self.somar_no_banco(resumo, model, linhas))
+            partes = [parte for parte in partes if len(parte)]
+            if not partes:
+                continue
+            por = agrupamento(resumo)
+            metricas = [field.name for field in resumo._meta.concrete_fields if isinstance(field, models.DecimalField)]
+            #as tabelas sem valor_dolares ficam com ele nulo (min_count = 1), não zero
+            df = (pd.concat(partes, ignore_index = True).reindex(columns = por + metricas)
+                  .groupby(por, as_index = False)[metricas].sum(min_count = 1))
+            df[metricas] = df[metricas].round(2)
+            df = df.astype(object).where(df.notna(), None)
+            #um executemany direto das tuplas do DataFrame: montar um model por linha custava mais que o próprio INSERT
+            colunas = [field.column for field in resumo._meta.concrete_fields if field.attname in df.columns]
+            sql = (f"INSERT INTO {resumo._meta.db_table} (atualizacao_id, {', '.join(colunas)}) "
+                   f"VALUES (%s, {', '.join(['%s'] * len(colunas))})")
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, [(atualizacao.id, *linha) for linha in df[colunas].itertuples(index = False, name = None)])
+            total += len(df)
+        return total
+
+    def restantes(self, model, atualizacao:object, copiadas:set):
+        """Linhas da versão na tabela que não foram somadas por acumular, ou None se não há nenhuma.
+        copiadas são as classificacoes (None para a tabela toda) das fontes copiadas de outra atualizacao."""
+        if atualizacao.base_id is None:
+            if not copiadas:
+                return None
+            linhas = model.objects.filter(atualizacao = atualizacao)
+            return linhas if None in copiadas else linhas.filter(classificacao_id__in = copiadas)
+        somadas = self.resumidas.get(model, set())
+        if None in somadas:
+            return None
+        linhas = model.objects.da_versao(atualizacao)
+        return linhas.exclude(classificacao_id__in = somadas) if somadas else linhas
+
+    def somar_no_banco(self, resumo, model, linhas) -> pd.DataFrame:
+        """Mesma parcial do acumular, com o GROUP BY feito no banco sobre as linhas informadas."""
+        por = agrupamento(resumo)
+        metricas = somas(resumo, model)
+        if any(field.name == "subtotal" for field in model._meta.concrete_fields):
+            linhas = linhas.filter(subtotal = False)
+        #os apelidos não podem ter o nome de um campo do model
+        somado = (linhas.annotate(tabela = Value(model.__name__)).values(*por)
+                  .annotate(**{f"soma_{campo}": Sum(campo) for campo in metricas}).order_by())
+        df = pd.DataFrame.from_records(list(somado), columns = por + [f"soma_{campo}" for campo in metricas])
+        df = df.rename(columns = {f"soma_{campo}": destino for campo, destino in metricas.items()})
+        return df.astype({destino: float for destino in metricas.values()})
+
+    def substituir(self, model, atualizacao:object, **constantes) -> int:
+        """Marca com substituido_em = atualizacao as linhas vigentes na base que têm as constantes
+        da fonte (ex: a classificacao), para que a versão passe a ter só as linhas novas dela.
+        Com chunk_rows é chamado a cada bloco; as linhas já marcadas não são atualizadas de novo.
+        Retorna o número de linhas marcadas."""
+        return (model.objects.da_versao(atualizacao.base).filter(**constantes)
+                .exclude(substituido_em = atualizacao).update(substituido_em = atualizacao))
+
+    def inserir(self, model, atualizacao:object, df:pd.DataFrame, colunas:dict, **constantes) -> int:
+        """Os objetos são montados direto das colunas do DataFrame e gravados com bulk_create
+        em lotes de batch_size, evitando um INSERT por linha. Retorna o número de linhas gravadas.
+        """
+        campos = list(colunas.keys())
+        valores = zip(*[df[coluna].tolist() for coluna in colunas.values()])
+        objetos = (
+            model(atualizacao = atualizacao, **constantes, **dict(zip(campos, linha)))
+            for linha in valores
+        )
 
-    def run(self, sources: dict,atualizacao:object):
+        if not self.bulk:
+            for objeto in objetos:
+                objeto.save(force_insert = True)
+            return len(df)
+
+        #grava em lotes para que a memória não cresça com o tamanho do arquivo
+        while True:
+            lote = list(islice(objetos, self.batch_size))
+            if not lote:
+                break
+            model.objects.bulk_create(lote, batch_size = self.batch_size)
+        return len(df)
+
+    def inserir_compacto(self, model, atualizacao:object, df:pd.DataFrame, colunas:dict, **constantes) -> int:
+        """Grava o DataFrame do transform como uma SerieCompacta por linha do CSV. O transform gera as
+        linhas ano a ano, com as entidades na mesma ordem em cada ano, então os valores voltam ao formato
+        (entidade, ano, métrica) com um reshape. Retorna o número de linhas do DataFrame."""
+        if df.empty:
+            return 0
+        #as métricas vão na ordem do model, a mesma usada na leitura (api.compacto)
+        metricas = [field.name for field in model._meta.concrete_fields if isinstance(field, models.DecimalField)]
+        dimensoes = [campo for campo in colunas if campo not in metricas and campo != "ano"]
+        anos_linha = df[colunas["ano"]].to_numpy()
+        anos = pd.unique(anos_linha)
+        entidades = len(df) // len(anos)
+        if entidades * len(anos) != len(df) or not (anos_linha.reshape(len(anos), entidades) == anos[:, None]).all():
+            raise ValueError("compact storage expects the rows year by year, as produced by transform.")
+
+        valores = np.stack([df[colunas[campo]].to_numpy(dtype = float) for campo in metricas], axis = -1).round(2)
+        valores = valores.reshape(len(anos), entidades, len(metricas)).transpose(1, 0, 2)
+        #anos que faltam no intervalo ficam NaN, para que o ano de cada valor seja ano_inicial + posição
+        ano_inicial = int(anos.min())
+        series = np.full((entidades, int(anos.max()) - ano_inicial + 1, len(metricas)), np.nan)
+        series[:, anos - ano_inicial, :] = valores
+        series = series.astype("<f8")
+
+        primeiro_ano = {campo: df[colunas[campo]].to_numpy()[:entidades].tolist() for campo in dimensoes}
+        objetos = (
+            SerieCompacta(atualizacao = atualizacao, tabela = model.__name__, ano_inicial = ano_inicial,
+                          valores = series[i].tobytes(), **constantes,
+                          **{campo: primeiro_ano[campo][i] for campo in dimensoes})
+            for i in range(entidades)
+        )
+        while True:
+            lote = list(islice(objetos, self.batch_size))
+            if not lote:
+                break
+            SerieCompacta.objects.bulk_create(lote, batch_size = self.batch_size)
+        return len(df)
+
+    def salvar_diferenca(self, model, atualizacao:object, df:pd.DataFrame, colunas:dict, **constantes) -> dict:
+        """Compara o DataFrame com as linhas vigentes na atualizacao base pela chave natural
+        (produto/cultivar/pais, classificacao, ano) e grava somente o delta:
+        1) linhas novas ou com valores alterados são inseridas nesta atualizacao
+        2) linhas alteradas ou que sumiram são marcadas com substituido_em = esta atualizacao
+        Retorna a contagem de linhas inseridas, alteradas e removidas."""
+        valores = [campo for campo in colunas if isinstance(model._meta.get_field(campo), models.DecimalField)]
+        chaves = [campo for campo in colunas if campo not in valores]
+
+        novo = pd.DataFrame({campo: df[coluna].to_numpy() for campo, coluna in colunas.items()})
+        anterior = pd.DataFrame.from_records(
+            list(model.objects.da_versao(atualizacao.base).filter(**constantes).values_list("id", *colunas)),
+            columns = ["id", *colunas])
+
+        for frame in (novo, anterior):
+            for campo in valores:
+                frame[campo] = frame[campo].astype(float).round(2)
+            #chaves repetidas (ex: o mesmo produto em duas categorias) são pareadas pela ordem dos valores
+            frame.sort_values(chaves + valores, inplace = True, kind = "stable")
+            frame["ordem"] = frame.groupby(chaves).cumcount()
+
+        merged = novo.merge(anterior, on = chaves + ["ordem"], how = "outer",
+                            suffixes = ("", "_anterior"), indicator = True)
+        iguais = pd.Series(True, index = merged.index)
+        for campo in valores:
+            iguais &= merged[campo] == merged[f"{campo}_anterior"]
+        ambos = merged["_merge"] == "both"
+
+        inseridos = merged[(merged["_merge"] == "left_only") | (ambos & ~iguais)]
+        substituidos = merged.loc[(merged["_merge"] == "right_only") | (ambos & ~iguais), "id"].astype(int).tolist()
+
+        #o SQLite limita o número de parâmetros por query, então o UPDATE é feito em lotes
+        for inicio in range(0, len(substituidos), 500):
+            model.objects.filter(id__in = substituidos[inicio:inicio + 500]).update(substituido_em = atualizacao)
+        self.inserir(model, atualizacao, inseridos, {campo: campo for campo in colunas}, **constantes)
+
+        alterados = int((ambos & ~iguais).sum())
+        return {
+            "inseridos": len(inseridos) - alterados,
+            "alterados": alterados,
+            "removidos": len(substituidos) - alterados
+        }
+
+    def run(self, sources: dict,atualizacao:object,callback = None):
         """O método run está implementado tendo como premissas os seguintes fatores:
         1) Ele receberá um dict que representa o json sources conforme documentado em Readme.md
-        2) Todos os handlers indicados começam com handler.
+        2) Cada fonte traz no sources.json o layout do seu CSV, usado pelo transform (ver DefaultEmbrapaPipeline.transform).
+        3) Se informado, callback(fonte, etapa, **info) é chamado a cada mudança de etapa de uma fonte.
 
         Com essas garantias no arquivo de entrada, teremos uma implementação mais limpa do método run;
         """
+        #o progresso de cada fonte, com as métricas de quem terminou, é gravado em atualizacao.detalhes
+        inicio = time.perf_counter()
+        progresso = {}
+        #as dimensões criadas numa carga que falhou somem no rollback, então os ids não passam de uma carga para outra
+        self.ids_dimensoes = {}
+        self.resumos = {}
+        self.resumidas = {}
+
+        def notificar(fonte, etapa, **info):
+            progresso[fonte] = {"etapa": etapa, **info}
+            if callback is not None:
+                callback(fonte, etapa, **info)
+
+        def detalhes(**extra) -> str:
+            return json.dumps({"fontes": progresso, "duracao_s": round(time.perf_counter() - inicio, 4), **extra})
+
         #Executa o download atualizado de todos os arquivos conforme as especificações de URL que constam no sources.json
-        self.downloader(sources)
-        
-        #busca por todos os métodos handler que estão em sources.json.
-        handlers = [self.__getattribute__(f"handle_{x}") for x in sources]
-        
-        with transaction.atomic():
-            try:
-                for handler in handlers:
-                #busca onde está salvo o csv
-                    dst_file = sources[handler.__name__.replace("handle_","")]['dst_file']
+        status = self.downloader(sources)
+        for fonte in sources:
+            notificar(fonte, status.get(fonte, "erro"))
+        manifest = self.carregar_manifest()
+
+        #fontes inalteradas desde uma atualizacao bem sucedida são copiadas dela em vez de reprocessadas.
+        #Na carga diferencial, se essa atualizacao for a base, não há nada a gravar.
+        origens = {}
+        for fonte, entrada in manifest.items():
+            if fonte in sources and status.get(fonte) == "inalterado" and entrada.get('atualizacao'):
+                origens[fonte] = entrada['atualizacao']
+        #só as atualizacoes em linhas servem de origem das cópias e de base; a carga compacta processa todas as fontes
+        sucessos = set(Atualizacao.objects.filter(id__in = origens.values(), status = "SUCESSO", armazenamento = "linhas")
+                       .values_list("id", flat = True))
+        origens = {fonte: origem for fonte, origem in origens.items() if origem in sucessos and self.armazenamento == "linhas"}
+
+        base = None
+        if self.modo == "diferencial" or self.parcial:
+            base = (Atualizacao.objects.filter(status = "SUCESSO", armazenamento = "linhas").exclude(id = atualizacao.id)
+                    .order_by("-id").first())
+
+        #fontes que não precisam ser processadas: copiadas de uma atualizacao anterior ou inalteradas desde
+        #que foram carregadas por uma atualizacao da cadeia da base (a versão da base já tem esse conteúdo)
+        cadeia_base = base.cadeia() if base is not None else []
+        copiar = {fonte: origem for fonte, origem in origens.items() if base is None}
+        ignorar = [fonte for fonte, origem in origens.items() if origem in cadeia_base]
+
+        #com parse_workers > 1 a transformação das fontes grandes roda num pool de processos
+        #e apenas a escrita acontece aqui, dentro da transação.
+        transformacoes = {}
+        pool = None
+        paralelas = [fonte for fonte in sources if fonte not in copiar and fonte not in ignorar
+                     and tamanho(sources[fonte]['dst_file']) >= self.parse_min_bytes]
+        if self.parse_workers > 1 and paralelas:
+            pool = ProcessPoolExecutor(max_workers = self.parse_workers, mp_context = multiprocessing.get_context("spawn"),
+                                       initializer = django.setup)
+            for fonte in paralelas:
+                notificar(fonte, "processando")
+                transformacoes[fonte] = pool.submit(transformar, self, sources[fonte], sources[fonte]['dst_file'])
+        
+        if atualizacao.armazenamento != self.armazenamento:
+            atualizacao.armazenamento = self.armazenamento
+            Atualizacao.objects.filter(id = atualizacao.id).update(armazenamento = self.armazenamento)
+
+        try:
+            with transaction.atomic():
+                if base is not None:
+                    atualizacao.base = base
+                    atualizacao.save()
+
+                for fonte in sources:
+                    if fonte in copiar:
+                        print(f'[handle_{fonte}] Inalterado, copiando da atualizacao {copiar[fonte]}.')
+                        notificar(fonte, "copiando")
+                        copia = time.perf_counter()
+                        linhas = self.copiar_fonte(sources[fonte], copiar[fonte], atualizacao)
+                        notificar(fonte, "concluido", metricas = self.metricas(fonte, linhas = linhas,
+                                                                              copia_s = time.perf_counter() - copia))
+                        continue
+                    if fonte in ignorar:
+                        print(f'[handle_{fonte}] Inalterado desde a atualizacao base {atualizacao.base_id}.')
+                        notificar(fonte, "concluido")
+                        continue
+                    if fonte in transformacoes:
+                        resultado = transformacoes[fonte].result()
+                        notificar(fonte, "gravando")
+                        resultado['metricas']['insert_s'] = self.gravar(resultado, atualizacao)
+                        notificar(fonte, "concluido", limpeza = resultado['limpeza'], metricas = self.metricas(fonte, **resultado['metricas']))
+                        continue
+                    #busca onde está salvo o csv
+                    dst_file = sources[fonte]['dst_file']
                     #executa o handler passando o diretório do CSV.
-                    print(f'[handle_producao] Init. {handler.__name__.replace("handle_","")}')
-                    handler(dst_file,atualizacao)
-                    print(f'[handle_producao] Fim. {handler.__name__.replace("handle_","")}')
+                    print(f'[handle_{fonte}] Init.')
+                    notificar(fonte, "processando")
+                    resultado = self.handle(sources[fonte], dst_file, atualizacao)
+                    notificar(fonte, "concluido", limpeza = resultado['limpeza'], metricas = self.metricas(fonte, **resultado['metricas']))
+                    print(f'[handle_{fonte}] Fim.')
+                #os resumos são calculados a partir dos DataFrames já gravados, ainda dentro da transação
+                resumos = time.perf_counter()
+                self.gravar_resumos(atualizacao, [sources[fonte] for fonte in copiar])
                 atualizacao.status = "SUCESSO"
+                atualizacao.detalhes = detalhes(resumos_s = round(time.perf_counter() - resumos, 4))
                 atualizacao.save()
-            except Exception as ex:
-                print(f"Erro inesperado: {ex}")
-                atualizacao.status = "ERRO"
-                atualizacao.save()
-                raise Exception from ex
-        
-        
-    def handle_producao(self, csv_file_path:str,atualizacao:int):
-        
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        df = df.melt(id_vars=["id", "control","produto"], 
-                var_name="ano", 
-                value_name="quantidade_litros")
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_litros'] = df['quantidade_litros'].astype(float)
-        df.drop(columns=['control'])
-        for index, row in df.iterrows():
-            
-            Producao.objects.create(
-                atualizacao = atualizacao,
-                produto = row['produto'],
-                ano = row['ano'],
-                quantidade_litros = row['quantidade_litros']
-            )
-
-
-    def handle_comercializacao(self, csv_file_path:str,atualizacao:int):
-        
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        df = df.melt(id_vars=["id", "control","Produto"], 
-                var_name="ano", 
-                value_name="quantidade_litros")
-        df.columns = ['id','control','produto','ano','quantidade_litros']
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_litros'] = df['quantidade_litros'].astype(float)
-        df.drop(columns=['control'])
-        for index, row in df.iterrows():
-           
-            Comercializacao.objects.create(
-                atualizacao = atualizacao,
-                produto = row['produto'],
-                ano = row['ano'],
-                quantidade_litros = row['quantidade_litros']
-            )
-
-    def handle_exportacao_espumantes(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-   
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-    
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Exportacao.objects.create(
-                    
-                 atualizacao = atualizacao,
-                 classificacao = "espumantes",
-                 pais = row['pais'],
-                 ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                 valor_dolares =  float(row['dolares']),
-                 quantidade = row['quantidade']
-             )
-            
-            
-    def handle_exportacao_suco_de_uva(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-   
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-  
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Exportacao.objects.create(
-                    
-                 atualizacao = atualizacao,
-                 classificacao = "suco_de_uva",
-                 pais = row['pais'],
-                 ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                 valor_dolares =  float(row['dolares']),
-                 quantidade = row['quantidade']
-             )
-            
-    
-    def handle_exportacao_uvas_frescas(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-   
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-  
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Exportacao.objects.create(
-                    
-                 atualizacao = atualizacao,
-                 classificacao = "uvas_frescas",
-                 pais = row['pais'],
-                 ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                 valor_dolares =  float(row['dolares']),
-                 quantidade = row['quantidade']
-             )
-            
-    
-    def handle_exportacao_vinhos_de_mesa(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Exportacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "vinhos_de_mesa",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-            
-    
-    def handle_importacao_espumantes(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Importacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "espumantes",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-    
-    def handle_importacao_suco_de_uva(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Importacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "suco_de_uva",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-    
-    def handle_importacao_uvas_passas(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Importacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "uvas_passas",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-    
-    def handle_importacao_uvas_frescas(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
-
-        
-
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
+        except Exception as ex:
+            #o status de erro é gravado fora da transação, senão o rollback também o desfaria
+            print(f"Erro inesperado: {ex}")
+            atualizacao.status = "ERRO"
+            atualizacao.detalhes = detalhes(erro = str(ex))
+            Atualizacao.objects.filter(id = atualizacao.id).update(status = "ERRO", detalhes = atualizacao.detalhes)
+            raise Exception from ex
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+
+        #o conteúdo em cache de cada fonte passa a estar carregado nesta atualizacao
+        manifest = self.carregar_manifest()
+        for fonte in sources:
+            if fonte in manifest:
+                manifest[fonte]['atualizacao'] = atualizacao.id
+        self.salvar_manifest(manifest)
+        
+        
+    def resultado(self, model, df:pd.DataFrame, colunas:dict, **constantes) -> dict:
+        """Resultado da fase de transformação de uma fonte, só com as colunas que vão para o banco.
+        1) colunas é um dict no formato {campo do model: coluna do DataFrame}
+        2) constantes são campos com o mesmo valor para todas as linhas (ex: classificacao)
+
+        É um dict simples para que possa voltar de um processo do pool de transformação."""
+        return {
+            "prod_table": model.__name__,
+            "df": pd.DataFrame({campo: df[coluna].to_numpy() for campo, coluna in colunas.items()}),
+            "constantes": constantes
+        }
+
+    def gravar(self, resultado:dict, atualizacao:object) -> float:
+        """Fase de escrita de uma fonte: grava o resultado da transformação no banco.
+        Retorna o tempo gasto, em segundos."""
+        inicio = time.perf_counter()
+        df = resultado['df']
+        self.salvar(apps.get_model("api", resultado['prod_table']), atualizacao, df,
+                    {campo: campo for campo in df.columns}, **resultado['constantes'])
+        return time.perf_counter() - inicio
+
+    def metricas(self, fonte:str, **medidas) -> dict:
+        """Métricas de uma fonte para o atualizacao.detalhes: download (tempo e bytes) somado às
+        medidas da carga (tempos em segundos por etapa e linhas) e às linhas por segundo da carga."""
+        metricas = {**getattr(self, "downloads", {}).get(fonte, {}), **medidas}
+        carga = sum(valor for chave, valor in medidas.items() if chave.endswith("_s"))
+        metricas['linhas_por_s'] = metricas.get('linhas', 0) / carga if carga else None
+        return {chave: round(valor, 4) if isinstance(valor, float) else valor for chave, valor in metricas.items()}
+
+    def handle(self, source:dict, csv_file_path:str, atualizacao:object) -> dict:
+        """Transforma e grava uma fonte. Retorna o resultado da transformação;
+        com chunk_rows o df não é guardado e o resultado traz só a limpeza somada dos blocos."""
+        if self.chunk_rows is None:
+            resultado = self.transform(source, csv_file_path)
+            resultado['metricas']['insert_s'] = self.gravar(resultado, atualizacao)
+            return resultado
+
+        #o read_csv com chunksize gera ao menos um bloco, mesmo para um CSV só com o cabeçalho
+        limpeza, metricas, partes = None, None, []
+        for bloco in self.transform_em_blocos(source, csv_file_path):
+            if self.modo == "diferencial" and atualizacao.base_id is not None:
+                #a diferença precisa da fonte inteira para achar as linhas removidas
+                partes.append(bloco['df'])
+            else:
+                bloco['metricas']['insert_s'] = self.gravar(bloco, atualizacao)
+                #com DEBUG o Django guarda o SQL de cada INSERT, e fora de um request ninguém limpa esse log
+                reset_queries()
+            limpeza = bloco['limpeza'] if limpeza is None else somar_limpeza(limpeza, bloco['limpeza'])
+            metricas = bloco['metricas'] if metricas is None else somar_metricas(metricas, bloco['metricas'])
+            resultado = {**bloco, "df": None, "limpeza": limpeza, "metricas": metricas}
+        if partes:
+            resultado['metricas']['insert_s'] = self.gravar({**resultado, "df": pd.concat(partes, ignore_index = True)}, atualizacao)
+        return resultado
+
+    def transform(self, source:dict, csv_file_path:str) -> dict:
+        """Transformação única dos CSVs da EMBRAPA, guiada pela entrada da fonte no sources.json:
+        1) delimiter: separador do CSV
+        2) dimensoes: {campo do model: coluna do CSV} das colunas que identificam a linha
+        3) valores: campos preenchidos pelas colunas de ano, na ordem em que se repetem em cada
+           ano (ex: ["quantidade", "valor_dolares"] para as colunas 1970;1970.1)
+        4) prod_table e classificacao: model de destino e valor gravado em todas as linhas
+        5) sentinelas: {marcador: valor} dos textos aceitos no lugar de números, padrão SENTINELAS
+
+        O CSV largo (uma coluna por ano) vira uma linha por (entidade, ano) num único reshape do
+        array de valores, sem melt nem merge. As linhas saem na mesma ordem do melt, ano a ano.
+        """
+        inicio = time.perf_counter()
+        df = pd.read_csv(csv_file_path, delimiter = source.get('delimiter', ";"))
+        return self.reshape(source, df, csv_file_path, read_csv_s = time.perf_counter() - inicio)
+
+    def transform_em_blocos(self, source:dict, csv_file_path:str):
+        """Mesmo que o transform, mas lendo o CSV em blocos de chunk_rows linhas;
+        gera um resultado por bloco, cada um na ordem ano a ano."""
+        leitor = pd.read_csv(csv_file_path, delimiter = source.get('delimiter', ";"), chunksize = self.chunk_rows)
+        with leitor:
+            #um bloco à frente: a última linha de categoria de um bloco só é subtotal se o próximo começa com um item
+            inicio = time.perf_counter()
+            df = next(leitor, None)
+            while df is not None:
+                read_csv_s = time.perf_counter() - inicio
+                inicio = time.perf_counter()
+                proximo = next(leitor, None)
+                yield self.reshape(source, df, csv_file_path, read_csv_s = read_csv_s + time.perf_counter() - inicio, proximo = proximo)
+                inicio = time.perf_counter()
+                df = proximo
+
+    def categorias(self, source:dict, df:pd.DataFrame):
+        """Linhas com control igual ao nome, ou None se o CSV não tem a coluna control."""
+        if COLUNA_CONTROL not in df.columns:
+            return None
+        nome = df[next(iter(source['dimensoes'].values()))].astype(str).str.strip()
+        return (df[COLUNA_CONTROL].astype(str).str.strip() == nome).to_numpy()
+
+    def subtotais(self, source:dict, df:pd.DataFrame, proximo:pd.DataFrame = None):
+        """Linhas de categoria seguidas de ao menos um item: o valor delas é a soma dos itens.
+        Uma categoria sem itens (ex: Sem classificação) é uma linha como as outras.
+        proximo é o bloco seguinte do CSV (chunk_rows), se houver. None se o CSV não tem control."""
+        categoria = self.categorias(source, df)
+        if categoria is None:
+            return None
+        seguinte = self.categorias(source, proximo) if proximo is not None and len(proximo) else None
+        item_depois = np.append(~categoria[1:], seguinte is not None and not seguinte[0])
+        return categoria & item_depois
+
+    def reshape(self, source:dict, df:pd.DataFrame, csv_file_path:str, read_csv_s:float = 0, proximo:pd.DataFrame = None) -> dict:
+        """Fase de transformação do transform sobre um DataFrame já lido do CSV.
+        O resultado traz em 'metricas' os tempos de read_csv e do reshape e as linhas geradas."""
+        inicio = time.perf_counter()
+        campos = source['valores']
+        colunas_ano = [coluna for coluna in df.columns if COLUNA_ANO.match(str(coluna))]
+        if not colunas_ano or len(colunas_ano) % len(campos):
+            raise ValueError(f"{csv_file_path}: expected {len(campos)} columns per year, got {len(colunas_ano)} year columns.")
+        #as colunas de um mesmo ano ficam lado a lado: 1970;1970.1;1971;1971.1...
+        anos = []
+        for i in range(0, len(colunas_ano), len(campos)):
+            grupo = {COLUNA_ANO.match(str(coluna)).group(1) for coluna in colunas_ano[i:i + len(campos)]}
+            if len(grupo) != 1:
+                raise ValueError(f"{csv_file_path}: columns {colunas_ano[i:i + len(campos)]} are not from the same year.")
+            anos.append(int(grupo.pop()))
+
+        linhas, n_anos = len(df), len(anos)
+        valores, limpeza = self.limpar(df[colunas_ano], source.get('sentinelas', SENTINELAS))
+        if limpeza['sentinelas'] or limpeza['invalidos']:
+            print(f"{csv_file_path}: {limpeza}")
+        valores = valores.reshape(linhas, n_anos, len(campos)).transpose(1, 0, 2).reshape(linhas * n_anos, len(campos))
+
+        dados = {campo: np.tile(df[coluna].to_numpy(), n_anos) for campo, coluna in source['dimensoes'].items()}
+        dados['ano'] = np.repeat(anos, linhas)
+        for i, campo in enumerate(campos):
+            dados[campo] = valores[:, i]
+        subtotal = self.subtotais(source, df, proximo)
+        if subtotal is not None:
+            dados['subtotal'] = np.tile(subtotal, n_anos)
+
+        constantes = {"classificacao": source['classificacao']} if source.get('classificacao') else {}
+        resultado = self.resultado(apps.get_model("api", source['prod_table']), pd.DataFrame(dados),
+                                   {campo: campo for campo in dados}, **constantes)
+        resultado['limpeza'] = limpeza
+        resultado['metricas'] = {
+            "read_csv_s": read_csv_s,
+            "reshape_s": time.perf_counter() - inicio,
+            "linhas": len(resultado['df'])
+        }
+        return resultado
+
+    def limpar(self, valores:pd.DataFrame, sentinelas:dict) -> tuple:
+        """Converte as colunas de ano para números com um único pd.to_numeric sobre todas as células.
+        Células vazias viram 0, os marcadores de sentinelas viram o valor configurado e qualquer
+        outro texto vira 0 e é contado como inválido.
+        Retorna (array de floats com o formato de valores, relatório com a contagem de cada caso)."""
+        bruto = valores.to_numpy(dtype = object)
+        celulas = pd.Series(bruto.ravel())
+        numeros = pd.to_numeric(celulas, errors = "coerce").to_numpy(dtype = float, copy = True)
+        vazios = celulas.isna().to_numpy()
+        coagidos = np.isnan(numeros) & ~vazios
+        relatorio = {
+            "celulas": int(bruto.size),
+            "vazios": int(vazios.sum()),
+            "sentinelas": {},
+            "invalidos": 0
+        }
+        if coagidos.any():
+            #só as células que não são números passam pela comparação de texto
+            marcadores = celulas[coagidos].astype(str).str.strip()
+            substitutos = marcadores.map(sentinelas)
+            conhecidos = marcadores.isin(list(sentinelas))
+            relatorio["sentinelas"] = {str(marcador): int(n) for marcador, n in marcadores[conhecidos].value_counts().items()}
+            relatorio["invalidos"] = int((~conhecidos).sum())
+            numeros[coagidos] = substitutos.to_numpy(dtype = float)
+        numeros[np.isnan(numeros)] = 0
+        return numeros.reshape(bruto.shape), relatorio
+
+    def criar_sessao(self) -> requests.Session:
+        """Cria a sessão HTTP compartilhada pelos downloads. O pool de conexões
+        tem o tamanho do número de workers, assim cada thread reaproveita a sua conexão."""
+        sessao = requests.Session()
+        adapter = HTTPAdapter(pool_connections = self.download_workers, pool_maxsize = self.download_workers)
+        sessao.mount("http://", adapter)
+        sessao.mount("https://", adapter)
+        return sessao
+
+    def carregar_manifest(self) -> dict:
+        """Lê o manifest do cache. Para cada fonte ele guarda etag, last_modified,
+        content_length e sha256 do arquivo em cache e o id da última atualizacao
+        que carregou com sucesso esse conteúdo."""
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file, encoding = "utf-8") as f:
+            return json.load(f)
+
+    def salvar_manifest(self, manifest:dict):
+        """Grava o manifest de forma atômica, via arquivo temporário + rename."""
+        diretorio = os.path.dirname(self.manifest_file) or "."
+        os.makedirs(diretorio, exist_ok = True)
+        with tempfile.NamedTemporaryFile("w", dir = diretorio, suffix = ".part", delete = False, encoding = "utf-8") as f:
+            json.dump(manifest, f, indent = 4)
+        os.replace(f.name, self.manifest_file)
+
+    def baixar_fonte(self, sessao:requests.Session, source:dict, entrada:dict) -> tuple:
+        """Baixa uma fonte fazendo streaming do conteúdo para um arquivo temporário
+        no mesmo diretório do destino, que só é renomeado para dst_file quando o download termina.
+        Em caso de falha tenta novamente até retries vezes, com backoff exponencial.
+
+        Se o arquivo já está em cache, a requisição é condicional (If-None-Match/If-Modified-Since).
+        Um 304, ou um conteúdo com o mesmo sha256 do manifest, retorna o status 'inalterado'.
+        Retorna a tupla (status, nova entrada do manifest)."""
+        url = source['url']
+        prod_file = source['dst_file']
+        timeout = source.get('timeout', self.timeout)
+        diretorio = os.path.dirname(prod_file) or "."
+
+        headers = {}
+        em_cache = os.path.exists(prod_file) and entrada.get('sha256')
+        if em_cache:
+            if entrada.get('etag'):
+                headers['If-None-Match'] = entrada['etag']
+            if entrada.get('last_modified'):
+                headers['If-Modified-Since'] = entrada['last_modified']
+
+        for tentativa in range(self.retries + 1):
+            tmp_file = None
+            try:
+                with sessao.get(url, stream = True, timeout = timeout, headers = headers) as response:
+                    if em_cache and response.status_code == 304:
+                        return "inalterado", entrada
+                    response.raise_for_status()
+                    sha256 = hashlib.sha256()
+                    content_length = 0
+                    with tempfile.NamedTemporaryFile(dir = diretorio, suffix = ".part", delete = False) as csv_file:
+                        tmp_file = csv_file.name
+                        for chunk in response.iter_content(chunk_size = self.chunk_size):
+                            csv_file.write(chunk)
+                            sha256.update(chunk)
+                            content_length += len(chunk)
+                    nova_entrada = {
+                        "url": url,
+                        "etag": response.headers.get('ETag'),
+                        "last_modified": response.headers.get('Last-Modified'),
+                        "content_length": content_length,
+                        "sha256": sha256.hexdigest(),
+                        "atualizacao": None
+                    }
+                if em_cache and nova_entrada['sha256'] == entrada['sha256']:
+                    os.remove(tmp_file)
+                    nova_entrada['atualizacao'] = entrada.get('atualizacao')
+                    return "inalterado", nova_entrada
+                os.replace(tmp_file, prod_file)
+                return "baixado", nova_entrada
+            except requests.RequestException as ex:
+                #erros 4xx não se resolvem tentando de novo
+                erro_do_cliente = ex.response is not None and ex.response.status_code < 500
+                if tentativa == self.retries or erro_do_cliente:
+                    raise
+                espera = self.backoff * (2 ** tentativa)
+                print(f"File {prod_file} download failed ({ex}). Retrying in {espera}s")
+                time.sleep(espera)
+            finally:
+                #qualquer falha (rede, disco cheio, interrupção) não deixa o .part para trás
+                if tmp_file and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+    def carregar_local(self, source:dict, entrada:dict) -> tuple:
+        """Equivalente ao baixar_fonte para as origens sem rede. O conteúdo é copiado para um
+        arquivo temporário ao lado do dst_file e comparado pelo sha256 com o manifest, como
+        no download: o mesmo conteúdo retorna 'inalterado' e a entrada atual do manifest.
+        Retorna a tupla (status, nova entrada do manifest)."""
+        prod_file = source['dst_file']
+        diretorio = os.path.dirname(prod_file) or "."
+
+        if self.origem == "cache":
+            if not os.path.exists(prod_file):
+                raise FileNotFoundError(f"{prod_file} is not in the cache.")
+            tmp_file, url = None, prod_file
+        else:
+            with tempfile.NamedTemporaryFile(dir = diretorio, suffix = ".part", delete = False) as csv_file:
+                tmp_file = csv_file.name
+                try:
+                    if self.origem == "teste":
+                        url = source['test_file']
+                        with open(url, "rb") as origem:
+                            shutil.copyfileobj(origem, csv_file, self.chunk_size)
+                    else:
+                        url = self.extrair(os.path.basename(prod_file), csv_file)
+                except Exception:
+                    csv_file.close()
+                    os.remove(tmp_file)
+                    raise
+
+        sha256 = hashlib.sha256()
+        with open(tmp_file or prod_file, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                sha256.update(chunk)
+        if os.path.exists(prod_file) and sha256.hexdigest() == entrada.get('sha256'):
+            if tmp_file:
+                os.remove(tmp_file)
+            return "inalterado", entrada
+
+        #etag e last_modified ficam vazios: eles descreviam o conteúdo da url, não este
+        nova_entrada = {
+            "url": url,
+            "etag": None,
+            "last_modified": None,
+            "content_length": os.path.getsize(tmp_file or prod_file),
+            "sha256": sha256.hexdigest(),
+            "atualizacao": None
+        }
+        if tmp_file:
+            os.replace(tmp_file, prod_file)
+        return "baixado", nova_entrada
+
+    def extrair(self, nome:str, destino) -> str:
+        """Copia para destino o membro com o nome informado (em qualquer pasta) do arquivo
+        .zip ou .tar(.gz) em self.arquivo e retorna o caminho dele, no formato arquivo!membro."""
+        if zipfile.is_zipfile(self.arquivo):
+            with zipfile.ZipFile(self.arquivo) as pacote:
+                membro = next((m for m in pacote.namelist() if os.path.basename(m) == nome), None)
+                if membro is not None:
+                    with pacote.open(membro) as origem:
+                        shutil.copyfileobj(origem, destino, self.chunk_size)
+        else:
+            with tarfile.open(self.arquivo) as pacote:
+                membro = next((m.name for m in pacote.getmembers() if m.isfile() and os.path.basename(m.name) == nome), None)
+                if membro is not None:
+                    with pacote.extractfile(membro) as origem:
+                        shutil.copyfileobj(origem, destino, self.chunk_size)
+        if membro is None:
+            raise FileNotFoundError(f"{nome} not found in {self.arquivo}.")
+        return f"{self.arquivo}!{membro}"
+
+    def downloader(self,sources:dict) -> dict:
+        """O objetivo deste método é realizar o download das fontes de dados do Emprapa
+        para o cache. Com origem diferente de "rede" os arquivos vêm de carregar_local.
+        Os downloads são feitos em paralelo, limitados a download_workers simultâneos,
+        e retorna um dict {fonte: status} em que status é 'baixado', 'inalterado' ou 'erro'.
+        O manifest do cache é atualizado ao final.
+        O tempo e o tamanho do arquivo de cada fonte ficam em self.downloads."""
 
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            
-            Importacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "uvas_frescas",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-    
-    def handle_importacao_vinhos_de_mesa(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        
-        df_quantidade = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[ x for x in df.columns[2:] if not ".1" in x ],
-                var_name="ano", 
-                value_name="quantidade")
+        for source in sources.values():
+            os.makedirs(os.path.dirname(source['dst_file']) or ".", exist_ok = True)
 
-        
+        manifest = self.carregar_manifest()
+        status = {}
+        self.downloads = {}
 
-        df_dolares = df.melt(
-                id_vars=["Id", "País"], 
-                value_vars=[x for x in df.columns[2:] if  ".1" in x],
-                var_name="ano", 
-                value_name="dolares")
-        
-        
-        
-        df_merged = pd.merge(df_quantidade, df_dolares, on = ["Id", "País","ano"],how='left')
-        df_merged.rename(
-            columns = 
-            {
-                "Id":"id",
-                "País":"pais"
-            },inplace=True
-        )
-        df_merged = df_merged.fillna(
-            {
-                "quantidade":0,
-                "dolares":0
-            }
-        )
-        for index, row in df_merged.iterrows():
-            Importacao.objects.create(
-                    
-                    atualizacao = atualizacao,
-                    classificacao = "vinhos_de_mesa",
-                    pais = row['pais'],
-                    ano = int(row['ano'].replace(".1","") if '.1' in row['ano'] else row["ano"]),
-                    valor_dolares =  float(row['dolares']),
-                    quantidade = row['quantidade']
-                )
-
-    
-    def handle_processamento_americanas(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = "\t")
-        df = df.melt(id_vars=["id", "control","cultivar"], 
-                var_name="ano", 
-                value_name="quantidade_kg")
-        df['quantidade_kg'] = df['quantidade_kg'].astype(str)
-        df['quantidade_kg'] = df['quantidade_kg'].apply(lambda x : 0 if not x.isdigit() else x)
-        
-        df.fillna({
-            "quantidade_kg":0
-        })
-        
-        
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_kg'] = df['quantidade_kg'].astype(float)
-        df.drop(columns=['control'])
-        
-        
-        for index, row in df.iterrows():
-            
-            Processamento.objects.create(
-                atualizacao = atualizacao,
-                classificacao = "americanas",
-                cultivar = row['cultivar'],
-                ano = row['ano'],
-                quantidade_kg = row['quantidade_kg']
-            )
-    
-    def handle_processamento_mesa(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = "\t")
-        df = df.melt(id_vars=["id", "control","cultivar"], 
-                var_name="ano", 
-                value_name="quantidade_kg")
-        df['quantidade_kg'] = df['quantidade_kg'].astype(str)
-        df['quantidade_kg'] = df['quantidade_kg'].apply(lambda x : 0 if not x.isdigit() else x)
-        
-        df.fillna({
-            "quantidade_kg":0
-        })
-        
-        
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_kg'] = df['quantidade_kg'].astype(float)
-        df.drop(columns=['control'])
-        
-        
-        for index, row in df.iterrows():
-            
-            Processamento.objects.create(
-                atualizacao = atualizacao,
-                classificacao = "mesa",
-                cultivar = row['cultivar'],
-                ano = row['ano'],
-                quantidade_kg = row['quantidade_kg']
-            )
-    
-    def handle_processamento_sem_classificacao(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = "\t")
-        df = df.melt(id_vars=["id", "control","cultivar"], 
-                var_name="ano", 
-                value_name="quantidade_kg")
-        df['quantidade_kg'] = df['quantidade_kg'].astype(str)
-        df['quantidade_kg'] = df['quantidade_kg'].apply(lambda x : 0 if not x.isdigit() else x)
-        
-        df.fillna({
-            "quantidade_kg":0
-        })
-        
-        
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_kg'] = df['quantidade_kg'].astype(float)
-        df.drop(columns=['control'])
-        
-        
-        for index, row in df.iterrows():
-            
-            Processamento.objects.create(
-                atualizacao = atualizacao,
-                classificacao = "sem_classificacao",
-                cultivar = row['cultivar'],
-                ano = row['ano'],
-                quantidade_kg = row['quantidade_kg']
-            )
-    
-    def handle_processamento_viniferas(self, csv_file_path:str,atualizacao:int):
-        df = pd.read_csv(csv_file_path, delimiter = ";")
-        df = df.melt(id_vars=["id", "control","cultivar"], 
-                var_name="ano", 
-                value_name="quantidade_kg")
-        df['quantidade_kg'] = df['quantidade_kg'].astype(str)
-        df['quantidade_kg'] = df['quantidade_kg'].apply(lambda x : 0 if not x.isdigit() else x)
-        
-        df.fillna({
-            "quantidade_kg":0
-        })
-        
-        
-        df['ano'] = df['ano'].astype(int)
-        df['quantidade_kg'] = df['quantidade_kg'].astype(float)
-        df.drop(columns=['control'])
-        
-        
-        for index, row in df.iterrows():
-            
-            Processamento.objects.create(
-                atualizacao = atualizacao,
-                classificacao = "viniferas",
-                cultivar = row['cultivar'],
-                ano = row['ano'],
-                quantidade_kg = row['quantidade_kg']
-            )
-
-    def downloader(self,sources:dict):
-        """O objetivo deste método é realizar o download das fontes de dados do Emprapa
-        para o cache."""
-        
-        if not os.path.exists("./cache"):
-            os.makedirs("./cache")
-        
-        #percorre todas as chaves do json cuja a chave é sources
-        for source in sources.keys():
+        def baixar(sessao, source):
+            inicio = time.perf_counter()
             try:
-                #O url onde está localizado o arquivo csv
-                url = sources[source]['url']
-                #prod_file define onde será salvo o arquivo csv
+                if self.origem != "rede":
+                    return self.carregar_local(sources[source], manifest.get(source, {}))
+                return self.baixar_fonte(sessao, sources[source], manifest.get(source, {}))
+            finally:
+                dst_file = sources[source]['dst_file']
+                self.downloads[source] = {
+                    "download_s": round(time.perf_counter() - inicio, 4),
+                    "bytes": os.path.getsize(dst_file) if os.path.exists(dst_file) else 0
+                }
+
+        with self.criar_sessao() as sessao, ThreadPoolExecutor(max_workers = self.download_workers) as executor:
+            futures = {executor.submit(baixar, sessao, source): source for source in sources.keys()}
+            for future in as_completed(futures):
+                source = futures[future]
                 prod_file = sources[source]['dst_file']
-
-                print(f"File {prod_file} download started")
-                #Utiliza a lib requests para buscar o conteudo csv
-                content = requests.get(url).content
-                print(f"File {prod_file} download finished")
-
-                #salva o arquivo no diretorio informado por prod_file
-                with open(prod_file,"wb") as csv_file:
-                    csv_file.write(content)
-                    print(f"File {prod_file} successfully saved")
-
-            #Caso ocorra algum erro ao salvar o arquivo, este é informado.
-            except Exception as ex:
-                print(f"Unexpected Error: {ex}")
-
-def run(atualizacao):
+                try:
+                    status[source], manifest[source] = future.result()
+                    print(f"File {prod_file} {status[source]}")
+                #Caso ocorra algum erro ao salvar o arquivo, este é informado.
+                except Exception as ex:
+                    status[source] = "erro"
+                    print(f"Unexpected Error: {ex}")
+        self.salvar_manifest(manifest)
+        return status
+
+    def copiar_fonte(self, source:dict, origem:int, atualizacao:object):
+        """Copia, direto no banco com INSERT ... SELECT, as linhas de uma fonte inalterada
+        da atualizacao origem para a atualizacao atual, sem baixar nem processar o CSV.
+        Retorna o número de linhas copiadas."""
+        model = apps.get_model("api", source['prod_table'])
+        colunas = [f.column for f in model._meta.concrete_fields
+                   if not f.primary_key and f.name not in ("atualizacao", "substituido_em")]
+        tabela = model._meta.db_table
+        #se a origem for diferencial, as linhas vigentes estão espalhadas pela cadeia dela
+        cadeia = Atualizacao.objects.get(id = origem).cadeia()
+        marcadores = ", ".join(["%s"] * len(cadeia))
+        sql = (f"INSERT INTO {tabela} (atualizacao_id, {', '.join(colunas)}) "
+               f"SELECT %s, {', '.join(colunas)} FROM {tabela} "
+               f"WHERE atualizacao_id IN ({marcadores}) "
+               f"AND (substituido_em_id IS NULL OR substituido_em_id NOT IN ({marcadores}))")
+        params = [atualizacao.id, *cadeia, *cadeia]
+        if source.get('classificacao'):
+            sql += f" AND {model._meta.get_field('classificacao').column} = %s"
+            params.append(self.ids(Classificacao, [source['classificacao']])[source['classificacao']])
+        #mantém nas cópias a ordem das linhas da origem
+        sql += " ORDER BY id"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+def agrupamento(resumo) -> list:
+    """Colunas de agrupamento de um resumo, com o *_id no lugar das dimensões."""
+    return [resumo._meta.get_field(campo).attname for campo in resumo.por]
+
+
+def somas(resumo, model) -> dict:
+    """{métrica da tabela: campo do resumo em que ela é somada}. As quantidades (quantidade_kg...)
+    vão para quantidade quando o resumo não tem um campo com o mesmo nome."""
+    campos = {field.name for field in resumo._meta.concrete_fields}
+    resultado = {}
+    for field in model._meta.concrete_fields:
+        if not isinstance(field, models.DecimalField):
+            continue
+        destino = field.name if field.name in campos or not field.name.startswith("quantidade") else "quantidade"
+        if destino in campos:
+            resultado[field.name] = destino
+    return resultado
+
+
+def somar_limpeza(total:dict, parcial:dict) -> dict:
+    """Soma dois relatórios de limpeza (DefaultEmbrapaPipeline.limpar), ex: de blocos do mesmo CSV."""
+    sentinelas = dict(total['sentinelas'])
+    for marcador, n in parcial['sentinelas'].items():
+        sentinelas[marcador] = sentinelas.get(marcador, 0) + n
+    return {
+        "celulas": total['celulas'] + parcial['celulas'],
+        "vazios": total['vazios'] + parcial['vazios'],
+        "sentinelas": sentinelas,
+        "invalidos": total['invalidos'] + parcial['invalidos']
+    }
+
+
+def somar_metricas(total:dict, parcial:dict) -> dict:
+    """Soma as métricas (tempos e linhas) de blocos do mesmo CSV."""
+    return {chave: total.get(chave, 0) + parcial.get(chave, 0) for chave in {**total, **parcial}}
+
+
+def tamanho(caminho:str) -> int:
+    """Tamanho do arquivo em bytes, 0 se ele não existe (o erro aparece no transform)."""
+    try:
+        return os.path.getsize(caminho)
+    except OSError:
+        return 0
+
+
+def transformar(pipeline:DefaultEmbrapaPipeline, source:dict, csv_file_path:str) -> dict:
+    """Executa a fase de transformação de uma fonte. Fica no nível do módulo
+    para poder ser enviada ao pool de processos do run."""
+    return pipeline.transform(source, csv_file_path)
+
+
+def carregar_sources(fontes:list = None) -> dict:
+    """Lê o sources.json. fontes limita o resultado às fontes cujo nome casa com algum dos
+    padrões informados (ex: ["producao", "exportacao_*"]); um padrão sem fonte é um erro."""
     with open("sources.json") as f:
         sources = json.load(f)['sources']
-        DefaultEmbrapaPipeline().run(sources,atualizacao)
+    if fontes is None:
+        return sources
+    for padrao in fontes:
+        if not fnmatch.filter(sources, padrao):
+            raise ValueError(f"no source matches '{padrao}'. Sources: {','.join(sources)}")
+    return {fonte: source for fonte, source in sources.items()
+            if any(fnmatch.fnmatchcase(fonte, padrao) for padrao in fontes)}
+
+
+def run(atualizacao, callback = None, fontes:list = None, **opcoes):
+    """fontes limita a carga a algumas fontes (ver carregar_sources), numa carga parcial que
+    herda as demais da última atualizacao com SUCESSO.
+    opcoes são repassadas ao DefaultEmbrapaPipeline (ex: modo = "diferencial")."""
+    sources = carregar_sources(fontes)
+    DefaultEmbrapaPipeline(parcial = fontes is not None, **opcoes).run(sources,atualizacao,callback)
 
 
@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import hashlib
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -61,6 +63,18 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Número de atualizações executadas em paralelo pelo pool de api/jobs.py.
+# Com SQLite só existe um escritor por vez, então o padrão é 1.
+INGESTAO_WORKERS = int(os.environ.get("INGESTAO_WORKERS", 1))
+
+# Linhas de CSV lidas por vez na carga (DefaultEmbrapaPipeline chunk_rows); vazio lê o arquivo inteiro.
+INGESTAO_CHUNK_ROWS = int(os.environ["INGESTAO_CHUNK_ROWS"]) if os.environ.get("INGESTAO_CHUNK_ROWS") else None
+
+# De onde a carga obtém os CSVs (scripts.ORIGENS): rede, cache, teste ou arquivo.
+# Com "arquivo", INGESTAO_ARQUIVO é o .zip/.tar com os CSVs já baixados.
+INGESTAO_ORIGEM = os.environ.get("INGESTAO_ORIGEM", "rede")
+INGESTAO_ARQUIVO = os.environ.get("INGESTAO_ARQUIVO") or None
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API Tech Challenge 01',
     'DESCRIPTION': 'Documentação da API referente ao TechChallenge 01',
@@ -90,10 +104,29 @@ WSGI_APPLICATION = 'web.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# O SQLite roda em WAL: a carga escreve no log enquanto as leituras continuam vendo a última versão
+# confirmada, sem esperar a transação do run terminar. As escritas das cargas esperam a trava até
+# SQLITE_TIMEOUT segundos; as feitas numa requisição (criar ou deletar uma atualizacao) só até
+# SQLITE_TIMEOUT_REQUISICAO, e depois disso a API responde 503. transaction_mode IMMEDIATE pega o lock de
+# escrita no início da transação, evitando o "database is locked" de quem começou lendo e depois tentou escrever.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -32000,
+}
+SQLITE_TIMEOUT = float(os.environ.get("SQLITE_TIMEOUT", 60))
+SQLITE_TIMEOUT_REQUISICAO = float(os.environ.get("SQLITE_TIMEOUT_REQUISICAO", 2))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': "".join(f"PRAGMA {nome}={valor};" for nome, valor in SQLITE_PRAGMAS.items()),
+            'transaction_mode': "IMMEDIATE",
+            'timeout': SQLITE_TIMEOUT,
+        },
     }
 }
 
@@ -139,4 +172,32 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-STATIC_ROOT = os.path.join(BASE_DIR, "static")
\ No newline at end of file
+STATIC_ROOT = os.path.join(BASE_DIR, "static")
+# Cache das respostas de leitura de atualizações finalizadas (api/cache.py).
+# O padrão grava em arquivos num diretório que todos os processos da máquina compartilham, então
+# a geração usada pelo invalidar() e o andamento das cargas (api/jobs.py) valem para todos os workers.
+# Com a API em mais de uma máquina, CACHE_RESPOSTAS_BACKEND/LOCATION devem apontar para um cache
+# compartilhado entre elas (ex: DatabaseCache ou Redis); um LocMemCache só serve para um processo.
+# O diretório padrão tem um subdiretório por banco, para que dois projetos (ou um banco de teste)
+# na mesma máquina não sirvam as respostas nem limpem o cache um do outro.
+# O total em disco é limitado por CACHE_RESPOSTAS_TOTAL_BYTES (as entradas mais antigas saem primeiro)
+# e respostas maiores que CACHE_RESPOSTA_MAX_BYTES não são guardadas.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "respostas": {
+        "BACKEND": os.environ.get("CACHE_RESPOSTAS_BACKEND", "api.cache.ArquivosLimitados"),
+        "LOCATION": os.environ.get("CACHE_RESPOSTAS_LOCATION", os.path.join(
+            tempfile.gettempdir(), "tech_challenge_respostas", hashlib.sha256(str(DATABASES["default"]["NAME"]).encode()).hexdigest()[:16])),
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("CACHE_RESPOSTAS_MAX_ENTRIES", 256)),
+        },
+    },
+}
+CACHE_RESPOSTAS_TOTAL_BYTES = int(os.environ.get("CACHE_RESPOSTAS_TOTAL_BYTES", 512 * 1024 * 1024))
+CACHE_RESPOSTA_MAX_BYTES = int(os.environ.get("CACHE_RESPOSTA_MAX_BYTES", 32 * 1024 * 1024))
+# Índices em memória do endpoint serie/ (api/series.py), um por atualização e tabela, por processo;
+# ao passar de SERIES_INDICES_MAX o menos usado é descartado.
+SERIES_INDICES_MAX = int(os.environ.get("SERIES_INDICES_MAX", 16))